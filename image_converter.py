@@ -1,11 +1,57 @@
+import sys
+
+from optimagegen.cli import is_cli_invocation
+
+if __name__ == "__main__" and is_cli_invocation(sys.argv[1:]):
+    # Пакетный режим запускается до импорта Tkinter, чтобы не тратить на него время и не требовать дисплея
+    from optimagegen.cli import main as cli_main
+    sys.exit(cli_main(sys.argv[1:]))
+
+import copy
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
-from PIL import Image
 import threading
 import queue
 
+from optimagegen.engine import (
+    ConversionOptions,
+    available_cpus,
+    build_img_tag,
+    convert_images,
+    output_filename,
+    parse_widths,
+    plan_outputs,
+    source_base_name,
+)
+from optimagegen.metadata import open_metadata
+from optimagegen.output import CODE_FILENAME, INDEX_FILENAME
+from optimagegen.placeholder import PLACEHOLDER_KINDS
+from optimagegen.preview import (
+    PREVIEW_CHUNK,
+    PREVIEW_DEBOUNCE_MS,
+    UPDATE_BATCH,
+    PathChecks,
+    PreviewModel,
+    format_stats,
+)
+from optimagegen.quality import QualityTarget
+from optimagegen.resize import resolve_widths
+from optimagegen.sources import iter_sources
+
+# Столбцы Treeview со временем стадий конвейера: стадия -> заголовок
+STAGE_COLUMNS = {
+    "decode": "Декод., мс",
+    "resize": "Масшт., мс",
+    "encode": "Кодир., мс",
+    "write": "Запись, мс",
+}
+
+# Значение списка заглушек, означающее «без заглушки»
+NO_PLACEHOLDER = "нет"
+
+
 class ImageConverterApp:
     """
     Класс приложения для конвертации изображений с графическим интерфейсом на основе Tkinter.
@@ -26,7 +72,8 @@ class ImageConverterApp:
         self.master.geometry("1200x700")  # Устанавливаем начальный размер окна
 
         # Инициализация переменных для хранения путей и настроек
-        self.source_image_paths = tk.StringVar()
+        self.source_image_paths = tk.StringVar()  # Отображаемый список исходников
+        self.source_inputs = []  # Выбранные файлы или папка
         self.output_folder_path = tk.StringVar()
         self.widths_string = tk.StringVar(value="400,800,1200")  # Значения по умолчанию для ширин
         self.selected_formats = {
@@ -36,15 +83,37 @@ class ImageConverterApp:
         }
         self.generate_html = tk.BooleanVar(value=True)       # Генерация HTML-кода включена по умолчанию
         self.add_lazy_loading = tk.BooleanVar(value=True)   # Добавление lazy loading включено по умолчанию
-
-        # Словарь для сопоставления путей файлов с ID элементов в Treeview
-        self.file_to_item = {}
+        self.placeholder_kind = tk.StringVar(value=NO_PLACEHOLDER)  # Вид заглушки на время загрузки
+        self.generate_index = tk.BooleanVar(value=True)     # Запись images.json включена по умолчанию
+        self.cascade_resize = tk.BooleanVar(value=True)     # Каскадное масштабирование включено по умолчанию
+        self.draft_decode = tk.BooleanVar(value=True)       # Уменьшенное декодирование JPEG включено по умолчанию
+        self.skip_unchanged = tk.BooleanVar(value=True)     # Пропуск неизменённых файлов включён по умолчанию
+        self.preserve_layout = tk.BooleanVar(value=False)   # Повторение структуры подпапок исходной папки
+        self.no_upscale = tk.BooleanVar(value=True)         # Ширины больше исходника сводятся к ширине исходника
+        self.prune_renditions = tk.BooleanVar(value=False)  # Удаление вариантов, которые не легче соседних
+        self.dedup_sources = tk.BooleanVar(value=True)      # Варианты одинаковых исходников берутся ссылками
+        self.keep_animation = tk.BooleanVar(value=True)     # Анимированные GIF и WEBP сохраняются в WEBP с анимацией
+        self.target_kb = tk.StringVar()   # Бюджет размера варианта в КБ для подбора качества (пусто — без бюджета)
+        self.target_ssim = tk.StringVar()  # Порог сходства SSIM для подбора качества (пусто — без порога)
+        self.worker_count = tk.IntVar(value=1)  # Число процессов конвертации (по умолчанию — последовательно)
+        self.spool_folder = tk.StringVar()  # Общая папка заданий для рабочих процессов (пусто — конвертация здесь)
+
+        # Модель списка предпросмотра: запланированные файлы, их статусы и ID элементов в Treeview
+        self.preview = PreviewModel()
+        self._fill_job = None  # Отложенное добавление следующей порции строк в Treeview
+        self._preview_job = None  # Отложенный пересчёт плана после ввода в поле ширин
+        self._plan_key = None  # Настройки, по которым составлен текущий план
+        # Индекс размеров и хешей исходников между запусками (None, если папка кэша недоступна)
+        self.metadata = open_metadata()
+        self.path_checks = PathChecks(metadata=self.metadata)  # Кэш проверок существования исходников и папки
 
         # Очередь для обмена сообщениями между рабочим потоком и главным потоком
         self.queue = queue.Queue()
 
         # Флаг для предотвращения повторного запуска конвертации
         self.conversion_in_progress = False
+        self.cancel_event = threading.Event()  # Запрос на остановку конвертации кнопкой "Отмена"
+        self._last_settings = None  # Настройки остановленной конвертации для кнопки "Продолжить"
 
         # Создание элементов интерфейса
         self.create_widgets()
@@ -85,6 +154,18 @@ class ImageConverterApp:
         btn_browse_source = tk.Button(frame_source, text="Обзор...", command=self.browse_source_image)
         btn_browse_source.pack(side="left", padx=5, pady=2)
 
+        # Кнопка для выбора папки с исходниками (обходится вместе с вложенными папками)
+        btn_browse_source_folder = tk.Button(frame_source, text="Папка...", command=self.browse_source_folder)
+        btn_browse_source_folder.pack(side="left", padx=5, pady=2)
+
+        # Чекбокс повторения структуры подпапок в папке результатов
+        cb_preserve_layout = tk.Checkbutton(
+            frame_source,
+            text="Сохранять структуру папок",
+            variable=self.preserve_layout
+        )
+        cb_preserve_layout.pack(side="left", padx=5, pady=2)
+
         # ========== Выбор папки для сохранения ==========
         frame_output = tk.Frame(frame_left)
         frame_output.pack(fill="x", padx=5, pady=2)  # Уменьшены отступы
@@ -130,7 +211,90 @@ class ImageConverterApp:
         # Поле для ввода размеров через запятую
         entry_sizes = tk.Entry(frame_sizes, textvariable=self.widths_string, width=30)
         entry_sizes.pack(side="left", padx=5, pady=2)
-        entry_sizes.bind("<KeyRelease>", lambda event: self.update_preview())  # Обновление предпросмотра при изменении размеров
+        entry_sizes.bind("<KeyRelease>", self.schedule_preview_update)  # Обновление предпросмотра после паузы во вводе размеров
+
+        # Чекбокс для замены ширин больше исходника одним вариантом в ширину исходника
+        chk_no_upscale = tk.Checkbutton(
+            frame_sizes,
+            text="Не увеличивать",
+            variable=self.no_upscale,
+            command=self.update_preview  # Состав файлов зависит от размеров исходников
+        )
+        chk_no_upscale.pack(side="left", padx=5, pady=2)
+
+        # Чекбокс для удаления вариантов, которые не легче соседних ширин и форматов
+        chk_prune = tk.Checkbutton(frame_sizes, text="Удалять лишние", variable=self.prune_renditions)
+        chk_prune.pack(side="left", padx=5, pady=2)
+
+        # Чекбокс для поиска одинаковых исходников: их варианты не кодируются повторно
+        chk_dedup = tk.Checkbutton(frame_sizes, text="Дубликаты ссылками", variable=self.dedup_sources)
+        chk_dedup.pack(side="left", padx=5, pady=2)
+
+        # Чекбокс для сохранения анимации GIF и WEBP в вариантах WEBP
+        chk_animation = tk.Checkbutton(frame_sizes, text="Анимация", variable=self.keep_animation)
+        chk_animation.pack(side="left", padx=5, pady=2)
+
+        # ========== Подбор качества ==========
+        frame_quality = tk.Frame(frame_left)
+        frame_quality.pack(fill="x", padx=5, pady=2)
+
+        # Метка для подбора качества JPEG и WEBP
+        lbl_quality = tk.Label(frame_quality, text="Подбор качества:")
+        lbl_quality.pack(side="left", padx=5, pady=2)
+
+        # Поле для бюджета размера одного варианта
+        lbl_target_kb = tk.Label(frame_quality, text="не больше, КБ")
+        lbl_target_kb.pack(side="left", padx=5, pady=2)
+        entry_target_kb = tk.Entry(frame_quality, textvariable=self.target_kb, width=8)
+        entry_target_kb.pack(side="left", padx=5, pady=2)
+
+        # Поле для порога сходства с несжатым вариантом
+        lbl_target_ssim = tk.Label(frame_quality, text="сходство SSIM не ниже")
+        lbl_target_ssim.pack(side="left", padx=5, pady=2)
+        entry_target_ssim = tk.Entry(frame_quality, textvariable=self.target_ssim, width=8)
+        entry_target_ssim.pack(side="left", padx=5, pady=2)
+
+        # ========== Параллельная обработка ==========
+        frame_workers = tk.Frame(frame_left)
+        frame_workers.pack(fill="x", padx=5, pady=2)
+
+        # Метка для выбора числа процессов
+        lbl_workers = tk.Label(frame_workers, text="Процессы:")
+        lbl_workers.pack(side="left", padx=5, pady=2)
+
+        # Поле для выбора числа процессов, обрабатывающих исходные изображения параллельно
+        spin_workers = tk.Spinbox(frame_workers, from_=1, to=max(64, available_cpus()),
+                                  textvariable=self.worker_count, width=5)
+        spin_workers.pack(side="left", padx=5, pady=2)
+
+        # Чекбокс для каскадного масштабирования (меньшие ширины строятся из больших)
+        chk_cascade = tk.Checkbutton(frame_workers, text="Каскадное масштабирование", variable=self.cascade_resize)
+        chk_cascade.pack(side="left", padx=5, pady=2)
+
+        # Чекбокс для уменьшенного декодирования крупных JPEG
+        chk_draft = tk.Checkbutton(frame_workers, text="Быстрое декодирование JPEG", variable=self.draft_decode)
+        chk_draft.pack(side="left", padx=5, pady=2)
+
+        # Чекбокс для пропуска файлов, которые по манифесту сборки уже актуальны
+        chk_skip = tk.Checkbutton(frame_workers, text="Пропускать неизменённые", variable=self.skip_unchanged)
+        chk_skip.pack(side="left", padx=5, pady=2)
+
+        # ========== Общая папка заданий ==========
+        frame_spool = tk.Frame(frame_left)
+        frame_spool.pack(fill="x", padx=5, pady=2)
+
+        # Метка для общей папки заданий
+        lbl_spool = tk.Label(frame_spool, text="Общая папка заданий:")
+        lbl_spool.pack(side="left", padx=5, pady=2)
+
+        # Поле для общей папки: если она указана, исходники конвертируют рабочие процессы,
+        # запущенные с --spool-worker на этой или других машинах
+        entry_spool = tk.Entry(frame_spool, textvariable=self.spool_folder, width=40)
+        entry_spool.pack(side="left", padx=5, pady=2, fill="x", expand=True)
+
+        # Кнопка для выбора общей папки заданий
+        btn_browse_spool = tk.Button(frame_spool, text="Обзор", command=self.browse_spool_folder)
+        btn_browse_spool.pack(side="left", padx=5, pady=2)
 
         # ========== HTML Опции ==========
         frame_html_options = tk.Frame(frame_left)
@@ -154,6 +318,30 @@ class ImageConverterApp:
         )
         chk_lazy_loading.pack(anchor='w', padx=5, pady=2)
 
+        # Выбор заглушки, которую браузер показывает, пока изображение загружается
+        frame_placeholder = tk.Frame(frame_html_options)
+        frame_placeholder.pack(anchor='w', padx=5, pady=2)
+        lbl_placeholder = tk.Label(frame_placeholder, text="Заглушка при загрузке:")
+        lbl_placeholder.pack(side="left")
+        combo_placeholder = ttk.Combobox(
+            frame_placeholder,
+            textvariable=self.placeholder_kind,
+            values=(NO_PLACEHOLDER, *PLACEHOLDER_KINDS),
+            state="readonly",
+            width=10
+        )
+        combo_placeholder.pack(side="left", padx=5)
+        combo_placeholder.bind("<<ComboboxSelected>>", lambda event: self.update_html_preview_after_selection())
+
+        # Чекбокс для записи списка вариантов с размерами в images.json
+        chk_generate_index = tk.Checkbutton(
+            frame_html_options,
+            text=f"Записывать список вариантов ({INDEX_FILENAME})",
+            variable=self.generate_index,
+            command=self.update_preview  # Файл появляется в списке предпросмотра
+        )
+        chk_generate_index.pack(anchor='w', padx=5, pady=2)
+
         # ------------------------ Правая половина (Предпросмотр HTML-кода) ------------------------
 
         # Виджет Text для предпросмотра HTML-кода
@@ -176,6 +364,14 @@ class ImageConverterApp:
         )
         self.btn_convert.pack(side="left", padx=5, pady=2)
 
+        # Кнопка для остановки конвертации после начатых файлов
+        self.btn_cancel = tk.Button(frame_convert, text="Отмена", command=self.cancel_conversion, state='disabled')
+        self.btn_cancel.pack(side="left", padx=5, pady=2)
+
+        # Кнопка для продолжения остановленной конвертации с теми же настройками
+        self.btn_resume = tk.Button(frame_convert, text="Продолжить", command=self.resume_conversion, state='disabled')
+        self.btn_resume.pack(side="left", padx=5, pady=2)
+
         # Метка для отображения общего статуса конвертации
         self.lbl_conversion_status = tk.Label(frame_convert, text="", font=("Arial", 12))
         self.lbl_conversion_status.pack(side="left", padx=10, pady=2)
@@ -193,13 +389,22 @@ class ImageConverterApp:
         style.configure("OddRow", background="#f0f0f0")    # Цвет нечетных строк
         style.configure("EvenRow", background="#ffffff")   # Цвет четных строк
 
-        # Создание Treeview для отображения предполагаемых файлов и их статусов
-        columns = ("File Path", "Status")
+        # Создание Treeview для отображения предполагаемых файлов, их статусов и времени стадий
+        columns = ("File Path", "Status") + tuple(STAGE_COLUMNS) + ("Size",)
         self.tree_preview = ttk.Treeview(frame_preview, columns=columns, show='headings', selectmode='browse')
         self.tree_preview.heading("File Path", text="Путь к файлу")
         self.tree_preview.heading("Status", text="Статус")
-        self.tree_preview.column("File Path", anchor="w", width=900)
+        self.tree_preview.column("File Path", anchor="w", width=600)
         self.tree_preview.column("Status", anchor="center", width=100)
+        for column, title in STAGE_COLUMNS.items():
+            self.tree_preview.heading(column, text=title)
+            self.tree_preview.column(column, anchor="e", width=90)
+        self.tree_preview.heading("Size", text="Размер")
+        self.tree_preview.column("Size", anchor="e", width=90)
+
+        # Применение стилей для чередования цветов строк
+        self.tree_preview.tag_configure("evenrow", background="#ffffff")
+        self.tree_preview.tag_configure("oddrow", background="#f0f0f0")
 
         # Создание вертикальной полосы прокрутки для Treeview
         scrollbar = ttk.Scrollbar(frame_preview, orient="vertical", command=self.tree_preview.yview)
@@ -227,16 +432,40 @@ class ImageConverterApp:
                 ("Все файлы", "*.*")]
         )
         if file_paths:
-            # Преобразуем список путей в строку, разделённую запятыми
+            # Пути хранятся списком; строка, разделённая запятыми, нужна только для отображения
+            self.source_inputs = list(file_paths)
             self.source_image_paths.set(", ".join(file_paths))
             # Установим папку экспорта в ту же папку, что и первый выбранный файл
             first_file_dir = os.path.dirname(file_paths[0])
             self.output_folder_path.set(first_file_dir)
+            self.path_checks.clear()
             self.update_preview()
             # Генерация HTML-кода для первого изображения, если опция выбрана
             if self.generate_html.get():
                 self.generate_html_preview_for_first_image(file_paths[0])
 
+    def browse_source_folder(self):
+        """
+        Открывает диалог выбора папки с исходными изображениями.
+
+        Папка обходится вместе с вложенными папками во время конвертации, поэтому файлы
+        появляются в предпросмотре по мере обработки. Папка экспорта по умолчанию — та же папка.
+        """
+        folder_path = filedialog.askdirectory(title="Выберите папку с изображениями")
+        if folder_path:
+            self.source_inputs = [folder_path]
+            self.source_image_paths.set(folder_path)
+            self.output_folder_path.set(folder_path)
+            self.path_checks.clear()
+            self.update_preview()
+            self.clear_html_preview()
+
+    def source_files(self):
+        """
+        Возвращает явно выбранные файлы (без папок): для них план строится заранее.
+        """
+        return [path for path in self.source_inputs if not self.path_checks.isdir(path)]
+
     def browse_output_folder(self):
         """
         Открывает диалог выбора папки для сохранения результатов.
@@ -247,42 +476,65 @@ class ImageConverterApp:
         folder_path = filedialog.askdirectory(title="Выберите папку для сохранения")
         if folder_path:
             self.output_folder_path.set(folder_path)
+            self.path_checks.clear()
             self.update_preview()
             # Генерация HTML-кода для первого изображения, если опция выбрана
-            if self.generate_html.get() and self.source_image_paths.get():
-                first_image_path = self.source_image_paths.get().split(", ")[0]
+            if self.generate_html.get() and self.source_files():
+                first_image_path = self.source_files()[0]
                 self.generate_html_preview_for_first_image(first_image_path)
 
+    def browse_spool_folder(self):
+        """
+        Открывает диалог выбора общей папки заданий.
+        """
+        folder_path = filedialog.askdirectory(title="Выберите общую папку заданий")
+        if folder_path:
+            self.spool_folder.set(folder_path)
+
+    def schedule_preview_update(self, event=None):
+        """
+        Откладывает обновление предпросмотра до паузы во вводе: пока пользователь печатает,
+        план не пересчитывается.
+        """
+        if self._preview_job is not None:
+            self.master.after_cancel(self._preview_job)
+        self._preview_job = self.master.after(PREVIEW_DEBOUNCE_MS, self.update_preview)
+
     def update_preview(self):
         """
         Обновляет поле предпросмотра с предполагаемыми файлами для конвертации.
 
         Включает генерируемые файлы на основе выбранных форматов и размеров, а также добавляет
         файл `code.txt` для хранения сгенерированного HTML-кода при активированной опции.
+        Если изменились только ширины или форматы, в Treeview удаляются и добавляются лишь
+        отличающиеся строки; остальные сохраняются вместе со статусами.
         """
-        # Очистка существующих записей в Treeview
-        self.tree_preview.delete(*self.tree_preview.get_children())
-        self.file_to_item.clear()  # Очистка сопоставлений файлов с элементами Treeview
+        if self._preview_job is not None:
+            self.master.after_cancel(self._preview_job)
+            self._preview_job = None
 
         # Получение путей к исходным файлам и настройкам
-        source_paths = self.source_image_paths.get().split(", ")
+        source_paths = self.source_files()
         output_folder = self.output_folder_path.get()
         widths_input = self.widths_string.get()
         selected_formats_list = [fmt for fmt, var in self.selected_formats.items() if var.get()]
+        generate_html = self.generate_html.get()
+        generate_index = self.generate_index.get()
 
         # Проверка наличия необходимых данных
-        if not source_paths or not any(os.path.isfile(path) for path in source_paths):
+        if not source_paths or not any(self.path_checks.isfile(path) for path in source_paths):
+            self.clear_tree_preview()
             return  # Ничего не делаем, если нет исходных файлов
 
         if not selected_formats_list:
+            self.clear_tree_preview()
             return  # Ничего не делаем, если нет выбранных форматов
 
         # Обработка размеров
         try:
-            widths = [int(w.strip()) for w in widths_input.split(",") if w.strip().isdigit()]
-            if not widths:
-                raise ValueError
+            widths = parse_widths(widths_input)
         except ValueError:
+            self.clear_tree_preview()
             return  # Ничего не делаем, если размеры некорректны
 
         # Если папка не указана, предполагаем папку исходного файла
@@ -290,42 +542,56 @@ class ImageConverterApp:
             output_folder = os.path.dirname(source_paths[0])
 
         # Проверка существования папки
-        if not os.path.isdir(output_folder):
+        if not self.path_checks.isdir(output_folder):
+            self.clear_tree_preview()
             return  # Ничего не делаем, если папка не существует
 
-        # Добавление всех генерируемых файлов в Treeview
-        for source_path in source_paths:
-            base_name = os.path.splitext(os.path.basename(source_path))[0]
-            for width in widths:
-                for fmt in selected_formats_list:
-                    ext = fmt.lower()
-                    if fmt == "JPEG":
-                        ext = "jpg"  # Используем .jpg для JPEG
-                    out_filename = f"{base_name}-{width}w.{ext}"
-                    out_path = os.path.join(output_folder, out_filename)
-
-                    # Определение тега для чередования цветов строк
-                    row_tag = "evenrow" if len(self.tree_preview.get_children()) % 2 == 0 else "oddrow"
-                    item_id = self.tree_preview.insert("", "end", values=(out_path, ""), tags=(row_tag,))
-                    self.file_to_item[out_path] = item_id  # Сохранение сопоставления пути файла с элементом Treeview
-
-        # Добавление "code.txt" только один раз и в конец списка
-        if self.generate_html.get():
-            code_filename = "code.txt"
-            code_path = os.path.join(output_folder, code_filename)
-            if code_path not in self.file_to_item:
-                item_id = self.tree_preview.insert("", "end", values=(code_path, ""), tags=("evenrow",))
-                self.file_to_item[code_path] = item_id  # Сохранение ID элемента
+        # План не изменился (например, в поле ширин только переместили курсор)
+        upscale = self.upscale_policy()
+        layout = (tuple(source_paths), output_folder, generate_html, generate_index)
+        plan_key = (layout, tuple(widths), tuple(selected_formats_list), upscale)
+        if plan_key == self._plan_key:
+            return
 
-        # Применение стилей для чередования цветов строк
-        self.tree_preview.tag_configure("evenrow", background="#ffffff")
-        self.tree_preview.tag_configure("oddrow", background="#f0f0f0")
+        # Планирование всех генерируемых файлов; номер исходника задаёт цвет фона строк
+        groups = {path: index for index, path in enumerate(source_paths)}
+        entries = [(out_path, groups[source_path])
+                   for source_path, _, _, out_path in plan_outputs(source_paths, widths, selected_formats_list, output_folder,
+                                                                   upscale=upscale, image_size=self.path_checks.image_size)]
+        if self.metadata is not None:
+            self.metadata.flush()  # Размеры, прочитанные для плана, пригодятся при следующем запуске
+
+        # Добавление "code.txt" и "images.json" только один раз и в конец списка
+        if generate_html:
+            entries.append((os.path.join(output_folder, CODE_FILENAME), len(source_paths)))
+        if generate_index:
+            entries.append((os.path.join(output_folder, INDEX_FILENAME), len(source_paths)))
+
+        if self._plan_key is not None and self._plan_key[0] == layout and self.preview.complete:
+            # Изменились только ширины или форматы: применяется разница планов
+            removed, added = self.preview.apply_plan(entries)
+            if removed:
+                self.tree_preview.delete(*[row.item_id for row in removed])
+            for row in added:
+                row.item_id = self.tree_preview.insert("", row.index, values=row.values(), tags=(row.tag,))
+        else:
+            # Строки добавляются в Treeview порциями
+            self.clear_tree_preview()
+            self.preview.set_plan(entries)
+            self.fill_tree_preview()
+        self._plan_key = plan_key
 
         # Обновление HTML-предпросмотра, если опция активирована и есть хотя бы одно изображение
-        if self.generate_html.get() and source_paths:
+        if generate_html and source_paths:
             first_image_path = source_paths[0]
             self.generate_html_preview_for_first_image(first_image_path)
 
+    def upscale_policy(self):
+        """
+        Возвращает политику для ширин больше исходника (см. resize.resolve_widths).
+        """
+        return "clamp" if self.no_upscale.get() else "allow"
+
     def generate_html_preview_for_first_image(self, source_path):
         """
         Генерирует HTML-код для первого исходного изображения и отображает его в предпросмотре.
@@ -337,55 +603,30 @@ class ImageConverterApp:
         selected_formats_list = [fmt for fmt, var in self.selected_formats.items() if var.get()]
 
         # Проверка существования папки
-        if not os.path.isdir(output_folder):
+        if not self.path_checks.isdir(output_folder):
             return  # Папка не существует
 
         try:
-            widths = sorted([int(w.strip()) for w in widths_input.split(",") if w.strip().isdigit()])
-            if not widths:
-                raise ValueError
+            widths = parse_widths(widths_input)
         except ValueError:
             return  # Некорректные размеры
 
-        base_name = os.path.splitext(os.path.basename(source_path))[0]
-        html_code = ""
-        srcset_entries = []
-        smallest_image = ""
-        alt_text = base_name.replace("-", " ")
-        sizes_attr = "(max-width: 480px) 100px, (max-width: 768px) 120px, 120px"
-        loading_attr = 'loading="lazy"' if self.add_lazy_loading.get() else ''  # Добавление атрибута loading при необходимости
-
-        # Сборка строк для srcset
-        for width in widths:
-            for fmt in selected_formats_list:
-                ext = fmt.lower()
-                if fmt == "JPEG":
-                    ext = "jpg"  # Используем .jpg для JPEG
-                filename = f"{base_name}-{width}w.{ext}"
-                srcset_entries.append(f"{filename} {width}w")
-                if not smallest_image or width < smallest_image[0]:
-                    smallest_image = (width, filename)
-
-        # Определение основного изображения (самого маленького)
-        if smallest_image:
-            src = smallest_image[1]
-        else:
-            src = srcset_entries[0].split(" ")[0]
-
-        # Формирование строки srcset с правильным отступом
-        srcset_str = ",\n\t".join(srcset_entries)  # Один знак табуляции перед каждым элементом srcset
-
-        # Форматирование HTML-кода согласно заданным требованиям
-        # Перед alt, class, loading, sizes, src - два знака табуляции
-        # Перед каждым элементом srcset - один знак табуляции
-        html_code = f'''<img
-\talt="{alt_text}"
-\tclass="profile-image"
-\t{loading_attr}
-\tsizes="{sizes_attr}"
-\tsrc="{src}" srcset="
-\t{srcset_str}
-">'''
+        if not selected_formats_list:
+            return  # Нет выбранных форматов
+
+        base_name = source_base_name(source_path)
+
+        # Ширины больше исходника заменяются так же, как при конвертации
+        size = self.path_checks.image_size(source_path)
+        widths = resolve_widths(widths, size[0] if size else None, self.upscale_policy())
+
+        # Сборка списка файлов для srcset: основным станет самое маленькое изображение
+        files = [(width, output_filename(base_name, width, fmt))
+                 for width in widths for fmt in selected_formats_list]
+        # Вариантов ещё нет, поэтому заглушка для предпросмотра считается по исходнику
+        kind = self.selected_placeholder()
+        placeholder = self.path_checks.placeholder(source_path, kind) if kind else None
+        html_code = build_img_tag(base_name, files, self.add_lazy_loading.get(), placeholder)
 
         # Обновление поля предпросмотра HTML-кода
         self.text_html_preview.config(state='normal')
@@ -393,13 +634,20 @@ class ImageConverterApp:
         self.text_html_preview.insert(tk.END, html_code)
         self.text_html_preview.config(state='disabled')  # Отключение редактирования
 
+    def selected_placeholder(self):
+        """
+        Возвращает выбранный вид заглушки (см. placeholder.PLACEHOLDER_KINDS) или None.
+        """
+        kind = self.placeholder_kind.get()
+        return kind if kind in PLACEHOLDER_KINDS else None
+
     def update_html_preview_after_selection(self):
         """
         Генерирует HTML-код для первого исходного изображения при изменении опций генерации HTML-кода
         или добавления lazy loading.
         """
-        if self.generate_html.get() and self.source_image_paths.get():
-            first_image_path = self.source_image_paths.get().split(", ")[0]
+        if self.generate_html.get() and self.source_files():
+            first_image_path = self.source_files()[0]
             self.generate_html_preview_for_first_image(first_image_path)
         else:
             self.clear_html_preview()
@@ -416,188 +664,259 @@ class ImageConverterApp:
             return
 
         # Проверка наличия файлов для конвертации
-        if not self.file_to_item:
+        if not len(self.preview) and len(self.source_files()) == len(self.source_inputs):
             messagebox.showwarning("Предупреждение", "Нет файлов для конвертации.")
             return
 
+        try:
+            target = self.quality_target()
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
+
+        # Общая папка заданий вводится вручную: недоступная папка сообщается до запуска рабочего потока
+        spool = self.spool_folder.get().strip() or None
+        if spool:
+            try:
+                os.makedirs(spool, exist_ok=True)
+            except OSError as e:
+                messagebox.showerror("Ошибка", f"Общая папка заданий недоступна: {e}")
+                return
+
+        # Настройки считываются в главном потоке: переменные Tkinter нельзя читать из рабочего потока
+        settings = {
+            "source_inputs": list(self.source_inputs),
+            "output_folder": self.output_folder_path.get(),
+            "widths_input": self.widths_string.get(),
+            "formats": [fmt for fmt, var in self.selected_formats.items() if var.get()],
+            "generate_html": self.generate_html.get(),
+            "lazy_loading": self.add_lazy_loading.get(),
+            "generate_index": self.generate_index.get(),
+            "workers": self.get_worker_count(),
+            "options": ConversionOptions(
+                cascade=self.cascade_resize.get(),
+                draft=self.draft_decode.get(),
+                incremental=self.skip_unchanged.get(),
+                upscale=self.upscale_policy(),
+                prune=self.prune_renditions.get(),
+                target=target,
+                dedup=self.dedup_sources.get(),
+                animation=self.keep_animation.get(),
+                placeholder=self.selected_placeholder(),
+            ),
+            "preserve_layout": self.preserve_layout.get(),
+            "spool": spool,
+        }
+        self.launch_conversion(settings, "Конвертация началась...")
+
+    def launch_conversion(self, settings, status_msg):
+        """
+        Запускает рабочий поток конвертации и переключает кнопки.
+
+        :param settings: Словарь с настройками (см. start_conversion).
+        :param status_msg: Текст общего статуса на время конвертации.
+        """
         # Установка флага конвертации
         self.conversion_in_progress = True
+        self.cancel_event.clear()
+        self._last_settings = settings
 
         # Отключение кнопки конвертации для предотвращения повторных нажатий
         self.btn_convert.config(state='disabled')
+        self.btn_resume.config(state='disabled')
+        self.btn_cancel.config(state='normal')
 
-        # Очистка статусных меток и HTML-предпросмотра
-        self.lbl_conversion_status.config(text="Конвертация началась...")
-        if self.generate_html.get():
-            self.html_code_full = ""  # Сброс накопленного HTML-кода
+        # Очистка статусных меток и прогрессбара (при продолжении готовые файлы сообщаются заново)
+        self.lbl_conversion_status.config(text=status_msg)
+        if hasattr(self, 'progress_bar'):
+            self.progress_bar['value'] = 0
 
         # Запуск рабочего потока для конвертации
-        worker = threading.Thread(target=self.convert_images_thread, daemon=True)
+        worker = threading.Thread(target=self.convert_images_thread, args=(settings,), daemon=True)
         worker.start()
 
-    def convert_images_thread(self):
+    def cancel_conversion(self):
         """
-        Рабочий поток для конвертации изображений.
+        Просит движок остановиться: начатые файлы дописываются, новые не начинаются.
+        """
+        if not self.conversion_in_progress:
+            return
+        self.cancel_event.set()
+        self.btn_cancel.config(state='disabled')
+        self.lbl_conversion_status.config(text="Остановка после начатых файлов...")
 
-        Выполняет конвертацию изображений по заданным параметрам, обновляет статус файлов и
-        генерирует HTML-код при необходимости.
+    def resume_conversion(self):
         """
-        source_paths = self.source_image_paths.get().split(", ")
-        output_folder = self.output_folder_path.get()
-        widths_input = self.widths_string.get()
+        Продолжает остановленную конвертацию с прежними настройками. Готовые файлы берутся
+        из манифеста сборки, поэтому обрабатывается только оставшееся.
+        """
+        if self.conversion_in_progress or self._last_settings is None:
+            return
+        settings = dict(self._last_settings)
+        # Продолжение не пересобирает файлы, которые остановленная конвертация уже собрала
+        settings["options"] = copy.copy(settings["options"])
+        settings["options"].incremental = True
+        self.launch_conversion(settings, "Конвертация продолжается...")
 
+    def quality_target(self):
+        """
+        Возвращает цель подбора качества, указанную в интерфейсе.
+
+        :return: QualityTarget или None, если оба поля пустые.
+        :raises ValueError: Если значение в поле некорректно.
+        """
+        kb_input = self.target_kb.get().strip()
+        ssim_input = self.target_ssim.get().strip().replace(",", ".")
+        if not kb_input and not ssim_input:
+            return None
+        max_bytes = min_ssim = None
+        if kb_input:
+            if not kb_input.isdigit() or int(kb_input) <= 0:
+                raise ValueError(f"Некорректный размер в килобайтах: {kb_input}")
+            max_bytes = int(kb_input) * 1024
+        if ssim_input:
+            try:
+                min_ssim = float(ssim_input)
+            except ValueError:
+                min_ssim = None
+            if min_ssim is None or not 0 < min_ssim <= 1:
+                raise ValueError(f"Порог сходства должен быть числом от 0 до 1: {ssim_input}")
+        return QualityTarget(max_bytes=max_bytes, min_ssim=min_ssim)
+
+    def get_worker_count(self):
+        """
+        Возвращает число процессов конвертации, указанное в интерфейсе.
+
+        :return: Число процессов (1, если значение некорректно).
+        """
+        try:
+            return max(1, self.worker_count.get())
+        except tk.TclError:
+            return 1
+
+    def convert_images_thread(self, settings):
+        """
+        Рабочий поток для конвертации изображений.
+
+        Передаёт настройки движку конвертации и пересылает его результаты в очередь сообщений,
+        откуда главный поток обновляет статус файлов и прогрессбар.
+
+        :param settings: Словарь с настройками, считанными из интерфейса в start_conversion.
+        """
         # Обработка размеров
         try:
-            widths = sorted([int(w.strip()) for w in widths_input.split(",") if w.strip().isdigit()])
-            if not widths:
-                raise ValueError
-        except ValueError:
-            self.queue.put(("error", "Укажите корректные целые числа для ширины изображений (через запятую)."))
+            widths = parse_widths(settings["widths_input"])
+        except ValueError as e:
+            self.queue.put(("error", str(e)))
+            self.queue.put(("conversion_complete", "Конвертация не выполнена."))
             self.conversion_in_progress = False
             return
 
         # Получение выбранных форматов
-        selected_formats_list = [fmt for fmt, var in self.selected_formats.items() if var.get()]
+        selected_formats_list = settings["formats"]
         if not selected_formats_list:
             self.queue.put(("error", "Не выбран ни один формат для конвертации."))
+            self.queue.put(("conversion_complete", "Конвертация не выполнена."))
             self.conversion_in_progress = False
             return
 
-        generated_files = []  # Список для хранения путей сгенерированных файлов
-        html_code_full = ""    # Накопленный HTML-код
+        def on_output(result):
+            if result.cached:
+                print(f"Актуален: {result.out_path}")
+            elif result.ok:
+                print(f"Сохранено: {result.out_path}")
+            else:
+                print(f"Ошибка сохранения файла {result.out_path}: {result.error}")
+            # Обновление статуса в Treeview и прогрессбара одним сообщением
+            stats = format_stats(result.timings, result.size_bytes) if result.timings else None
+            self.queue.put(("update_output", result.source_path, result.out_path, result.status_symbol, stats))
+
+        def on_error(message):
+            print(message)
+            self.queue.put(("error", message))
+
+        # Папки обходятся по ходу конвертации: первые файлы обрабатываются до окончания обхода
+        output_folder = settings["output_folder"]
+        sources = iter_sources(settings["source_inputs"], exclude=[output_folder] if output_folder else ())
+
+        # Ошибка, прервавшая конвертацию целиком (например, недоступная общая папка заданий), не должна
+        # оставить интерфейс в состоянии «конвертация запущена»
+        try:
+            report = convert_images(
+                sources,
+                widths,
+                selected_formats_list,
+                output_folder=settings["output_folder"],
+                generate_html=settings["generate_html"],
+                lazy_loading=settings["lazy_loading"],
+                generate_index=settings["generate_index"],
+                on_output=on_output,
+                on_error=on_error,
+                workers=settings["workers"],
+                options=settings["options"],
+                preserve_layout=settings["preserve_layout"],
+                cancel=self.cancel_event,
+                spool=settings.get("spool"),
+                metadata=self.metadata,
+            )
+        except Exception as e:
+            print(f"Ошибка конвертации: {e}")
+            self.queue.put(("error", f"Ошибка конвертации: {e}"))
+            self.queue.put(("conversion_complete", "Конвертация не выполнена."))
+            return
+        finally:
+            self.conversion_in_progress = False
 
-        total_files = len(source_paths) * len(widths) * len(selected_formats_list)  # Общее количество файлов для конвертации
-        processed_files = 0  # Счётчик обработанных файлов
+        if report.cancelled:
+            done = len(report.generated_files) - len(report.cached_outputs)
+            self.queue.put(("conversion_cancelled", f"Конвертация остановлена. Сохранено файлов: {done}."))
+            return
 
-        for source_path in source_paths:
-            try:
-                with Image.open(source_path) as img:
-                    # Получение имени файла без расширения
-                    base_name = os.path.splitext(os.path.basename(source_path))[0]
-
-                    generated_files_current = {}  # Для хранения сгенерированных файлов текущего изображения
-
-                    for width in widths:
-                        # Вычисление новой высоты с сохранением пропорций
-                        ratio = width / float(img.width)
-                        new_height = int(img.height * ratio)
-
-                        # Создание копии исходного изображения нужного размера
-                        resized_img = img.resize((width, new_height), Image.LANCZOS)
-
-                        for fmt in selected_formats_list:
-                            # Формирование имени выходного файла
-                            ext = fmt.lower()
-                            if fmt == "JPEG":
-                                ext = "jpg"  # Используем .jpg для JPEG
-                                fmt_pillow = "JPEG"
-                            else:
-                                fmt_pillow = fmt  # "PNG" или "WEBP"
-
-                            out_filename = f"{base_name}-{width}w.{ext}"
-                            out_path = os.path.join(output_folder, out_filename)
-
-                            # Дополнительные параметры сохранения
-                            save_params = {}
-                            if fmt_pillow == "JPEG":
-                                # Установка качества и оптимизация для JPEG
-                                save_params["quality"] = 85
-                                save_params["optimize"] = True
-                                save_params["progressive"] = True
-                            elif fmt_pillow == "WEBP":
-                                # Установка качества и метода для WEBP
-                                save_params["quality"] = 80
-                                save_params["method"] = 6  # Оптимизация (0-6)
-
-                            # Сохранение изображения
-                            try:
-                                resized_img.save(out_path, fmt_pillow, **save_params)
-                                generated_files.append(out_path)
-                                print(f"Сохранено: {out_path}")
-                                # Обновление статуса в Treeview
-                                self.queue.put(("update_status", out_path, "✔"))
-
-                                # Сбор данных для HTML-кода
-                                if self.generate_html.get():
-                                    if base_name not in generated_files_current:
-                                        generated_files_current[base_name] = []
-                                    generated_files_current[base_name].append((width, out_filename))
-
-                            except Exception as e:
-                                print(f"Ошибка сохранения файла {out_path}: {e}")
-                                # Обновление статуса в Treeview при ошибке
-                                self.queue.put(("update_status", out_path, "✖"))
-
-                            # Увеличение счётчика обработанных файлов и обновление прогрессбара
-                            processed_files += 1
-                            self.queue.put(("update_progress", 1))
-
-                    # Генерация HTML-кода для текущего изображения
-                    if self.generate_html.get():
-                        for base_name, files in generated_files_current.items():
-                            # Сортировка файлов по ширине и формату
-                            sorted_files = sorted(files, key=lambda x: (x[0], selected_formats_list.index(
-                                os.path.splitext(x[1])[1][1:].upper().replace('JPG','JPEG'))))
-                            srcset_entries = ",\n\t".join([f"{filename} {width}w" for width, filename in sorted_files])
-                            smallest_image = sorted_files[0][1]
-                            alt_text = base_name.replace("-", " ")
-                            sizes_attr = "(max-width: 480px) 100px, (max-width: 768px) 120px, 120px"
-                            loading_attr = 'loading="lazy"' if self.add_lazy_loading.get() else ''
-
-                            # Форматирование HTML-кода согласно заданным требованиям
-                            html_code = f'''<img
-\talt="{alt_text}"
-\tclass="profile-image"
-\t{loading_attr}
-\tsizes="{sizes_attr}"
-\tsrc="{smallest_image}" srcset="
-\t{srcset_entries}
-">'''
-                            html_code_full += html_code + "\n\n"  # Разделение кодов разных изображений пустой строкой
-
-            except Exception as e:
-                print(f"Не удалось обработать файл {source_path}: {e}")
-                self.queue.put(("error", f"Не удалось обработать файл {source_path}: {e}"))
-
-        # Запись накопленного HTML-кода в файл code.txt, если опция активирована
-        if self.generate_html.get() and html_code_full.strip():
-            txt_filename = "code.txt"
-            txt_path = os.path.join(output_folder, txt_filename)
-            try:
-                with open(txt_path, 'w', encoding='utf-8') as f:
-                    f.write(html_code_full.strip())
-                print(f"HTML-код записан в файл: {txt_path}")
-                # Обновление статуса "code.txt" в Treeview
-                self.queue.put(("update_status", txt_path, "✔"))
-            except Exception as e:
-                print(f"Ошибка записи HTML-кода в файл: {e}")
-                self.queue.put(("error", f"Ошибка записи HTML-кода в файл: {e}"))
+        if report.code_path:
+            print(f"HTML-код записан в файл: {report.code_path}")
+            # Обновление статуса "code.txt" в Treeview
+            self.queue.put(("update_status", report.code_path, "✔"))
+        if report.index_path:
+            print(f"Список вариантов записан в файл: {report.index_path}")
+            self.queue.put(("update_status", report.index_path, "✔"))
 
         # Обновление общего статуса конвертации
-        if generated_files:
-            self.queue.put(("conversion_complete", "Конвертация завершена успешно."))
+        if report.generated_files:
+            status_msg = "Конвертация завершена успешно."
+            if report.cached_outputs:
+                status_msg += f" Из кэша: {len(report.cached_outputs)}."
+            if report.deduplicated_outputs:
+                status_msg += (f" Дубликатов: {len(report.deduplicated_outputs)},"
+                               f" сэкономлено {report.dedup_saved_bytes / 1024:.1f} КБ.")
+            if report.draft_decodes:
+                status_msg += f" Быстрое декодирование: {report.draft_decodes} из {report.sources_decoded}."
+            self.queue.put(("conversion_complete", status_msg))
         else:
             self.queue.put(("conversion_complete", "Не было сгенерировано ни одного файла."))
 
-        # Сброс флага конвертации и восстановление кнопки конвертации
-        self.conversion_in_progress = False
-
     def process_queue(self):
         """
         Обрабатывает сообщения из очереди и выполняет соответствующие действия.
 
-        Этот метод вызывается периодически (каждые 100 мс) и обрабатывает обновления статуса файлов,
-        прогресса конвертации и ошибок.
+        Этот метод вызывается периодически (каждые 100 мс). Все накопившиеся сообщения сначала
+        разбираются без обращения к виджетам: изменения одной строки объединяются, приращения
+        прогресса суммируются. Затем к Treeview применяется не больше UPDATE_BATCH строк, а
+        прогрессбар обновляется один раз, поэтому поток результатов не замораживает окно.
         """
+        progress = 0
         try:
             while True:
                 message = self.queue.get_nowait()
-                if message[0] == "update_status":
+                if message[0] == "update_output":
+                    _, source_path, file_path, status_symbol, stats = message
+                    if file_path not in self.preview:
+                        # Исходник найден при обходе папки: строка добавляется во время конвертации
+                        self.preview.append_output(file_path, source_path)
+                    self.preview.update(file_path, status_symbol, stats)
+                    progress += 1
+                elif message[0] == "update_status":
                     _, file_path, status_symbol = message
                     self.update_file_status(file_path, status_symbol)
-                elif message[0] == "update_progress":
-                    _, increment = message
-                    self.update_progress_bar(increment)
                 elif message[0] == "error":
                     _, error_msg = message
                     messagebox.showerror("Ошибка", error_msg)
@@ -606,12 +925,53 @@ class ImageConverterApp:
                     self.lbl_conversion_status.config(text=status_msg)
                     # Включение кнопки конвертации после завершения
                     self.btn_convert.config(state='normal')
+                    self.btn_cancel.config(state='disabled')
+                elif message[0] == "conversion_cancelled":
+                    _, status_msg = message
+                    self.lbl_conversion_status.config(text=status_msg)
+                    self.btn_convert.config(state='normal')
+                    self.btn_cancel.config(state='disabled')
+                    self.btn_resume.config(state='normal')
         except queue.Empty:
             pass
         finally:
+            if not self.preview.complete and self._fill_job is None:
+                self.fill_tree_preview()
+            self.apply_preview_changes()
+            if progress:
+                self.update_progress_bar(progress)
             # Продолжение проверки очереди
             self.master.after(100, self.process_queue)
 
+    def clear_tree_preview(self):
+        """
+        Удаляет все строки из Treeview и останавливает их отложенное добавление.
+        """
+        if self._fill_job is not None:
+            self.master.after_cancel(self._fill_job)
+            self._fill_job = None
+        self.tree_preview.delete(*self.tree_preview.get_children())
+        self.preview.set_plan([])
+        self._plan_key = None
+
+    def fill_tree_preview(self):
+        """
+        Добавляет в Treeview следующую порцию строк из модели предпросмотра и, если строки ещё
+        остались, планирует добавление следующей порции после обработки событий окна.
+        """
+        self._fill_job = None
+        for row in self.preview.pending_rows(PREVIEW_CHUNK):
+            row.item_id = self.tree_preview.insert("", "end", values=row.values(), tags=(row.tag,))
+        if self.preview.inserted < len(self.preview):
+            self._fill_job = self.master.after(1, self.fill_tree_preview)
+
+    def apply_preview_changes(self):
+        """
+        Применяет к Treeview накопленные изменения строк (не больше UPDATE_BATCH за вызов).
+        """
+        for row in self.preview.take_changed(UPDATE_BATCH):
+            self.tree_preview.item(row.item_id, values=row.values())
+
     def update_file_status(self, file_path, status_symbol):
         """
         Обновляет статус конкретного файла в Treeview.
@@ -619,23 +979,21 @@ class ImageConverterApp:
         :param file_path: Путь к файлу.
         :param status_symbol: Символ статуса ("✔" для успешного, "✖" для неудачного).
         """
-        item_id = self.file_to_item.get(file_path)
-        if item_id:
-            # Обновление существующего элемента
-            self.tree_preview.set(item_id, column="Status", value=status_symbol)
-        else:
-            # Если item_id отсутствует (например, для "code.txt"), добавляем новый элемент
-            if os.path.basename(file_path) == "code.txt":
-                # Проверка, не было ли уже добавлено "code.txt"
-                if not any(self.tree_preview.item(child)["values"][0] == file_path for child in self.tree_preview.get_children()):
-                    # Добавление "code.txt" в конец списка
-                    new_item = self.tree_preview.insert("", "end", values=(file_path, status_symbol), tags=("evenrow",))
-                    self.file_to_item[file_path] = new_item
+        # Если файла нет в списке (например, "code.txt" при отключённом предпросмотре HTML), он
+        # добавляется в конец списка
+        if file_path not in self.preview and os.path.basename(file_path) in (CODE_FILENAME, INDEX_FILENAME):
+            self.preview.append(file_path, self.preview.next_group())
+            if self._fill_job is None:
+                self.fill_tree_preview()
+        self.preview.update(file_path, status_symbol)
 
     def update_progress_bar(self, increment):
         """
         Обновляет прогрессбар при конвертации файлов.
 
+        Максимум пересчитывается при каждом обновлении: файлы исходников, найденных при обходе
+        папки, добавляются в предпросмотр во время конвертации (см. process_queue).
+
         :param increment: Значение, на которое увеличивается прогрессбар.
         """
         # Если прогрессбар ещё не создан, создаём его
@@ -644,9 +1002,10 @@ class ImageConverterApp:
             self.progress_bar = ttk.Progressbar(frame_convert, orient='horizontal', mode='determinate', length=300)
             self.progress_bar.pack(side="left", padx=10, pady=2)
             self.progress_bar['value'] = 0
-            # Установка максимального значения прогрессбара как общее количество файлов
-            total_files = len(self.file_to_item) - (1 if self.generate_html.get() else 0)  # Исключаем code.txt
-            self.progress_bar['maximum'] = total_files
+
+        # Установка максимального значения прогрессбара как общее количество файлов
+        total_files = len(self.preview) - self.generate_html.get() - self.generate_index.get()  # Исключаем code.txt и images.json
+        self.progress_bar['maximum'] = max(total_files, 1)
 
         # Увеличение значения прогрессбара
         self.progress_bar['value'] += increment
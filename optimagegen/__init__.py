@@ -0,0 +1,26 @@
+"""
+OptImageGen — конвертация изображений в набор адаптивных размеров и форматов.
+
+Пакет содержит движок конвертации, не зависящий от Tkinter, и пакетный режим командной строки.
+Графический интерфейс находится в image_converter.py.
+"""
+from .cache import MANIFEST_FILENAME, BuildManifest
+from .engine import (
+    DEFAULT_SAVE_PARAMS,
+    SUPPORTED_FORMATS,
+    ConversionOptions,
+    ConversionReport,
+    OutputResult,
+    build_img_tag,
+    convert_images,
+    convert_source,
+    output_filename,
+    parse_widths,
+    plan_outputs,
+)
+from .metadata import MetadataIndex
+from .output import CODE_FILENAME, INDEX_FILENAME
+from .quality import QualityTarget
+from .server import RenditionServer
+from .sources import SourceFile, iter_sources
+from .watch import watch_folders
@@ -0,0 +1,8 @@
+"""
+Запуск пакетного режима командой `python -m optimagegen`.
+"""
+import sys
+
+from .cli import main
+
+sys.exit(main())
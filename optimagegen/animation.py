@@ -0,0 +1,124 @@
+"""
+Покадровое масштабирование анимированных исходников (GIF, WEBP).
+
+Анимированный вариант кодируется в WEBP без загрузки всех кадров: кодировщику передаётся
+многокадровое изображение (FrameFeed), кадр которого декодируется из исходника и уменьшается
+только при обращении к нему. В памяти одновременно находятся текущий кадр исходника, один
+уменьшенный кадр и то, что держит сам кодировщик.
+
+Кадры берутся уже собранными: при переходе к следующему кадру Pillow накладывает его на
+предыдущий с учётом способа удаления (disposal) и прозрачности. Кодировщик WEBP сам выделяет
+изменившиеся области, поэтому вариант выглядит так же, как исходник, с теми же длительностями кадров.
+Длительности кадров читаются один раз на исходник, до кодирования вариантов (см. frame_durations).
+
+Анимированные PNG и GIF Pillow записывает, только собрав все кадры в памяти, поэтому варианты
+в этих форматах (и в JPEG) строятся из первого кадра, как и для неподвижных исходников.
+"""
+import time
+
+from PIL import Image
+
+# Форматы, в которые анимированный исходник кодируется с анимацией
+ANIMATED_FORMATS = ("WEBP",)
+
+# Длительность кадра GIF, не больше которой браузеры считают её незаданной, и длительность, которую
+# они используют вместо неё, в миллисекундах
+MAX_UNSET_DURATION = 10
+DEFAULT_FRAME_DURATION = 100
+
+
+def frame_count(img):
+    """
+    Число кадров изображения (1 для неподвижного).
+
+    :param img: Открытое изображение; для GIF подсчёт требует пройти по всем кадрам.
+    """
+    if not getattr(img, "is_animated", False):
+        return 1
+    return img.n_frames
+
+
+def frame_duration(info, fmt):
+    """
+    Длительность кадра в миллисекундах так, как её показывают браузеры: кадры GIF не длиннее
+    MAX_UNSET_DURATION показываются DEFAULT_FRAME_DURATION, длительности остальных форматов берутся как есть.
+
+    :param info: Сведения кадра исходника (img.info после перехода к кадру).
+    :param fmt: Формат исходника (img.format).
+    """
+    duration = info.get("duration") or 0
+    if fmt == "GIF" and duration <= MAX_UNSET_DURATION:
+        return DEFAULT_FRAME_DURATION
+    return int(duration)
+
+
+def frame_durations(img, frames):
+    """
+    Длительности всех кадров изображения в миллисекундах.
+
+    GIF и WEBP сообщают длительность кадра только после его декодирования, поэтому проход по
+    кадрам декодирует каждый из них; после прохода изображение возвращается к первому кадру.
+    Вызывается один раз на исходник: список передаётся кодированию каждого варианта.
+
+    :param img: Открытое анимированное изображение.
+    :param frames: Число кадров (см. frame_count).
+    """
+    durations = []
+    for frame in range(frames):
+        img.seek(frame)
+        img.load()
+        durations.append(frame_duration(img.info, img.format))
+    img.seek(0)
+    return durations
+
+
+class FrameFeed(Image.Image):
+    """
+    Кадры исходника, уменьшенные до размера варианта, в виде многокадрового изображения.
+
+    Изображение передаётся в Image.save(save_all=True): кодировщик переходит к кадру через seek
+    и читает его пиксели, и только тогда кадр исходника декодируется и уменьшается. Кадры
+    читаются по порядку, как их запрашивает кодировщик WEBP.
+    """
+
+    def __init__(self, source, size, durations):
+        """
+        :param source: Открытый анимированный исходник; принадлежит вызывающему коду.
+        :param size: Размер варианта (ширина, высота).
+        :param durations: Длительности всех кадров исходника (см. frame_durations).
+        """
+        super().__init__()
+        self._mode = "RGBA"
+        self._size = tuple(size)
+        self._source = source
+        self._frame = 0
+        self._loaded = None
+        self.n_frames = len(durations)
+        self.is_animated = self.n_frames > 1
+        # Число повторов: у GIF без расширения NETSCAPE его нет, и такая анимация проигрывается один раз
+        self.info = {"loop": source.info.get("loop", 1)}
+        # Список передаётся в Image.save(duration=...) целиком
+        self.durations = list(durations)
+        self.resize_time = 0.0  # Суммарное время декодирования и уменьшения кадров в секундах
+
+    def seek(self, frame):
+        if not 0 <= frame < self.n_frames:
+            raise EOFError("Кадра с таким номером нет")
+        self._frame = frame
+
+    def tell(self):
+        return self._frame
+
+    def load(self):
+        if self._loaded != self._frame:
+            started = time.perf_counter()
+            self._source.seek(self._frame)
+            # Кадр без прозрачности уменьшается в RGB: это почти вдвое быстрее, чем в RGBA.
+            # Режим меняется от кадра к кадру, как и у самого исходника GIF
+            self._mode = "RGBA" if self._source.has_transparency_data else "RGB"
+            frame = self._source.convert(self._mode)
+            self.im = frame.resize(self._size, Image.LANCZOS).im
+            del frame
+            self._loaded = self._frame
+            self.resize_time += time.perf_counter() - started
+        return super().load()
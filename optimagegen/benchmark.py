@@ -0,0 +1,874 @@
+"""
+Замеры производительности конвейера конвертации.
+
+Запуск: `python image_converter.py --benchmark` или `python -m optimagegen.benchmark`. Исходные
+изображения генерируются синтетически (несколько разрешений, режимы RGB/RGBA/палитра,
+фотоподобное и плоское содержимое), поэтому результаты воспроизводимы на любой машине без набора
+тестовых фотографий. Каждый случай выполняется в отдельном процессе, чтобы пиковая память
+измерялась независимо от предыдущих случаев.
+
+Результаты выводятся таблицей или в JSON; их можно сохранить как базовую линию и сравнивать с ней
+последующие запуски.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import PIL
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageStat
+
+from .cli import parse_formats
+from .engine import ConversionOptions, convert_images, parse_widths
+from .resize import resize_renditions
+from .server import RenditionServer, latency_summary
+from .shared import FrameRef, SharedFrame, attached_image, start_tracker
+from .stream import PREMULTIPLIED_MODES, STRIP_HEIGHT, open_image, stream_renditions, strip_reader
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Размеры исходников по умолчанию: от фото с телефона до снимка с полнокадровой камеры
+DEFAULT_SOURCE_SIZES = ((1920, 1080), (4000, 3000), (6000, 4000))
+
+# Размеры исходников для быстрого прогона
+QUICK_SOURCE_SIZES = ((1280, 720),)
+
+# Режимы и типы содержимого синтетических исходников
+DEFAULT_MODES = ("RGB", "RGBA", "P")
+DEFAULT_CONTENTS = ("photo", "flat")
+
+# Формат, в котором хранится синтетический исходник каждого режима
+SOURCE_FORMATS = {"RGB": "JPEG", "RGBA": "PNG", "P": "PNG"}
+
+# Режимы исходников, которые формат не записывает: в такой формат случай не кодируется, как не стал
+# бы его выбирать и пользователь (JPEG не хранит прозрачность и палитру)
+UNWRITABLE_MODES = {"JPEG": ("RGBA", "P")}
+
+# Метрики, сравниваемые с базовой линией: имя -> True, если рост значения означает ухудшение
+COMPARED_METRICS = {
+    "decode_s": True,
+    "resize_s": True,
+    "encode_s": True,
+    "total_s": True,
+    "megapixels_per_s": False,
+    "peak_rss_mb": True,
+}
+
+# Изменения времени меньше этой величины (в секундах) считаются шумом
+MIN_TIME_DELTA = 0.005
+
+
+def synthetic_image(width, height, mode="RGB"):
+    """
+    Создаёт фотоподобное изображение: плавные градиенты с шумом, слегка размытым как после оптики.
+
+    :param width: Ширина.
+    :param height: Высота.
+    :param mode: Режим результата.
+    """
+    gradient = Image.linear_gradient("L").resize((width, height))
+    radial = Image.radial_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    img = Image.merge("RGB", (
+        gradient,
+        Image.blend(radial, noise, 0.5),
+        Image.blend(gradient.transpose(Image.FLIP_LEFT_RIGHT), noise, 0.3),
+    ))
+    return with_mode(img.filter(ImageFilter.GaussianBlur(1)), mode, radial)
+
+
+def synthetic_flat_image(width, height, mode="RGB"):
+    """
+    Создаёт плоское изображение, похожее на графику или скриншот: заливки и фигуры в несколько цветов.
+
+    :param width: Ширина.
+    :param height: Высота.
+    :param mode: Режим результата.
+    """
+    img = Image.new("RGB", (width, height), (240, 240, 235))
+    draw = ImageDraw.Draw(img)
+    colors = ((52, 112, 131), (76, 175, 80), (230, 126, 34), (44, 62, 80))
+    step = max(1, min(width, height) // 8)
+    for i in range(0, width, step):
+        for j in range(0, height, step):
+            color = colors[(i // step + j // step) % len(colors)]
+            if (i // step + 2 * (j // step)) % 3 == 0:
+                draw.rectangle((i, j, i + step // 2, j + step // 2), fill=color)
+            else:
+                draw.ellipse((i, j, i + step - 2, j + step - 2), outline=color, width=max(1, step // 16))
+    return with_mode(img, mode, Image.linear_gradient("L").resize((width, height)))
+
+
+def with_mode(img, mode, alpha):
+    """
+    Переводит RGB-изображение в нужный режим; для RGBA используется переданный альфа-канал.
+    """
+    if mode == "RGBA":
+        img = img.copy()
+        img.putalpha(alpha)
+        return img
+    if mode == "P":
+        return img.convert("P", palette=Image.ADAPTIVE, colors=256)
+    return img.convert(mode)
+
+
+def generate_source(directory, size, mode, content):
+    """
+    Генерирует и сохраняет синтетический исходник.
+
+    :param directory: Папка для сохранения.
+    :param size: Размер (ширина, высота).
+    :param mode: Режим.
+    :param content: "photo" или "flat".
+    :return: Путь к файлу.
+    """
+    factory = synthetic_image if content == "photo" else synthetic_flat_image
+    fmt = SOURCE_FORMATS.get(mode, "PNG")
+    path = os.path.join(directory, f"{size[0]}x{size[1]}-{mode}-{content}.{fmt.lower()}")
+    params = {"quality": 92} if fmt == "JPEG" else {"compress_level": 1}
+    factory(size[0], size[1], mode).save(path, fmt, **params)
+    return path
+
+
+def peak_rss_mb():
+    """
+    Пиковый объём резидентной памяти текущего процесса в МБ или None, если он недоступен.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux значение в килобайтах, в macOS — в байтах
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_pipeline_case(source_path, widths, formats, options, repeat, out_dir):
+    """
+    Прогоняет один исходник через конвейер (engine.convert_images) и замеряет стадии.
+
+    Каждый повтор пишет в новую папку результатов, поэтому ничего не берётся из манифеста сборки,
+    а в замер входят и пул потоков кодирования, и запись манифеста, code.txt и images.json.
+    Время стадий берётся из отрезков результатов (OutputResult.spans); для каждой стадии
+    учитывается лучшее время из repeat повторов. Функция выполняется в отдельном процессе
+    (см. benchmark_pipeline).
+
+    :return: Словарь с результатами случая.
+    """
+    with open_image(source_path) as img:
+        source_size = img.size
+        mode = img.mode
+    best = {"decode_s": float("inf"), "resize_s": float("inf"), "encode_s": float("inf"), "total_s": float("inf")}
+    encode_by_format = {fmt: float("inf") for fmt in formats}
+    output_bytes = {fmt: 0 for fmt in formats}
+    errors = set()
+    cpu_start = time.process_time()
+
+    for attempt in range(repeat):
+        output_folder = os.path.join(out_dir, str(attempt))
+        os.makedirs(output_folder)
+        started = time.perf_counter()
+        report = convert_images([source_path], widths, formats, output_folder, options=options)
+        total = time.perf_counter() - started
+
+        totals = report.stage_totals()
+        format_times = {fmt: 0.0 for fmt in formats}
+        sizes = {fmt: 0 for fmt in formats}
+        for result in report.results:
+            format_times[result.fmt] += sum(span[2] for span in result.spans if span[0] == "encode")
+            if result.ok:
+                sizes[result.fmt] += result.size_bytes or 0
+            else:
+                errors.add(f"{result.fmt}: {result.error}")
+        errors.update(report.errors)
+
+        best["decode_s"] = min(best["decode_s"], totals["decode"])
+        best["resize_s"] = min(best["resize_s"], totals["resize"])
+        best["encode_s"] = min(best["encode_s"], totals["encode"])
+        best["total_s"] = min(best["total_s"], total)
+        for fmt in formats:
+            encode_by_format[fmt] = min(encode_by_format[fmt], format_times[fmt])
+        output_bytes = sizes
+
+    megapixels = source_size[0] * source_size[1] / 1e6
+    case = {key: round(value, 4) for key, value in best.items()}
+    case.update({
+        "source_mode": mode,
+        "source_megapixels": round(megapixels, 2),
+        "encode_by_format_s": {fmt: round(value, 4) for fmt, value in encode_by_format.items()},
+        "output_bytes": output_bytes,
+        "megapixels_per_s": round(megapixels / best["total_s"], 2) if best["total_s"] else None,
+        "cpu_s": round((time.process_time() - cpu_start) / repeat, 4),
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": sorted(errors),
+    })
+    return case
+
+
+def _run_case_in_child(args):
+    source_path, widths, formats, options, repeat = args
+    with tempfile.TemporaryDirectory(prefix="optimagegen-bench-out-") as out_dir:
+        return run_pipeline_case(source_path, widths, formats, options, repeat, out_dir)
+
+
+def benchmark_pipeline(source_sizes=DEFAULT_SOURCE_SIZES, modes=DEFAULT_MODES, contents=DEFAULT_CONTENTS,
+                       widths=(400, 800, 1200), formats=("WEBP",), options=None, repeat=3, on_case=None):
+    """
+    Прогоняет конвейер конвертации (декодирование → масштабирование → кодирование → запись) на
+    синтетических исходниках.
+
+    :param source_sizes: Размеры исходников.
+    :param modes: Режимы исходников.
+    :param contents: Типы содержимого ("photo", "flat").
+    :param widths: Список ширин.
+    :param formats: Список форматов; форматы, не записывающие режим исходника (см. UNWRITABLE_MODES),
+                    в случае этого режима пропускаются.
+    :param options: ConversionOptions; по умолчанию — параметры по умолчанию.
+    :param repeat: Число повторов каждого случая; учитывается лучшее время.
+    :param on_case: Функция, вызываемая с именем и результатом каждого завершённого случая.
+    :return: Словарь {"meta": сведения о запуске, "cases": {имя случая: результаты}}.
+    """
+    options = options or ConversionOptions()
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "widths": list(widths),
+            "formats": list(formats),
+            "repeat": repeat,
+            "options": options.cache_key(),
+        },
+        "cases": {},
+    }
+    # Каждый случай — в свежем процессе, чтобы пиковая память не наследовалась от предыдущих
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="optimagegen-bench-") as directory:
+        for size in source_sizes:
+            for mode in modes:
+                for content in contents:
+                    case_formats = [fmt for fmt in formats if mode not in UNWRITABLE_MODES.get(fmt, ())]
+                    if not case_formats:
+                        continue
+                    name = f"{size[0]}x{size[1]}-{mode}-{content}"
+                    source_path = generate_source(directory, size, mode, content)
+                    with context.Pool(1) as pool:
+                        case = pool.apply(_run_case_in_child,
+                                          ((source_path, list(widths), case_formats, options, repeat),))
+                    case["formats"] = case_formats
+                    report["cases"][name] = case
+                    if on_case:
+                        on_case(name, case)
+    return report
+
+
+def compare_with_baseline(report, baseline, threshold=0.1):
+    """
+    Сравнивает результаты с базовой линией.
+
+    :param report: Результаты benchmark_pipeline.
+    :param baseline: Результаты предыдущего запуска в том же формате.
+    :param threshold: Допустимое относительное ухудшение (0.1 — 10%).
+    :return: Список регрессий: словари {"case", "metric", "baseline", "current", "change"}.
+    """
+    regressions = []
+    for name, case in report["cases"].items():
+        base_case = baseline.get("cases", {}).get(name)
+        if not base_case:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            current, previous = case.get(metric), base_case.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            worse = change > threshold if higher_is_worse else change < -threshold
+            if metric.endswith("_s") and abs(current - previous) < MIN_TIME_DELTA:
+                worse = False
+            if worse:
+                regressions.append({
+                    "case": name,
+                    "metric": metric,
+                    "baseline": previous,
+                    "current": current,
+                    "change": round(change, 3),
+                })
+    return regressions
+
+
+def print_case(name, case):
+    """
+    Выводит строку таблицы с результатами одного случая.
+    """
+    rss = f"{case['peak_rss_mb']:.0f}" if case["peak_rss_mb"] is not None else "—"
+    print(f"{name:<28} {case['decode_s']:>9.3f} {case['resize_s']:>9.3f} {case['encode_s']:>9.3f} "
+          f"{case['total_s']:>9.3f} {case['megapixels_per_s']:>8.1f} {rss:>8}")
+    for error in case["errors"]:
+        print(f"    ошибка: {error}")
+
+
+def print_header():
+    """
+    Выводит заголовок таблицы результатов.
+    """
+    print(f"{'Случай':<28} {'Декод, с':>9} {'Масшт, с':>9} {'Кодир, с':>9} {'Всего, с':>9} "
+          f"{'Мп/с':>8} {'Пик, МБ':>8}")
+
+
+def timed(func):
+    """
+    Выполняет функцию и возвращает её результат и затраченное процессорное время в секундах.
+    """
+    start = time.process_time()
+    result = func()
+    return result, time.process_time() - start
+
+
+def mean_difference(first, second):
+    """
+    Средняя абсолютная разница значений пикселей двух изображений (0-255).
+    """
+    diff = ImageChops.difference(first.convert("RGB"), second.convert("RGB"))
+    return sum(ImageStat.Stat(diff).mean) / 3
+
+
+def benchmark_resize(source_sizes=DEFAULT_SOURCE_SIZES, widths=(400, 800, 1200), repeat=3):
+    """
+    Сравнивает масштабирование каждой ширины из исходника с каскадным планом.
+
+    :param source_sizes: Размеры синтетических исходников.
+    :param widths: Список ширин.
+    :param repeat: Число повторов; учитывается лучшее время.
+    :return: Список словарей с результатами по каждому исходнику.
+    """
+    rows = []
+    for width, height in source_sizes:
+        img = synthetic_image(width, height)
+        img.load()
+
+        direct_time = cascade_time = float("inf")
+        for _ in range(repeat):
+            direct, elapsed = timed(lambda: dict(resize_renditions(img, widths, cascade=False)))
+            direct_time = min(direct_time, elapsed)
+            cascade, elapsed = timed(lambda: dict(resize_renditions(img, widths, cascade=True)))
+            cascade_time = min(cascade_time, elapsed)
+
+        rows.append({
+            "source": f"{width}x{height}",
+            "widths": list(widths),
+            "direct_cpu_s": round(direct_time, 4),
+            "cascade_cpu_s": round(cascade_time, 4),
+            "cpu_saved_s": round(direct_time - cascade_time, 4),
+            "speedup": round(direct_time / cascade_time, 2) if cascade_time else None,
+            # Наибольшее среди ширин среднее отклонение от прямого LANCZOS
+            "max_mean_diff": round(max(mean_difference(direct[w], cascade[w]) for w in widths), 3),
+        })
+    return rows
+
+
+def print_resize_table(rows):
+    """
+    Выводит результаты benchmark_resize в виде таблицы.
+    """
+    print(f"{'Исходник':>12} {'Прямо, с':>10} {'Каскад, с':>10} {'Экономия, с':>12} {'Ускорение':>10} {'Отклонение':>11}")
+    for row in rows:
+        print(f"{row['source']:>12} {row['direct_cpu_s']:>10.3f} {row['cascade_cpu_s']:>10.3f} "
+              f"{row['cpu_saved_s']:>12.3f} {row['speedup']:>9.2f}x {row['max_mean_diff']:>11.3f}")
+
+
+def generate_raw_source(directory, size, mode):
+    """
+    Генерирует исходник без сжатия, который читается полосами: PPM/PGM для RGB и L (записывается
+    полосами, поэтому годится и для очень крупных размеров) и TIFF для RGBA.
+
+    :return: Путь к файлу.
+    """
+    width, height = size
+    if mode == "RGBA":
+        path = os.path.join(directory, f"{width}x{height}-{mode}.tif")
+        synthetic_image(width, height, mode).save(path)
+        return path
+    path = os.path.join(directory, f"{width}x{height}-{mode}.{'ppm' if mode == 'RGB' else 'pgm'}")
+    with open(path, "wb") as f:
+        f.write(f"{'P6' if mode == 'RGB' else 'P5'}\n{width} {height}\n255\n".encode())
+        for top in range(0, height, STRIP_HEIGHT):
+            rows = min(STRIP_HEIGHT, height - top)
+            # Полосы отличаются поворотом узора, чтобы их границы попадали в результат
+            strip = synthetic_image(width, STRIP_HEIGHT, mode).rotate(top % 360, fillcolor=top % 256)
+            f.write(strip.tobytes()[:len(strip.tobytes()) * rows // STRIP_HEIGHT])
+    return path
+
+
+def _streaming_case(args):
+    # Масштабирование в отдельном процессе: пиковая память не зависит от предыдущих случаев
+    source_path, widths, streamed = args
+    started = time.perf_counter()
+    img = open_image(source_path)
+    if streamed:
+        renditions = dict(stream_renditions(img, strip_reader(img), widths, False, img.size))
+    else:
+        img.load()
+        renditions = dict(resize_renditions(img, widths, False, img.size))
+    elapsed = time.perf_counter() - started
+    return {
+        "time_s": round(elapsed, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "renditions": {width: (r.mode, r.size, r.tobytes()) for width, r in renditions.items()},
+    }
+
+
+def benchmark_streaming(source_sizes=DEFAULT_SOURCE_SIZES, modes=("RGB", "RGBA"), widths=(400, 800, 1200)):
+    """
+    Сравнивает потоковое масштабирование (см. stream) с LANCZOS по исходнику в памяти.
+
+    Оба способа строят каждую ширину прямо из исходника (без каскада), каждый — в отдельном процессе.
+
+    :param source_sizes: Размеры синтетических исходников.
+    :param modes: Режимы исходников (RGB, L, RGBA); палитровые исходники полосами не читаются и пропускаются.
+    :param widths: Список ширин.
+    :return: Список словарей с результатами по каждому исходнику.
+    """
+    rows = []
+    # Пиковая память наследуется при запуске процесса (Linux сохраняет её и при exec), поэтому случаи
+    # запускаются через сервер процессов с небольшой памятью, а исходники генерируются не в этом процессе
+    context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+                                          else "spawn")
+    with tempfile.TemporaryDirectory(prefix="optimagegen-bench-") as directory:
+        for size in source_sizes:
+            for mode in modes:
+                if mode not in ("RGB", "L", "RGBA"):
+                    continue
+                with context.Pool(1) as pool:
+                    source_path = pool.apply(generate_raw_source, (directory, size, mode))
+                cases = {}
+                for streamed in (False, True):
+                    with context.Pool(1) as pool:
+                        cases[streamed] = pool.apply(_streaming_case, ((source_path, list(widths), streamed),))
+                differences = {}
+                for width, (rendition_mode, rendition_size, data) in cases[False]["renditions"].items():
+                    in_memory = Image.frombytes(rendition_mode, rendition_size, data)
+                    streamed_img = Image.frombytes(*cases[True]["renditions"][width])
+                    if rendition_mode in PREMULTIPLIED_MODES:
+                        # Цвет почти прозрачных пикселей после деления на альфу сильно меняется от
+                        # единицы округления, но не виден; отклонение считается в предумноженном виде
+                        in_memory = in_memory.convert(PREMULTIPLIED_MODES[rendition_mode])
+                        streamed_img = streamed_img.convert(PREMULTIPLIED_MODES[rendition_mode])
+                    diff = ImageChops.difference(in_memory, streamed_img)
+                    differences[width] = {
+                        "max_diff": max(band.getextrema()[1] for band in diff.split()),
+                        "mean_diff": round(sum(ImageStat.Stat(diff).mean) / len(diff.getbands()), 5),
+                    }
+                rows.append({
+                    "source": f"{size[0]}x{size[1]}-{mode}",
+                    "in_memory_s": cases[False]["time_s"],
+                    "streamed_s": cases[True]["time_s"],
+                    "in_memory_peak_mb": cases[False]["peak_rss_mb"],
+                    "streamed_peak_mb": cases[True]["peak_rss_mb"],
+                    "max_diff": max(item["max_diff"] for item in differences.values()),
+                    "widths": differences,
+                })
+                os.remove(source_path)
+    return rows
+
+
+def print_streaming_table(rows):
+    """
+    Выводит результаты benchmark_streaming в виде таблицы.
+    """
+    print(f"{'Исходник':>16} {'Память, с':>10} {'Поток, с':>9} {'Пик памяти, МБ':>15} {'Пик потока, МБ':>15} "
+          f"{'Откл.':>6}")
+    for row in rows:
+        print(f"{row['source']:>16} {row['in_memory_s']:>10.2f} {row['streamed_s']:>9.2f} "
+              f"{row['in_memory_peak_mb'] or 0:>15.0f} {row['streamed_peak_mb'] or 0:>15.0f} {row['max_diff']:>6}")
+
+
+def _handoff_receiver(conn):
+    # Процесс-получатель: принимает изображения или описания сегментов и подтверждает приём
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        if isinstance(message, FrameRef):
+            with attached_image(message) as img:
+                img.getpixel((0, 0))
+        else:
+            message.getpixel((0, 0))
+        conn.send(True)
+
+
+def benchmark_handoff(source_sizes=DEFAULT_SOURCE_SIZES, modes=DEFAULT_MODES, widths=(400, 800, 1200), repeat=3):
+    """
+    Сравнивает передачу вариантов процессу-кодировщику через pickle и через разделяемую память.
+
+    При передаче через pickle пиксели копируются в байтовую строку (tobytes), в буфер pickle, через
+    канал (запись и чтение) и обратно в изображение (frombytes); через разделяемую память — один раз,
+    в сегмент (см. shared). Время — лучший из repeat полных обменов с отдельным процессом.
+
+    :param source_sizes: Размеры синтетических исходников.
+    :param modes: Режимы исходников; палитровые варианты через разделяемую память не передаются.
+    :param widths: Список ширин.
+    :param repeat: Число повторов; учитывается лучшее время.
+    :return: Список словарей с результатами по каждому варианту.
+    """
+    rows = []
+    start_tracker()
+    conn, child_conn = multiprocessing.Pipe()
+    receiver = multiprocessing.Process(target=_handoff_receiver, args=(child_conn,), daemon=True)
+    receiver.start()
+
+    def exchange(message):
+        started = time.perf_counter()
+        conn.send(message)
+        conn.recv()
+        return time.perf_counter() - started
+
+    try:
+        for width, height in source_sizes:
+            for mode in modes:
+                img = synthetic_image(width, height, mode)
+                for rendition_width, rendition in resize_renditions(img, widths, True, img.size):
+                    raw_bytes = len(rendition.tobytes())
+                    pickled_bytes = len(pickle.dumps(rendition, pickle.HIGHEST_PROTOCOL))
+                    pickle_time = min(exchange(rendition) for _ in range(repeat))
+                    row = {
+                        "source": f"{width}x{height}-{mode}",
+                        "width": rendition_width,
+                        "pickle_copy_bytes": 2 * raw_bytes + 3 * pickled_bytes,
+                        "pickle_ms": round(pickle_time * 1000, 2),
+                        "shared_copy_bytes": None,
+                        "copy_bytes_avoided": None,
+                        "shared_ms": None,
+                    }
+                    if SharedFrame.supported(rendition):
+                        shared_time = float("inf")
+                        for _ in range(repeat):
+                            started = time.perf_counter()
+                            with SharedFrame(rendition) as frame:
+                                exchange(frame.ref)
+                            shared_time = min(shared_time, time.perf_counter() - started)
+                        row["shared_copy_bytes"] = frame.nbytes
+                        row["copy_bytes_avoided"] = row["pickle_copy_bytes"] - frame.nbytes
+                        row["shared_ms"] = round(shared_time * 1000, 2)
+                    rows.append(row)
+    finally:
+        conn.send(None)
+        receiver.join()
+    return rows
+
+
+def print_handoff_table(rows):
+    """
+    Выводит результаты benchmark_handoff в виде таблицы.
+    """
+    print(f"{'Исходник':>16} {'Ширина':>7} {'pickle, МБ':>11} {'Общая, МБ':>10} {'Избежано, МБ':>13} "
+          f"{'pickle, мс':>11} {'Общая, мс':>10}")
+    megabyte = 1024 * 1024
+    for row in rows:
+        shared = row["shared_copy_bytes"] is not None
+        shared_mb = f"{row['shared_copy_bytes'] / megabyte:>10.2f}" if shared else f"{'—':>10}"
+        avoided_mb = f"{row['copy_bytes_avoided'] / megabyte:>13.2f}" if shared else f"{'—':>13}"
+        shared_ms = f"{row['shared_ms']:>10.2f}" if shared else f"{'—':>10}"
+        print(f"{row['source']:>16} {row['width']:>7} {row['pickle_copy_bytes'] / megabyte:>11.2f} {shared_mb} "
+              f"{avoided_mb} {row['pickle_ms']:>11.2f} {shared_ms}")
+
+
+async def fetch(reader, writer, path):
+    """
+    Отправляет GET-запрос по открытому соединению и дочитывает ответ.
+
+    :return: Статус ответа.
+    """
+    writer.write(f"GET /{path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return int(head.split(b" ", 2)[1])
+
+
+async def load(port, paths, concurrency):
+    """
+    Запрашивает пути concurrency клиентами с постоянными соединениями.
+
+    :return: Сводка задержек (см. server.latency_summary) с числом ошибок и запросов в секунду.
+    """
+    queue = list(reversed(paths))
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while queue:
+                path = queue.pop()
+                started = time.perf_counter()
+                if await fetch(reader, writer, path) != 200:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    summary = latency_summary(latencies)
+    summary["errors"] = errors
+    summary["requests_per_s"] = round(len(latencies) / elapsed, 1) if elapsed else None
+    return summary
+
+
+def benchmark_server(source_sizes=QUICK_SOURCE_SIZES, widths=(400, 800, 1200), formats=("WEBP",), options=None,
+                     sources=8, concurrency=8, rounds=3, workers=0, on_phase=None):
+    """
+    Нагрузочный замер сервера вариантов (см. server.RenditionServer) на синтетических исходниках.
+
+    Фазы: cold — каждый вариант запрашивается впервые и собирается; disk — после очистки кэша
+    в памяти варианты отдаются с диска; memory — rounds проходов по всем вариантам из памяти.
+    Клиенты работают в том же процессе и цикле событий, что и сервер, поэтому задержки включают
+    их накладные расходы; сборка идёт в пуле процессов сервера.
+
+    :param source_sizes: Размеры исходников.
+    :param widths: Список ширин.
+    :param formats: Список форматов.
+    :param options: ConversionOptions; по умолчанию — параметры по умолчанию.
+    :param sources: Сколько исходников каждого размера (копии под разными именами).
+    :param concurrency: Число одновременных клиентов.
+    :param rounds: Число проходов фазы memory.
+    :param workers: Число процессов сборки сервера; 0 — по числу ядер.
+    :param on_phase: Функция, вызываемая с именем и результатом каждой завершённой фазы.
+    :return: Словарь {"meta": сведения о запуске, "phases": {фаза: сводка задержек}}.
+    """
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "widths": list(widths),
+            "formats": list(formats),
+            "sources": sources * len(source_sizes),
+            "concurrency": concurrency,
+            "rounds": rounds,
+        },
+        "phases": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="optimagegen-bench-") as directory:
+        source_dir = os.path.join(directory, "src")
+        out_dir = os.path.join(directory, "out")
+        os.makedirs(source_dir)
+        os.makedirs(out_dir)
+        paths = []
+        for size in source_sizes:
+            template = generate_source(directory, size, "RGB", "photo")
+            base_name, ext = os.path.splitext(os.path.basename(template))
+            for i in range(sources):
+                shutil.copyfile(template, os.path.join(source_dir, f"{base_name}-{i}{ext}"))
+                paths.extend(f"{base_name}-{i}-{width}w.{'jpg' if fmt == 'JPEG' else fmt.lower()}"
+                             for width in widths for fmt in formats)
+        server = RenditionServer([source_dir], out_dir, widths, formats, options=options, workers=workers)
+        report["meta"]["workers"] = server.workers
+
+        async def run():
+            await server.start("127.0.0.1", 0)
+            try:
+                for phase, phase_paths in (("cold", paths), ("disk", paths), ("memory", paths * rounds)):
+                    if phase == "disk":
+                        server.cache.clear()
+                    result = await load(server.port, phase_paths, concurrency)
+                    report["phases"][phase] = result
+                    if on_phase:
+                        on_phase(phase, result)
+            finally:
+                await server.close()
+
+        asyncio.run(run())
+    return report
+
+
+def print_server_header():
+    """
+    Выводит заголовок таблицы нагрузочного замера сервера.
+    """
+    print(f"{'Фаза':<8} {'Запросов':>9} {'p50, мс':>9} {'p90, мс':>9} {'p99, мс':>9} {'Макс, мс':>9} "
+          f"{'Запр/с':>8} {'Ошибок':>7}")
+
+
+def print_server_phase(name, phase):
+    """
+    Выводит строку таблицы с результатами одной фазы нагрузочного замера.
+    """
+    print(f"{name:<8} {phase['count']:>9} {phase['p50_ms']:>9.2f} {phase['p90_ms']:>9.2f} {phase['p99_ms']:>9.2f} "
+          f"{phase['max_ms']:>9.2f} {phase['requests_per_s']:>8.1f} {phase['errors']:>7}")
+
+
+def parse_sizes(sizes_input):
+    """
+    Разбирает список размеров вида "1920x1080,4000x3000".
+    """
+    sizes = []
+    for item in sizes_input.split(","):
+        try:
+            width, height = (int(v) for v in item.lower().strip().split("x"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"некорректный размер: {item}")
+        sizes.append((width, height))
+    return sizes
+
+
+def save_json(data, path):
+    """
+    Сохраняет результаты замеров в JSON-файл.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {path}")
+
+
+def build_parser():
+    """
+    Создаёт парсер аргументов замеров.
+    """
+    parser = argparse.ArgumentParser(prog="image_converter.py --benchmark",
+                                     description="Замеры производительности конвейера конвертации.")
+    parser.add_argument("--benchmark", action="store_true", help="режим замеров")
+    parser.add_argument("-w", "--widths", default="400,800,1200", help="ширины через запятую")
+    parser.add_argument("-f", "--formats", type=parse_formats, default=["WEBP", "JPEG", "PNG"],
+                        help="форматы через запятую (по умолчанию webp,jpeg,png)")
+    parser.add_argument("--sizes", type=parse_sizes, help="размеры исходников, например 1920x1080,4000x3000")
+    parser.add_argument("--modes", default=",".join(DEFAULT_MODES), help="режимы исходников (RGB,RGBA,P)")
+    parser.add_argument("--contents", default=",".join(DEFAULT_CONTENTS), help="содержимое (photo,flat)")
+    parser.add_argument("--quick", action="store_true", help="быстрый прогон на маленьком исходнике")
+    parser.add_argument("--repeat", type=int, default=3, help="число повторов (по умолчанию 3)")
+    parser.add_argument("--no-cascade", action="store_true", help="без каскадного масштабирования")
+    parser.add_argument("--no-draft", action="store_true", help="без уменьшенного декодирования JPEG")
+    parser.add_argument("--json", metavar="FILE", help="сохранить результаты в JSON ('-' — вывести)")
+    parser.add_argument("--baseline", metavar="FILE", help="сравнить с базовой линией из JSON-файла")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="допустимое ухудшение относительно базовой линии, %% (по умолчанию 10)")
+    parser.add_argument("--compare-cascade", action="store_true",
+                        help="только сравнить прямое и каскадное масштабирование")
+    parser.add_argument("--compare-streaming", action="store_true",
+                        help="сравнить потоковое масштабирование с масштабированием в памяти (время, пик памяти, "
+                             "отклонение)")
+    parser.add_argument("--handoff", action="store_true",
+                        help="сравнить передачу вариантов кодировщику через pickle и разделяемую память")
+    parser.add_argument("--server", action="store_true",
+                        help="нагрузочный замер сервера вариантов: задержки холодных запросов, "
+                             "с диска и из памяти (--repeat — число проходов из памяти)")
+    parser.add_argument("--concurrency", type=int, default=8, metavar="N",
+                        help="число одновременных клиентов для --server (по умолчанию 8)")
+    parser.add_argument("--server-sources", type=int, default=8, metavar="N",
+                        help="исходников каждого размера для --server (по умолчанию 8)")
+    parser.add_argument("-j", "--workers", type=int, default=0, metavar="N",
+                        help="процессов сборки сервера для --server (по умолчанию 0 — по числу ядер)")
+    return parser
+
+
+def main(argv=None):
+    """
+    Точка входа замеров.
+
+    :param argv: Аргументы командной строки без имени программы.
+    :return: Код возврата: 0 — без регрессий, 1 — найдены регрессии относительно базовой линии.
+    """
+    args = build_parser().parse_args(argv)
+    widths = parse_widths(args.widths)
+
+    if args.compare_cascade:
+        rows = benchmark_resize(args.sizes or DEFAULT_SOURCE_SIZES, widths, args.repeat)
+        if args.json == "-":
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            print_resize_table(rows)
+            if args.json:
+                save_json(rows, args.json)
+        return 0
+
+    sizes = args.sizes or (QUICK_SOURCE_SIZES if args.quick else DEFAULT_SOURCE_SIZES)
+    if args.compare_streaming:
+        rows = benchmark_streaming(sizes, [m.strip() for m in args.modes.split(",") if m.strip()], widths)
+        if args.json == "-":
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            print_streaming_table(rows)
+            if args.json:
+                save_json(rows, args.json)
+        return 0
+    if args.handoff:
+        rows = benchmark_handoff(sizes, [m.strip() for m in args.modes.split(",") if m.strip()], widths,
+                                 args.repeat)
+        if args.json == "-":
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            print_handoff_table(rows)
+            if args.json:
+                save_json(rows, args.json)
+        return 0
+
+    options = ConversionOptions(cascade=not args.no_cascade, draft=not args.no_draft)
+
+    if args.server:
+        to_stdout = args.json == "-"
+        if not to_stdout:
+            print_server_header()
+        report = benchmark_server(args.sizes or QUICK_SOURCE_SIZES, widths, args.formats, options,
+                                  args.server_sources, args.concurrency, args.repeat, args.workers,
+                                  on_phase=None if to_stdout else print_server_phase)
+        if to_stdout:
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        elif args.json:
+            save_json(report, args.json)
+        return 0
+
+    to_stdout = args.json == "-"
+    if not to_stdout:
+        print_header()
+    report = benchmark_pipeline(
+        sizes,
+        [m.strip() for m in args.modes.split(",") if m.strip()],
+        [c.strip() for c in args.contents.split(",") if c.strip()],
+        widths,
+        args.formats,
+        options,
+        args.repeat,
+        on_case=None if to_stdout else print_case,
+    )
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = compare_with_baseline(report, baseline, args.threshold / 100)
+        if report["regressions"]:
+            exit_code = 1
+        if not to_stdout:
+            if report["regressions"]:
+                print(f"\nРегрессии относительно {args.baseline} (порог {args.threshold:g}%):")
+                for item in report["regressions"]:
+                    print(f"  {item['case']}: {item['metric']} {item['baseline']} → {item['current']} "
+                          f"({item['change']:+.0%})")
+            else:
+                print(f"\nРегрессий относительно {args.baseline} нет (порог {args.threshold:g}%).")
+
+    if to_stdout:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    elif args.json:
+        save_json(report, args.json)
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,331 @@
+"""
+Манифест сборки для инкрементальной конвертации.
+
+В папке результатов хранится файл .optimagegen-manifest.json. Для каждого выходного файла (по пути
+относительно этой папки) в нём записаны хеш содержимого исходника, ширина, формат, параметры
+сохранения и параметры конвейера. Если всё это совпадает с текущим запуском и файл на месте,
+повторно он не кодируется.
+
+Чтобы не перечитывать неизменённые исходники, для каждого из них запоминаются размер и время
+изменения: при совпадении используется сохранённый хеш.
+
+Манифест целиком перезаписывается лишь изредка, а изменения после каждого исходника дописываются
+в журнал .optimagegen-journal.jsonl. При загрузке журнал применяется поверх манифеста, поэтому после
+сбоя или принудительного завершения повторный запуск пропускает всё, что успело сохраниться.
+"""
+import hashlib
+import json
+import os
+
+# Имя файла манифеста в папке результатов
+MANIFEST_FILENAME = ".optimagegen-manifest.json"
+
+# Версия формата манифеста; при несовпадении манифест считается пустым
+MANIFEST_VERSION = 1
+
+# Имя журнала изменений манифеста, ещё не перенесённых в сам манифест
+JOURNAL_FILENAME = ".optimagegen-journal.jsonl"
+
+# Имя файла с описанием незавершённого задания (см. save_job)
+JOB_FILENAME = ".optimagegen-job.json"
+
+# Размер блока чтения при хешировании
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    """
+    Вычисляет SHA-256 содержимого файла.
+
+    :param path: Путь к файлу.
+    :return: Шестнадцатеричная строка хеша.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_state(source_path, known_state=None):
+    """
+    Возвращает размер, время изменения и хеш исходника.
+
+    :param source_path: Путь к исходнику.
+    :param known_state: Ранее сохранённое состояние; его хеш используется повторно, если размер и
+                        время изменения файла не поменялись.
+    :return: Словарь {"size", "mtime_ns", "sha256"}.
+    """
+    stat = os.stat(source_path)
+    if known_state and known_state.get("size") == stat.st_size and known_state.get("mtime_ns") == stat.st_mtime_ns:
+        return dict(known_state)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_digest(source_path)}
+
+
+def output_key(source_sha256, width, fmt, save_params, pipeline):
+    """
+    Формирует запись манифеста, описывающую, из чего и как получен выходной файл.
+
+    :param source_sha256: Хеш содержимого исходника.
+    :param width: Ширина.
+    :param fmt: Формат.
+    :param save_params: Параметры сохранения формата.
+    :param pipeline: Параметры конвейера, влияющие на пиксели (ConversionOptions.cache_key()).
+    """
+    return {
+        "source_sha256": source_sha256,
+        "width": width,
+        "format": fmt,
+        "params": dict(save_params),
+        "pipeline": dict(pipeline),
+    }
+
+
+class SourceCache:
+    """
+    Сведения манифеста об одном исходнике.
+
+    Объект передаётся в рабочий процесс вместе с задачей, поэтому содержит только простые данные.
+    """
+
+    def __init__(self, state=None, outputs=None):
+        """
+        :param state: Сохранённое состояние исходника (см. source_state) или None.
+        :param outputs: Словарь {путь к выходному файлу: запись манифеста}.
+        """
+        self.state = state
+        self.outputs = outputs or {}
+
+    def is_fresh(self, out_path, key):
+        """
+        Проверяет, что выходной файл существует и получен с теми же параметрами. Файл, удалённый
+        как лишний (см. engine.prune_renditions), считается актуальным без проверки на диске.
+
+        :param out_path: Путь к выходному файлу.
+        :param key: Запись, сформированная output_key для текущего запуска.
+        """
+        entry = self.outputs.get(out_path)
+        if not entry or any(entry.get(name) != value for name, value in key.items()):
+            return False
+        if entry.get("pruned"):
+            return True
+        try:
+            return os.path.getsize(out_path) == entry.get("bytes")
+        except OSError:
+            return False
+
+
+class BuildManifest:
+    """
+    Манифест сборки в папке результатов.
+    """
+
+    def __init__(self, output_folder, data=None):
+        """
+        :param output_folder: Папка результатов.
+        :param data: Содержимое манифеста; по умолчанию — пустой манифест.
+        """
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, MANIFEST_FILENAME)
+        self.journal_path = os.path.join(output_folder, JOURNAL_FILENAME)
+        data = data if data and data.get("version") == MANIFEST_VERSION else {}
+        self.sources = data.get("sources", {})
+        self.outputs = data.get("outputs", {})
+        self.dirty = False
+        self._journal = []  # Изменения, ещё не дописанные в журнал
+
+    def output_name(self, out_path):
+        """
+        Ключ выходного файла в манифесте: путь относительно папки результатов с разделителем "/"
+        (для файлов в самой папке — просто имя файла).
+        """
+        return os.path.relpath(out_path, self.output_folder).replace(os.sep, "/")
+
+    def is_output(self, path):
+        """
+        Проверяет, записан ли файл в манифест как результат конвертации. Нужно, чтобы при обходе
+        папки, совпадающей с папкой результатов, не принимать результаты прошлых запусков за исходники.
+        """
+        try:
+            return self.output_name(path) in self.outputs
+        except ValueError:
+            return False  # Файл на другом диске (Windows)
+
+    @classmethod
+    def load(cls, output_folder):
+        """
+        Загружает манифест из папки результатов; повреждённый или отсутствующий манифест
+        считается пустым.
+
+        :param output_folder: Папка результатов.
+        """
+        try:
+            with open(os.path.join(output_folder, MANIFEST_FILENAME), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        manifest = cls(output_folder, data if isinstance(data, dict) else None)
+        manifest.replay_journal()
+        return manifest
+
+    def replay_journal(self):
+        """
+        Применяет журнал, оставшийся от прерванного запуска. Недописанная последняя строка
+        (процесс завершён посреди записи) пропускается.
+        """
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                op, name, value = json.loads(line)
+            except ValueError:
+                break
+            if op == "source":
+                self.sources[name] = value
+            elif op == "output":
+                self.outputs[name] = value
+            elif op == "forget":
+                self.outputs.pop(name, None)
+            self.dirty = True
+
+    def flush_journal(self):
+        """
+        Дописывает накопленные изменения в журнал. Вызывается после каждого исходника, чтобы
+        принудительное завершение процесса теряло не больше одного исходника.
+        """
+        if not self._journal:
+            return
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in self._journal))
+        self._journal = []
+
+    def lookup(self, source_path, out_paths):
+        """
+        Возвращает сведения об исходнике и его выходных файлах для передачи в задачу.
+
+        :param source_path: Путь к исходнику.
+        :param out_paths: Пути к выходным файлам исходника.
+        :return: SourceCache.
+        """
+        outputs = {}
+        for out_path in out_paths:
+            entry = self.outputs.get(self.output_name(out_path))
+            if entry is not None:
+                outputs[out_path] = entry
+        return SourceCache(self.sources.get(os.path.abspath(source_path)), outputs)
+
+    def source(self, source_path):
+        """
+        Возвращает сохранённое состояние исходника (см. source_state) или None.
+        """
+        return self.sources.get(os.path.abspath(source_path))
+
+    def is_pruned(self, out_path):
+        """
+        Проверяет, записан ли выходной файл как удалённый лишний вариант.
+        """
+        return bool(self.outputs.get(self.output_name(out_path), {}).get("pruned"))
+
+    def record_source(self, source_path, state):
+        """
+        Запоминает состояние исходника.
+        """
+        key = os.path.abspath(source_path)
+        if self.sources.get(key) != state:
+            self.sources[key] = state
+            self._journal.append(("source", key, state))
+            self.dirty = True
+
+    def record_output(self, out_path, key, size_bytes=None, pruned=False, height=None, quality=None):
+        """
+        Запоминает, из чего и как получен выходной файл.
+
+        :param out_path: Путь к выходному файлу.
+        :param key: Запись, сформированная output_key.
+        :param size_bytes: Размер файла; если не указан, считывается с диска.
+        :param pruned: Файл удалён как лишний; размер запоминается, чтобы сравнивать с ним соседние варианты.
+        :param height: Высота изображения (для images.json при следующих запусках).
+        :param quality: Подобранное качество кодирования, если оно подбиралось.
+        """
+        entry = dict(key)
+        entry["bytes"] = size_bytes if size_bytes is not None else os.path.getsize(out_path)
+        if height is not None:
+            entry["height"] = height
+        if quality is not None:
+            entry["quality"] = quality
+        if pruned:
+            entry["pruned"] = True
+        name = self.output_name(out_path)
+        self.outputs[name] = entry
+        self._journal.append(("output", name, entry))
+        self.dirty = True
+
+    def forget_output(self, out_path):
+        """
+        Удаляет запись о выходном файле (например, если сохранить его не удалось).
+        """
+        name = self.output_name(out_path)
+        if self.outputs.pop(name, None) is not None:
+            self._journal.append(("forget", name, None))
+            self.dirty = True
+
+    def save(self):
+        """
+        Атомарно записывает манифест: сначала во временный файл, затем переименованием.
+        """
+        if not self.dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "sources": self.sources, "outputs": self.outputs},
+                      f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        # Всё из журнала теперь есть в манифесте
+        self._journal = []
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+
+def save_job(output_folder, job):
+    """
+    Записывает описание задания в папку результатов, чтобы прерванную конвертацию можно было
+    продолжить (см. cli --resume). Уже готовые файлы при продолжении берутся из манифеста.
+
+    :param output_folder: Папка результатов.
+    :param job: Описание задания — простые данные, сериализуемые в JSON.
+    """
+    path = os.path.join(output_folder, JOB_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_job(output_folder):
+    """
+    Читает описание незавершённого задания.
+
+    :param output_folder: Папка результатов.
+    :return: Описание задания или None, если незавершённого задания нет.
+    """
+    try:
+        with open(os.path.join(output_folder, JOB_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def clear_job(output_folder):
+    """
+    Удаляет описание задания после его успешного завершения.
+    """
+    try:
+        os.remove(os.path.join(output_folder, JOB_FILENAME))
+    except FileNotFoundError:
+        pass
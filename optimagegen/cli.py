@@ -0,0 +1,562 @@
+"""
+Пакетный режим командной строки.
+
+Запускается командой `python image_converter.py --batch ...` или `python -m optimagegen ...` и
+выполняет тот же конвейер, что и графический интерфейс, без импорта Tkinter.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import threading
+
+from .cache import load_job
+from .engine import SUPPORTED_FORMATS, ConversionOptions, convert_images, parse_widths
+from .metadata import default_metadata_path, open_metadata
+from .placeholder import PLACEHOLDER_KINDS
+from .quality import DEFAULT_MAX_QUALITY, DEFAULT_MIN_QUALITY, QualityTarget
+from .resize import DEFAULT_UPSCALE, UPSCALE_POLICIES
+from .sources import glob_root, iter_sources
+from .spool import DEFAULT_LEASE
+
+# Флаги, при наличии которых image_converter.py не запускает графический интерфейс
+MODE_FLAGS = ("--batch", "--benchmark", "--watch", "--resume", "--serve", "--spool-worker")
+
+
+def is_cli_invocation(argv):
+    """
+    Проверяет, нужно ли обработать аргументы в режиме командной строки, а не открыть окно.
+
+    :param argv: Аргументы командной строки без имени программы.
+    """
+    return any(arg in MODE_FLAGS for arg in argv)
+
+
+def parse_formats(formats_input):
+    """
+    Разбирает список форматов, перечисленных через запятую.
+
+    :param formats_input: Строка вида "webp,jpeg".
+    :return: Список форматов в верхнем регистре.
+    """
+    formats = []
+    for fmt in formats_input.split(","):
+        fmt = fmt.strip().upper()
+        if fmt == "JPG":
+            fmt = "JPEG"
+        if not fmt:
+            continue
+        if fmt not in SUPPORTED_FORMATS:
+            raise argparse.ArgumentTypeError(f"неподдерживаемый формат: {fmt}")
+        if fmt not in formats:
+            formats.append(fmt)
+    if not formats:
+        raise argparse.ArgumentTypeError("не выбран ни один формат")
+    return formats
+
+
+def parse_widths_arg(widths_input):
+    """
+    Обёртка над parse_widths для argparse.
+    """
+    try:
+        return parse_widths(widths_input)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_ssim_arg(value):
+    """
+    Разбирает порог сходства SSIM для argparse.
+    """
+    try:
+        threshold = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"некорректный порог сходства: {value}")
+    if not 0 < threshold <= 1:
+        raise argparse.ArgumentTypeError("порог сходства должен быть в диапазоне (0, 1]")
+    return threshold
+
+
+def parse_quality_range(value):
+    """
+    Разбирает границы подбора качества вида "30-95" для argparse.
+    """
+    try:
+        low, high = (int(part) for part in value.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"некорректные границы качества: {value}")
+    if not 1 <= low <= high <= 100:
+        raise argparse.ArgumentTypeError("границы качества должны удовлетворять 1 <= MIN <= MAX <= 100")
+    return low, high
+
+
+def parse_address(value):
+    """
+    Разбирает адрес сервера вида "8080" или "0.0.0.0:8080" для argparse.
+
+    :return: Кортеж (хост, порт); хост по умолчанию — 127.0.0.1.
+    """
+    host, _, port = value.rpartition(":")
+    try:
+        port = int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"некорректный адрес: {value}")
+    if not 0 <= port <= 65535:
+        raise argparse.ArgumentTypeError(f"некорректный порт: {port}")
+    return host or "127.0.0.1", port
+
+
+def build_parser():
+    """
+    Создаёт парсер аргументов командной строки.
+    """
+    parser = argparse.ArgumentParser(
+        prog="image_converter.py --batch",
+        description="Конвертация изображений в набор ширин и форматов без графического интерфейса.",
+    )
+    parser.add_argument("--batch", action="store_true",
+                        help="пакетный режим (без графического интерфейса)")
+    parser.add_argument("sources", nargs="*", metavar="SOURCE",
+                        help="исходные изображения, папки или шаблоны имён (например, 'photos/**/*.jpg')")
+    parser.add_argument("--no-recursive", action="store_true",
+                        help="не обходить вложенные папки")
+    parser.add_argument("--keep-structure", action="store_true",
+                        help="повторять структуру подпапок исходников в папке результатов")
+    parser.add_argument("-o", "--output", metavar="DIR",
+                        help="папка для сохранения (по умолчанию — папка первого исходника)")
+    parser.add_argument("-w", "--widths", type=parse_widths_arg, default=parse_widths("400,800,1200"),
+                        help="ширины через запятую (по умолчанию 400,800,1200)")
+    parser.add_argument("-f", "--formats", type=parse_formats, default=["WEBP"],
+                        help="форматы через запятую: jpeg, png, webp (по умолчанию webp)")
+    parser.add_argument("--no-html", action="store_true",
+                        help="не генерировать HTML-код и code.txt")
+    parser.add_argument("--no-index", action="store_true",
+                        help="не записывать images.json (список вариантов с размерами в пикселях и байтах)")
+    parser.add_argument("--no-lazy", action="store_true",
+                        help='не добавлять атрибут loading="lazy"')
+    parser.add_argument("--placeholder", choices=PLACEHOLDER_KINDS,
+                        help="встраивать в HTML-код и images.json заглушку на время загрузки: "
+                             "blurhash — строка BlurHash, lqip — крошечная копия в data: URL; "
+                             "в обоих случаях и преобладающий цвет (нужна библиотека numpy)")
+    parser.add_argument("--jpeg-quality", type=int, metavar="Q",
+                        help="качество JPEG (по умолчанию 85)")
+    parser.add_argument("--webp-quality", type=int, metavar="Q",
+                        help="качество WEBP (по умолчанию 80)")
+    parser.add_argument("--webp-method", type=int, choices=range(7), metavar="M",
+                        help="метод сжатия WEBP 0-6 (по умолчанию 6)")
+    parser.add_argument("--target-kb", type=int, metavar="KB",
+                        help="подбирать качество JPEG и WEBP так, чтобы каждый вариант был не больше KB килобайт")
+    parser.add_argument("--min-ssim", type=parse_ssim_arg, metavar="S",
+                        help="подбирать наименьшее качество JPEG и WEBP со сходством SSIM не ниже S "
+                             "(например, 0.95; нужна библиотека numpy)")
+    parser.add_argument("--quality-range", type=parse_quality_range,
+                        default=(DEFAULT_MIN_QUALITY, DEFAULT_MAX_QUALITY), metavar="MIN-MAX",
+                        help=f"границы подбора качества (по умолчанию {DEFAULT_MIN_QUALITY}-{DEFAULT_MAX_QUALITY})")
+    parser.add_argument("--no-cascade", action="store_true",
+                        help="строить каждую ширину из исходника, без каскадного масштабирования")
+    parser.add_argument("--no-draft", action="store_true",
+                        help="всегда декодировать JPEG в полном разрешении")
+    parser.add_argument("--upscale", choices=UPSCALE_POLICIES, default=DEFAULT_UPSCALE,
+                        help="ширины больше исходника: allow — увеличивать, skip — пропускать, "
+                             "clamp — заменить одним вариантом в ширину исходника (по умолчанию)")
+    parser.add_argument("--prune", action="store_true",
+                        help="удалять варианты, которые не легче варианта большей ширины или "
+                             "варианта той же ширины в первом из форматов")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="не искать одинаковые исходники: кодировать каждый, даже если такой же "
+                             "файл или изображение уже сконвертировано под другим именем")
+    parser.add_argument("--no-animation", action="store_true",
+                        help="кодировать анимированные GIF и WEBP только первым кадром, без анимации в WEBP")
+    parser.add_argument("--force", action="store_true",
+                        help="пересобрать все файлы, даже если по манифесту сборки они актуальны")
+    parser.add_argument("--metadata-index", metavar="FILE",
+                        help=f"индекс размеров и хешей исходников между запусками (по умолчанию "
+                             f"{default_metadata_path()})")
+    parser.add_argument("--no-metadata-index", action="store_true",
+                        help="не использовать индекс исходников: читать заголовки и хеши из файлов")
+    parser.add_argument("-j", "--workers", type=int, default=1, metavar="N",
+                        help="число рабочих процессов (по умолчанию 1, 0 — по числу ядер)")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="бюджет памяти параллельной конвертации в МБ "
+                             "(по умолчанию — половина физической памяти, 0 — без ограничения)")
+    parser.add_argument("--encode-threads", type=int, default=0, metavar="N",
+                        help="число потоков, кодирующих форматы одного варианта параллельно "
+                             "(по умолчанию 0 — ядра делятся между процессами)")
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="при -j 1 кодировать форматы в отдельных процессах (--encode-threads), "
+                             "передавая им пиксели вариантов через разделяемую память")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="записать время стадий каждого файла в трассировку "
+                             "(.jsonl — JSON Lines, иначе формат Chrome Trace)")
+    parser.add_argument("--watch", action="store_true",
+                        help="после конвертации следить за папками SOURCE и конвертировать новые "
+                             "и изменённые изображения (завершение — Ctrl+C)")
+    parser.add_argument("--serve", type=parse_address, metavar="[HOST:]PORT",
+                        help="вместо конвертации отдавать варианты по HTTP, собирая их при первом запросе "
+                             "(исходники — папки SOURCE, дисковый кэш — папка результатов)")
+    parser.add_argument("--memory-cache", type=int, default=64, metavar="MB",
+                        help="размер кэша вариантов в памяти сервера в МБ (по умолчанию 64)")
+    parser.add_argument("--max-queue", type=int, default=64, metavar="N",
+                        help="сколько разных вариантов сервер может одновременно ждать; следующие "
+                             "холодные запросы получают 503 (по умолчанию 64)")
+    parser.add_argument("--spool", metavar="DIR",
+                        help="раздавать исходники рабочим процессам через общую папку заданий DIR "
+                             "(они запускаются с --spool-worker на этой или других машинах)")
+    parser.add_argument("--spool-worker", metavar="DIR",
+                        help="вместо конвертации выполнять задания из общей папки DIR "
+                             "(-j — число процессов, завершение — Ctrl+C)")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE, metavar="SECONDS",
+                        help="аренда задания в общей папке: задание, аренду которого рабочий процесс "
+                             f"не продлевал дольше, выполняется заново (по умолчанию {DEFAULT_LEASE:g})")
+    parser.add_argument("--once", action="store_true",
+                        help="с --spool-worker: завершиться, когда свободных заданий не останется")
+    parser.add_argument("--resume", metavar="DIR",
+                        help="продолжить прерванную конвертацию с папкой результатов DIR с теми же параметрами")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="выводить только ошибки")
+    return parser
+
+
+def save_params_from_args(args):
+    """
+    Собирает переопределения параметров сохранения из аргументов командной строки.
+    """
+    overrides = {}
+    if args.jpeg_quality is not None:
+        overrides.setdefault("JPEG", {})["quality"] = args.jpeg_quality
+    if args.webp_quality is not None:
+        overrides.setdefault("WEBP", {})["quality"] = args.webp_quality
+    if args.webp_method is not None:
+        overrides.setdefault("WEBP", {})["method"] = args.webp_method
+    return overrides
+
+
+def target_from_args(args):
+    """
+    Собирает цель подбора качества из аргументов командной строки.
+
+    :return: QualityTarget или None, если качество фиксированное.
+    """
+    if args.target_kb is None and args.min_ssim is None:
+        return None
+    low, high = args.quality_range
+    max_bytes = args.target_kb * 1024 if args.target_kb is not None else None
+    return QualityTarget(max_bytes=max_bytes, min_ssim=args.min_ssim, min_quality=low, max_quality=high)
+
+
+def metadata_from_args(args):
+    """
+    Открывает индекс исходников по аргументам командной строки; None, если он отключён или недоступен.
+    """
+    if args.no_metadata_index:
+        return None
+    metadata = open_metadata(args.metadata_index)
+    if metadata is None:
+        print("Индекс исходников недоступен: заголовки и хеши будут читаться из файлов.", file=sys.stderr)
+    return metadata
+
+
+def options_from_args(args):
+    """
+    Собирает параметры конвейера из аргументов командной строки.
+    """
+    return ConversionOptions(
+        cascade=not args.no_cascade,
+        draft=not args.no_draft,
+        incremental=not args.force,
+        encode_threads=args.encode_threads,
+        upscale=args.upscale,
+        prune=args.prune,
+        target=target_from_args(args),
+        dedup=not args.no_dedup,
+        shared_memory=args.shared_memory,
+        animation=not args.no_animation,
+        placeholder=args.placeholder,
+    )
+
+
+def job_from_argv(argv):
+    """
+    Описание задания для продолжения через --resume: рабочая папка и аргументы командной строки.
+    --force не сохраняется: при продолжении уже пересобранные файлы пересобирать не нужно.
+    """
+    return {"cwd": os.getcwd(), "argv": [arg for arg in argv if arg != "--force"]}
+
+
+def resume(output_folder):
+    """
+    Продолжает прерванную конвертацию по описанию задания в папке результатов.
+
+    :param output_folder: Папка результатов прерванной конвертации.
+    :return: Код возврата.
+    """
+    job = load_job(output_folder)
+    if job is None:
+        print(f"В папке {output_folder} нет незавершённой конвертации.", file=sys.stderr)
+        return 2
+    # Относительные пути в аргументах указаны относительно рабочей папки прерванного запуска
+    os.chdir(job["cwd"])
+    return main(job["argv"])
+
+
+def run_watch(args, on_output, on_error):
+    """
+    Режим наблюдения: конвертирует папки и следит за ними до Ctrl+C.
+
+    :param args: Разобранные аргументы командной строки.
+    :param on_output: Функция для OutputResult.
+    :param on_error: Функция для текста ошибки.
+    :return: Код возврата.
+    """
+    from .watch import watch_folders
+
+    folders = [path for path in args.sources if os.path.isdir(path)]
+    if len(folders) != len(args.sources):
+        print("В режиме наблюдения SOURCE должны быть папками.", file=sys.stderr)
+        return 2
+    output_folder = args.output or folders[0]
+    metadata = metadata_from_args(args)
+
+    def on_batch(report):
+        if not args.quiet:
+            print(f"Сохранено файлов: {len(report.generated_files) - len(report.cached_outputs)}, "
+                  f"уже актуальных: {len(report.cached_outputs)}, "
+                  f"ошибок: {len(report.failed_outputs) + len(report.errors)}. Ожидание изменений...")
+
+    try:
+        watch_folders(
+            folders,
+            args.widths,
+            args.formats,
+            output_folder,
+            save_params=save_params_from_args(args),
+            generate_html=not args.no_html,
+            generate_index=not args.no_index,
+            lazy_loading=not args.no_lazy,
+            on_output=on_output,
+            on_error=on_error,
+            on_batch=on_batch,
+            workers=args.workers,
+            options=options_from_args(args),
+            memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None,
+            preserve_layout=args.keep_structure,
+            recursive=not args.no_recursive,
+            metadata=metadata,
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metadata is not None:
+            metadata.close()
+    return 0
+
+
+def run_serve(args):
+    """
+    Режим сервера вариантов: отдаёт варианты по HTTP до Ctrl+C.
+
+    :param args: Разобранные аргументы командной строки.
+    :return: Код возврата.
+    """
+    from .server import RenditionServer
+
+    host, port = args.serve
+    first = args.sources[0]
+    output_folder = args.output or (first if os.path.isdir(first) else glob_root(first))
+    server = RenditionServer(
+        args.sources,
+        output_folder,
+        widths=args.widths,
+        formats=args.formats,
+        save_params=save_params_from_args(args),
+        options=options_from_args(args),
+        workers=args.workers,
+        memory_cache=args.memory_cache * 1024 * 1024,
+        max_queue=args.max_queue,
+        recursive=not args.no_recursive,
+    )
+
+    def on_ready(server):
+        if not args.quiet:
+            print(f"Сервер вариантов: http://{host}:{server.port}/ (задержки — /stats, остановка — Ctrl+C)")
+
+    try:
+        asyncio.run(server.serve(host, port, on_ready))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Не удалось запустить сервер: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def run_spool_worker(args):
+    """
+    Режим рабочего процесса: выполняет задания из общей папки до Ctrl+C.
+
+    :param args: Разобранные аргументы командной строки.
+    :return: Код возврата.
+    """
+    from .engine import resolve_workers
+    from .spool import run_workers
+
+    workers = resolve_workers(args.workers)
+
+    def on_job(job, payload):
+        if args.quiet:
+            return
+        if "error" in payload:
+            print(f"Не удалось обработать файл {job['source']}: {payload['error']}", file=sys.stderr)
+        else:
+            print(f"Выполнено: {job['source']} (файлов: {len(payload['results'])})", flush=True)
+
+    # Ctrl+C и SIGTERM возвращают начатые задания в очередь: их выполнят другие рабочие процессы
+    cancel = threading.Event()
+    previous_handlers = {signum: signal.signal(signum, lambda signum, frame: cancel.set())
+                         for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        if not args.quiet:
+            print(f"Рабочих процессов: {workers}, общая папка заданий: {args.spool_worker} (остановка — Ctrl+C)",
+                  flush=True)
+        run_workers(args.spool_worker, workers, args.lease, args.once, cancel, on_job)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+    return 0
+
+
+def main(argv=None):
+    """
+    Точка входа пакетного режима.
+
+    :param argv: Аргументы командной строки без имени программы.
+    :return: Код возврата: 0 — успешно, 1 — были ошибки.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if "--benchmark" in argv:
+        from .benchmark import main as benchmark_main
+        return benchmark_main(argv)
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.resume:
+        return resume(args.resume)
+    if args.spool_worker:
+        return run_spool_worker(args)
+    if not args.sources:
+        parser.error("не указаны исходники SOURCE")
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    def on_output(result):
+        if result.pruned:
+            if not args.quiet:
+                print(f"Лишний, удалён: {result.out_path}")
+        elif result.ok:
+            if not args.quiet:
+                quality = f" (качество {result.quality})" if result.quality is not None else ""
+                if result.linked_from:
+                    print(f"Дубликат: {result.out_path} (из {result.linked_from})")
+                else:
+                    print(f"{'Актуален' if result.cached else 'Сохранено'}: {result.out_path}{quality}")
+        else:
+            print(f"Ошибка сохранения файла {result.out_path}: {result.error}", file=sys.stderr)
+
+    def on_error(message):
+        print(message, file=sys.stderr)
+
+    if args.watch:
+        return run_watch(args, on_output, on_error)
+    if args.serve:
+        return run_serve(args)
+
+    # Папки и шаблоны обходятся по ходу конвертации
+    sources = iter_sources(args.sources, recursive=not args.no_recursive,
+                           exclude=[args.output] if args.output else ())
+
+    # Первое Ctrl+C останавливает конвертацию после начатых файлов, второе прерывает её сразу
+    cancel = threading.Event()
+
+    def on_interrupt(signum, frame):
+        if cancel.is_set():
+            raise KeyboardInterrupt
+        cancel.set()
+        print("Остановка после начатых файлов (повторное Ctrl+C — прервать сразу)...", file=sys.stderr)
+
+    metadata = metadata_from_args(args)
+    previous_handler = signal.signal(signal.SIGINT, on_interrupt)
+    if args.spool and not args.quiet:
+        print(f"Задания записываются в общую папку {args.spool}; рабочие процессы: "
+              f"python image_converter.py --spool-worker {args.spool}")
+    try:
+        report = convert_images(
+            sources,
+            args.widths,
+            args.formats,
+            output_folder=args.output,
+            save_params=save_params_from_args(args),
+            generate_html=not args.no_html,
+            generate_index=not args.no_index,
+            lazy_loading=not args.no_lazy,
+            on_output=on_output,
+            on_error=on_error,
+            workers=args.workers,
+            options=options_from_args(args),
+            memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None,
+            trace_path=args.trace,
+            preserve_layout=args.keep_structure,
+            cancel=cancel,
+            job=job_from_argv(argv),
+            spool=args.spool,
+            lease=args.lease,
+            metadata=metadata,
+        )
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        if metadata is not None:
+            metadata.close()
+
+    if report.cancelled:
+        print(f"Конвертация остановлена. Продолжить: python image_converter.py --resume {report.output_folder}",
+              file=sys.stderr)
+        return 130
+    if report.code_path and not args.quiet:
+        print(f"HTML-код записан в файл: {report.code_path}")
+    if report.index_path and not args.quiet:
+        print(f"Список вариантов записан в файл: {report.index_path}")
+    if not args.quiet:
+        print(f"Сохранено файлов: {len(report.generated_files) - len(report.cached_outputs)}, "
+              f"уже актуальных: {len(report.cached_outputs)}, "
+              f"ошибок: {len(report.failed_outputs) + len(report.errors)}")
+        if report.pruned_outputs:
+            print(f"Удалено лишних вариантов: {len(report.pruned_outputs)}")
+        duplicates = report.deduplicated_outputs
+        if duplicates:
+            print(f"Взято у одинаковых исходников файлов: {len(duplicates)} "
+                  f"(исходников: {len({r.source_path for r in duplicates})}), "
+                  f"сэкономлено жёсткими ссылками: {report.dedup_saved_bytes / 1024:.1f} КБ")
+        if report.sources_decoded:
+            print(f"Уменьшенное декодирование JPEG: {report.draft_decodes} из {report.sources_decoded} "
+                  f"декодированных исходников")
+        animations = [r for r in report.results if r.frames and not r.cached and not r.linked_from and r.ok]
+        if animations:
+            frames = sum(r.frames for r in animations)
+            resize_ms = sum(r.timings.get("resize", 0.0) for r in animations) * 1000 / frames
+            encode_ms = sum(r.timings.get("encode", 0.0) for r in animations) * 1000 / frames
+            print(f"Анимированных вариантов: {len(animations)}, кадров: {frames}; на кадр: "
+                  f"декодирование и масштабирование {resize_ms:.1f} мс, кодирование {encode_ms:.1f} мс")
+        if metadata is not None:
+            print(f"Индекс исходников: сведений взято из индекса {metadata.hits}, "
+                  f"прочитано из файлов {metadata.misses}")
+        totals = report.stage_totals()
+        print(f"Время стадий: декодирование {totals['decode']:.2f} с, масштабирование {totals['resize']:.2f} с, "
+              f"кодирование {totals['encode']:.2f} с, запись {totals['write']:.2f} с")
+        if args.trace:
+            print(f"Трассировка записана в файл: {args.trace}")
+        if report.scheduler.deferred:
+            print(f"Задач отложено из-за бюджета памяти: {report.scheduler.deferred}, "
+                  f"пиковая оценка: {report.scheduler.peak // (1024 * 1024)} МБ")
+    return 1 if report.errors or report.failed_outputs else 0
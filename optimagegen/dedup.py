@@ -0,0 +1,246 @@
+"""
+Поиск одинаковых исходников.
+
+В папках с материалами часто лежат копии одного изображения под разными именами. Варианты такой
+копии не кодируются заново, а берутся у уже сконвертированного исходника («донора») жёсткой ссылкой
+или, если ссылки не поддерживаются, копированием. HTML-код и images.json по-прежнему формируются
+для каждого имени.
+
+Побайтно одинаковые файлы находятся по хешу содержимого (он и так считается для манифеста сборки)
+ещё до декодирования. Файлы с разным содержимым, но одинаковыми пикселями (например, отличающиеся
+только метаданными), находятся по хешу декодированных пикселей — после декодирования, но до
+масштабирования и кодирования.
+
+В задачу рабочего процесса передаются только хеши пикселей кандидатов того же размера: варианты
+всех кандидатов пересылались бы с каждой задачей, хотя совпадение редко. Совпавшая задача
+прерывается исключением PixelMatch, и главный процесс отправляет её заново с вариантами
+единственного донора.
+"""
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+
+from .output import private_partial_path
+
+# Высота полосы, по которой изображение передаётся в хеш пикселей: так не создаётся копия
+# всего изображения в памяти
+PIXEL_HASH_STRIP = 256
+
+# Сколько последних доноров одного размера сравнивается с исходником по пикселям
+PIXEL_CANDIDATES = 256
+
+
+class PixelMatch(Exception):
+    """
+    Пиксели исходника совпали с донором, варианты которого остались в главном процессе
+    (см. DedupHint.digests).
+    """
+
+    def __init__(self, image_size, digest):
+        super().__init__(image_size, digest)
+        self.image_size = tuple(image_size)
+        self.digest = digest
+
+
+def pixel_digest(img, decode_scale=1, strips=None):
+    """
+    Хеш декодированных пикселей изображения.
+
+    В хеш входят режим, размер, масштаб декодирования, палитра, прозрачность и ICC-профиль:
+    от них зависят выходные файлы.
+
+    :param img: Загруженное изображение.
+    :param decode_scale: Знаменатель масштаба, в котором декодирован исходник.
+    :param strips: Полосы изображения сверху вниз, если оно читается полосами и не загружено
+                   (см. stream.strip_reader); хеш не зависит от высоты полос.
+    :return: Шестнадцатеричная строка хеша.
+    """
+    digest = hashlib.sha256()
+    width, height = img.size
+    digest.update(f"{img.mode}:{width}x{height}:{decode_scale}:{img.info.get('transparency')!r}:".encode())
+    digest.update(img.info.get("icc_profile") or b"")
+    if img.mode == "P":
+        digest.update(bytes(img.getpalette() or ()))
+    if strips is None:
+        strips = (img.crop((0, top, width, min(height, top + PIXEL_HASH_STRIP)))
+                  for top in range(0, height, PIXEL_HASH_STRIP))
+    for strip in strips:
+        digest.update(strip.tobytes())
+    return digest.hexdigest()
+
+
+def link_output(donor_path, out_path):
+    """
+    Создаёт выходной файл из файла донора: жёсткой ссылкой, а если она невозможна (другой диск,
+    файловая система без ссылок) — копированием. Файл появляется под итоговым именем переименованием,
+    поэтому последующая пересборка донора (тоже переименованием) копию не затрагивает.
+
+    :param donor_path: Готовый файл донора.
+    :param out_path: Путь к выходному файлу.
+    :return: True, если создана жёсткая ссылка, False — если файл скопирован.
+    """
+    tmp_path = private_partial_path(out_path)
+    try:
+        try:
+            os.link(donor_path, tmp_path)
+            hardlink = True
+        except OSError:
+            shutil.copyfile(donor_path, tmp_path)
+            hardlink = False
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return hardlink
+
+
+def rendition_owner(name, width):
+    """
+    Имя исходника без расширения, которому принадлежит выходной файл вида "{имя}-{ширина}w.{ext}",
+    или None, если имя файла не соответствует ширине.
+
+    :param name: Путь или имя выходного файла.
+    :param width: Ширина варианта.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    suffix = f"-{width}w"
+    return stem[:-len(suffix)] if stem.endswith(suffix) else None
+
+
+class DedupHint:
+    """
+    Доноры, переданные в задачу одного исходника.
+
+    Объект передаётся в рабочий процесс, поэтому содержит только простые данные. Варианты донора
+    описываются словарём {(ширина, формат): (путь, высота, качество, размер в байтах)}; путь None
+    означает вариант, удалённый как лишний (см. engine.prune_renditions).
+    """
+
+    def __init__(self, files=None, pixels=None, digests=None):
+        """
+        :param files: Варианты донора с тем же содержимым файла или None.
+        :param pixels: Словарь {хеш пикселей: варианты донора} для сравнения после декодирования.
+        :param digests: Хеши пикселей доноров без их вариантов: при совпадении задача прерывается
+                        исключением PixelMatch.
+        """
+        self.files = files
+        self.pixels = pixels or {}
+        self.digests = digests or frozenset()
+
+
+class DedupIndex:
+    """
+    Доноры, известные главному процессу: исходники, сконвертированные в этом запуске, и неизменённые
+    исходники из манифеста сборки, варианты которых получены с теми же параметрами.
+    """
+
+    def __init__(self):
+        self.by_file = {}    # Хеш содержимого -> варианты донора
+        self.by_pixels = {}  # Размер исходника -> OrderedDict {хеш пикселей: варианты донора}
+        self._owners = {}    # Путь выходного файла -> хеш содержимого, у вариантов которого он записан
+
+    @classmethod
+    def from_manifest(cls, manifest, keys):
+        """
+        Собирает доноров из манифеста сборки.
+
+        Учитываются только файлы исходников, которые не изменились с прошлого запуска: их варианты
+        в этом запуске не пересобираются, и ссылаться на них безопасно.
+
+        :param manifest: BuildManifest.
+        :param keys: Функция (ширина, формат) -> параметры записи манифеста без хеша исходника
+                     (params и pipeline) для текущего запуска или None, если формат не запрошен.
+        """
+        index = cls()
+        unchanged = {}
+        for source_path, state in manifest.sources.items():
+            try:
+                stat = os.stat(source_path)
+            except OSError:
+                continue
+            if stat.st_size == state.get("size") and stat.st_mtime_ns == state.get("mtime_ns"):
+                base_name = os.path.splitext(os.path.basename(source_path))[0]
+                unchanged[base_name, state.get("sha256")] = state
+        for name, entry in manifest.outputs.items():
+            width, fmt, sha256 = entry.get("width"), entry.get("format"), entry.get("source_sha256")
+            if (rendition_owner(name, width), sha256) not in unchanged:
+                continue
+            expected = keys(width, fmt)
+            if expected is None or any(entry.get(field) != value for field, value in expected.items()):
+                continue
+            path = None if entry.get("pruned") else os.path.join(manifest.output_folder, *name.split("/"))
+            index._add_rendition(sha256, width, fmt, path, entry.get("height"), entry.get("quality"),
+                                 entry.get("bytes"))
+        for state in unchanged.values():
+            renditions = index.by_file.get(state.get("sha256"))
+            if renditions and state.get("pixels") and state.get("image_size"):
+                index._add_pixels(state, renditions)
+        return index
+
+    def _add_rendition(self, sha256, width, fmt, path, height, quality, size_bytes):
+        owner = self._owners.get(path)
+        if owner is not None and owner != sha256:
+            # Файл перезаписан вариантом другого исходника
+            self.by_file.get(owner, {}).pop((width, fmt), None)
+        if path is not None:
+            self._owners[path] = sha256
+        self.by_file.setdefault(sha256, {})[width, fmt] = (path, height, quality, size_bytes)
+
+    def _add_pixels(self, state, renditions):
+        candidates = self.by_pixels.setdefault(tuple(state["image_size"]), OrderedDict())
+        candidates[state["pixels"]] = renditions
+        candidates.move_to_end(state["pixels"])
+        if len(candidates) > PIXEL_CANDIDATES:
+            candidates.popitem(last=False)
+
+    def add(self, state, results):
+        """
+        Запоминает сконвертированный исходник как донора.
+
+        :param state: Состояние исходника (см. cache.source_state) с хешем пикселей, если он считался.
+        :param results: Результаты конвертации исходника (engine.OutputResult).
+        """
+        if not state or not state.get("sha256"):
+            return
+        for result in results:
+            if result.ok and result.size_bytes is not None:
+                self._add_rendition(state["sha256"], result.width, result.fmt,
+                                    None if result.pruned else result.out_path,
+                                    result.height, result.quality, result.size_bytes)
+        renditions = self.by_file.get(state["sha256"])
+        if renditions and state.get("pixels") and state.get("image_size"):
+            self._add_pixels(state, renditions)
+
+    def hint(self, sha256, image_size=None, digests_only=False):
+        """
+        Доноры для задачи исходника.
+
+        :param sha256: Хеш содержимого исходника.
+        :param image_size: Размер исходника, если известен: по нему выбираются кандидаты
+                           для сравнения пикселей.
+        :param digests_only: Передать только хеши пикселей кандидатов (для задачи в другом процессе).
+        :return: DedupHint или None, если доноров нет.
+        """
+        files = self.by_file.get(sha256)
+        pixels = self.by_pixels.get(tuple(image_size)) if image_size else None
+        if not files and not pixels:
+            return None
+        files = dict(files) if files else None
+        if digests_only:
+            return DedupHint(files, digests=frozenset(pixels) if pixels else None)
+        return DedupHint(files, {digest: dict(renditions) for digest, renditions in pixels.items()} if pixels else None)
+
+    def pixel_match(self, hint, match):
+        """
+        Доноры для повторной отправки задачи, прерванной исключением PixelMatch.
+
+        :param hint: DedupHint прерванной задачи.
+        :param match: PixelMatch.
+        :return: DedupHint с вариантами совпавшего донора (если он ещё известен) и без хешей для сравнения.
+        """
+        renditions = self.by_pixels.get(match.image_size, {}).get(match.digest)
+        return DedupHint(hint.files, {match.digest: dict(renditions)} if renditions else None)
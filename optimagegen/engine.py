@@ -0,0 +1,1384 @@
+"""
+Движок конвертации изображений без графического интерфейса.
+
+Модуль не импортирует Tkinter: его используют и окно приложения, и пакетный режим командной строки,
+и сторонние скрипты. На вход подаются исходные файлы, ширины, форматы и параметры кодировщиков,
+на выходе — результаты по каждому сгенерированному файлу.
+"""
+import copy
+import io
+import itertools
+import multiprocessing
+import os
+import signal
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from .animation import ANIMATED_FORMATS, FrameFeed, frame_count, frame_durations
+from .cache import BuildManifest, clear_job, output_key, save_job, source_state
+from .dedup import DedupIndex, PixelMatch, link_output, pixel_digest
+from .output import OutputWriter, private_partial_path, source_entry
+from .placeholder import compute_placeholder, file_placeholder, placeholder_attributes
+from .quality import QUALITY_FORMATS, search_quality
+from .resize import DEFAULT_UPSCALE, apply_draft, resize_renditions, resolve_widths, target_height
+from .scheduler import MemoryScheduler, estimate_source_memory, resolve_memory_budget
+from .shared import SharedFrame, attached_image, start_tracker
+from .sources import source_root, split_source
+from .stream import check_decoded_size, open_image, stream_reader, stream_renditions
+from .trace import STAGES, Stopwatch, TraceWriter, make_span
+
+# Поддерживаемые форматы в порядке отображения в интерфейсе
+SUPPORTED_FORMATS = ("JPEG", "PNG", "WEBP")
+
+# Параметры сохранения по умолчанию для каждого формата
+DEFAULT_SAVE_PARAMS = {
+    "JPEG": {"quality": 85, "optimize": True, "progressive": True},
+    "PNG": {},
+    "WEBP": {"quality": 80, "method": 6},  # method — степень оптимизации (0-6)
+}
+
+# Через сколько исходников манифест сборки сохраняется на диск во время конвертации
+MANIFEST_SAVE_INTERVAL = 200
+
+# Как часто при ожидании рабочих процессов проверяется запрос на отмену, в секундах
+CANCEL_POLL_INTERVAL = 0.2
+
+# Значение атрибута sizes в генерируемом HTML-коде
+SIZES_ATTR = "(max-width: 480px) 100px, (max-width: 768px) 120px, 120px"
+
+
+def parse_widths(widths_input):
+    """
+    Разбирает строку с ширинами, перечисленными через запятую.
+
+    :param widths_input: Строка вида "400,800,1200".
+    :return: Отсортированный список уникальных ширин.
+    :raises ValueError: Если в строке нет ни одной корректной ширины.
+    """
+    widths = sorted({int(w.strip()) for w in widths_input.split(",") if w.strip().isdigit()})
+    widths = [w for w in widths if w > 0]
+    if not widths:
+        raise ValueError("Укажите корректные целые числа для ширины изображений (через запятую).")
+    return widths
+
+
+def format_extension(fmt):
+    """
+    Возвращает расширение выходного файла для формата Pillow.
+
+    :param fmt: Название формата ("JPEG", "PNG" или "WEBP").
+    :return: Расширение без точки (для JPEG используется "jpg").
+    """
+    return "jpg" if fmt == "JPEG" else fmt.lower()
+
+
+def source_base_name(source_path):
+    """
+    Возвращает имя исходного файла без каталога и расширения.
+
+    :param source_path: Путь к исходному изображению.
+    """
+    return os.path.splitext(os.path.basename(source_path))[0]
+
+
+def output_filename(base_name, width, fmt):
+    """
+    Формирует имя выходного файла вида "{base_name}-{width}w.{ext}".
+
+    :param base_name: Имя исходного файла без расширения.
+    :param width: Ширина выходного изображения.
+    :param fmt: Формат выходного изображения.
+    """
+    return f"{base_name}-{width}w.{format_extension(fmt)}"
+
+
+def resolve_save_params(formats, overrides=None):
+    """
+    Собирает параметры сохранения для выбранных форматов.
+
+    :param formats: Список форматов.
+    :param overrides: Словарь {формат: {параметр: значение}}, дополняющий значения по умолчанию.
+    :return: Словарь {формат: параметры сохранения}.
+    """
+    params = {fmt: dict(DEFAULT_SAVE_PARAMS.get(fmt, {})) for fmt in formats}
+    for fmt, extra in (overrides or {}).items():
+        if fmt in params:
+            params[fmt].update(extra)
+    return params
+
+
+def source_output_folder(output_folder, subdir, preserve_layout=False):
+    """
+    Возвращает папку для результатов одного исходника.
+
+    :param output_folder: Папка для сохранения.
+    :param subdir: Папка исходника относительно корня обхода (см. sources.split_source).
+    :param preserve_layout: Повторять ли структуру подпапок исходников в папке результатов.
+    """
+    if preserve_layout and subdir:
+        return os.path.join(output_folder, subdir)
+    return output_folder
+
+
+def read_image_size(source_path):
+    """
+    Читает размер изображения из заголовка файла, не декодируя пиксели.
+
+    :param source_path: Путь к изображению.
+    :return: Кортеж (ширина, высота).
+    """
+    with open_image(source_path) as img:
+        return img.size
+
+
+def plan_outputs(source_paths, widths, formats, output_folder, preserve_layout=False, upscale=DEFAULT_UPSCALE,
+                 image_size=None):
+    """
+    Составляет список файлов, которые будут сгенерированы.
+
+    :param source_paths: Пути к исходным изображениям или SourceFile.
+    :param widths: Список ширин.
+    :param formats: Список форматов.
+    :param output_folder: Папка для сохранения.
+    :param preserve_layout: Повторять ли структуру подпапок исходников в папке результатов.
+    :param upscale: Политика для ширин больше исходника (см. resize.resolve_widths); при любой
+                    политике, кроме "allow", читаются заголовки исходников.
+    :param image_size: Функция, возвращающая размер исходника или None; по умолчанию read_image_size.
+    :return: Список кортежей (путь к исходнику, ширина, формат, путь к выходному файлу).
+    """
+    plan = []
+    for source in source_paths:
+        source_path, subdir = split_source(source)
+        folder = source_output_folder(output_folder, subdir, preserve_layout)
+        base_name = source_base_name(source_path)
+        source_widths = widths
+        if upscale != "allow":
+            try:
+                size = (image_size or read_image_size)(source_path)
+            except Exception:
+                size = None  # Ошибку открытия сообщит конвертация
+            source_widths = resolve_widths(widths, size[0] if size else None, upscale)
+        for width in source_widths:
+            for fmt in formats:
+                out_path = os.path.join(folder, output_filename(base_name, width, fmt))
+                plan.append((source_path, width, fmt, out_path))
+    return plan
+
+
+def build_img_tag(base_name, files, lazy_loading=True, placeholder=None):
+    """
+    Формирует HTML-код тега <img> с атрибутом srcset.
+
+    :param base_name: Имя исходного файла без расширения (используется для alt).
+    :param files: Список кортежей (ширина, имя файла), отсортированный по ширине.
+    :param lazy_loading: Добавлять ли атрибут loading="lazy".
+    :param placeholder: Заглушка на время загрузки (см. placeholder.compute_placeholder) или None.
+    :return: Строка с HTML-кодом.
+    """
+    alt_text = base_name.replace("-", " ")
+    loading_attr = 'loading="lazy"' if lazy_loading else ''
+    # Атрибуты заглушки идут после class, каждый на своей строке
+    placeholder_attrs = "".join(f'\n\t{name}="{value}"' for name, value in placeholder_attributes(placeholder))
+    # Основное изображение — самое маленькое
+    src = files[0][1]
+    # Перед каждым элементом srcset — один знак табуляции
+    srcset_str = ",\n\t".join(f"{filename} {width}w" for width, filename in files)
+    return f'''<img
+\talt="{alt_text}"
+\tclass="profile-image"{placeholder_attrs}
+\t{loading_attr}
+\tsizes="{SIZES_ATTR}"
+\tsrc="{src}" srcset="
+\t{srcset_str}
+">'''
+
+
+class ConversionOptions:
+    """
+    Параметры конвейера, не влияющие на состав выходных файлов, — только на способ их получения.
+
+    Объект передаётся в рабочие процессы, поэтому содержит только простые значения.
+    """
+
+    def __init__(self, cascade=True, draft=True, incremental=True, encode_threads=0, upscale=DEFAULT_UPSCALE,
+                 prune=False, target=None, dedup=True, shared_memory=False, animation=True, placeholder=None):
+        """
+        :param cascade: Строить меньшие ширины из уже уменьшенных вариантов (см. resize.plan_resizes).
+        :param draft: Декодировать крупные JPEG в уменьшенном масштабе (см. resize.apply_draft).
+        :param incremental: Пропускать файлы, которые по манифесту сборки уже актуальны (см. cache).
+        :param encode_threads: Число потоков, кодирующих форматы одного варианта параллельно;
+                               0 — подобрать автоматически (см. resolve_encode_threads).
+        :param upscale: Что делать с ширинами больше исходника (см. resize.resolve_widths).
+        :param prune: Удалять варианты, которые не легче соседних (см. prune_renditions).
+        :param target: quality.QualityTarget — подбирать качество JPEG и WEBP под бюджет размера
+                       или порог сходства вместо фиксированного; None — фиксированное качество.
+        :param dedup: Брать варианты одинаковых исходников у уже сконвертированного (см. dedup).
+        :param shared_memory: При последовательной обработке исходников кодировать форматы в
+                              encode_threads отдельных процессах, передавая им пиксели вариантов
+                              через разделяемую память (см. shared).
+        :param animation: Кодировать анимированные исходники в WEBP со всеми кадрами (см. animation);
+                          False — только первый кадр, как в остальных форматах.
+        :param placeholder: Вид заглушки, встраиваемой в HTML-код и images.json (см. placeholder);
+                            None — без заглушки. На файлы вариантов не влияет.
+        """
+        self.cascade = cascade
+        self.draft = draft
+        self.incremental = incremental
+        self.encode_threads = encode_threads
+        self.upscale = upscale
+        self.prune = prune
+        self.target = target
+        self.dedup = dedup
+        self.shared_memory = shared_memory
+        self.animation = animation
+        self.placeholder = placeholder
+
+    def cache_key(self, fmt=None):
+        """
+        Параметры, влияющие на пиксели результата; входят в запись манифеста сборки.
+
+        :param fmt: Формат файла; цель подбора качества учитывается только для форматов с качеством.
+        """
+        key = {"cascade": self.cascade, "draft": self.draft}
+        if self.target is not None and fmt in QUALITY_FORMATS:
+            key["target"] = self.target.cache_key()
+        if not self.animation and fmt in ANIMATED_FORMATS:
+            key["animation"] = False
+        return key
+
+
+class OutputResult:
+    """
+    Результат сохранения одного выходного файла.
+    """
+
+    def __init__(self, source_path, out_path, width, fmt, error=None, decode_scale=1, cached=False,
+                 size_bytes=None):
+        """
+        :param source_path: Путь к исходному изображению.
+        :param out_path: Путь к выходному файлу.
+        :param width: Ширина выходного изображения.
+        :param fmt: Формат выходного изображения.
+        :param error: Текст ошибки или None, если файл сохранён успешно.
+        :param decode_scale: Знаменатель масштаба, в котором был декодирован исходник.
+        :param cached: True, если файл уже был актуален и не кодировался заново.
+        :param size_bytes: Размер сохранённого файла в байтах.
+        """
+        self.source_path = source_path
+        self.out_path = out_path
+        self.width = width
+        self.height = None        # Высота выходного изображения, если известна
+        self.fmt = fmt
+        self.error = error
+        self.decode_scale = decode_scale
+        self.cached = cached
+        self.size_bytes = size_bytes
+        self.quality = None       # Качество кодирования, если оно подбиралось (см. quality.search_quality)
+        self.pruned = False       # Файл удалён как лишний (см. prune_renditions)
+        self.linked_from = None   # Файл одинакового исходника, из которого взят этот файл (см. dedup)
+        self.hardlinked = False   # Файл взят жёсткой ссылкой, а не копированием
+        self.frames = None        # Число кадров анимированного варианта (см. encode_animation)
+        self.placeholder = None   # Заглушка исходника (см. placeholder), общая для всех его файлов
+        self.source_state = None  # Состояние исходника для манифеста сборки (см. cache.source_state)
+        self.cache_key = None     # Запись манифеста для этого файла (см. cache.output_key)
+        # Длительности стадий в секундах; декодирование и масштабирование общие для файлов
+        # одного исходника и одной ширины и указываются у каждого из них
+        self.timings = {}
+        # Отрезки времени (см. trace.make_span); общие стадии приписаны только одному из файлов,
+        # поэтому сумма по всем результатам не учитывает их дважды
+        self.spans = []
+
+    @property
+    def ok(self):
+        """True, если файл сохранён без ошибок (или уже был актуален)."""
+        return self.error is None
+
+    @property
+    def status_symbol(self):
+        """
+        Символ статуса для отображения в интерфейсе ("✔", "✔ (кэш)", "✔ (дубликат)", "— (лишний)" или "✖").
+        """
+        if not self.ok:
+            return "✖"
+        if self.pruned:
+            return "— (лишний)"
+        if self.linked_from:
+            return "✔ (дубликат)"
+        return "✔ (кэш)" if self.cached else "✔"
+
+    def __repr__(self):
+        return f"OutputResult({self.out_path!r}, {self.status_symbol})"
+
+
+class ConversionReport:
+    """
+    Сводный результат пакетной конвертации.
+    """
+
+    def __init__(self):
+        self.results = []    # Список OutputResult по всем выходным файлам
+        self.errors = []     # Сообщения об ошибках обработки исходников и записи code.txt
+        self.code_path = None   # Путь к записанному code.txt (если он был записан)
+        self.index_path = None  # Путь к записанному images.json (если он был записан)
+        self.sources_converted = 0  # Число успешно обработанных исходников (в том числе полностью актуальных)
+        self.sources_decoded = 0    # Сколько из них декодировано ради кодирования (не только кэш и дубликаты)
+        self.draft_decodes = 0      # Сколько из декодированных декодировано в уменьшенном масштабе
+        self.scheduler = None       # MemoryScheduler параллельной конвертации (оценки памяти и ожидания)
+        self.output_folder = None   # Папка результатов (в том числе выбранная по умолчанию)
+        self.cancelled = False      # Конвертация остановлена по запросу до обработки всех исходников
+
+    @property
+    def generated_files(self):
+        """Пути к успешно сохранённым файлам (без удалённых как лишние)."""
+        return [r.out_path for r in self.results if r.ok and not r.pruned]
+
+    @property
+    def failed_outputs(self):
+        """Результаты, сохранить которые не удалось."""
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def cached_outputs(self):
+        """Результаты, пропущенные как уже актуальные."""
+        return [r for r in self.results if r.cached and not r.pruned]
+
+    @property
+    def pruned_outputs(self):
+        """Результаты, удалённые как лишние."""
+        return [r for r in self.results if r.pruned]
+
+    @property
+    def deduplicated_outputs(self):
+        """Результаты, взятые у одинакового исходника вместо кодирования."""
+        return [r for r in self.results if r.linked_from and not r.pruned]
+
+    @property
+    def dedup_saved_bytes(self):
+        """Сколько байт на диске сэкономили жёсткие ссылки на файлы одинаковых исходников."""
+        return sum(r.size_bytes or 0 for r in self.deduplicated_outputs if r.hardlinked)
+
+    def stage_totals(self):
+        """
+        Суммарное время каждой стадии конвейера в секундах.
+        """
+        totals = dict.fromkeys(STAGES, 0.0)
+        for result in self.results:
+            for stage, _, duration, _, _ in result.spans:
+                totals[stage] += duration
+        return totals
+
+
+# Признак того, что файл уже актуален и кодировать его не нужно
+_CACHED = object()
+
+
+def encode_output(img, out_path, fmt, save_params, target=None, guess=None):
+    """
+    Кодирует и сохраняет один выходной файл.
+
+    Изображение кодируется в память, а затем записывается на диск, чтобы время кодирования и записи
+    замерялось отдельно. Файл пишется во временный (см. output.private_partial_path) и переименовывается
+    в итоговый, поэтому недописанный при сбое файл никогда не выглядит готовым.
+
+    :param img: Изображение нужного размера.
+    :param out_path: Путь к выходному файлу.
+    :param fmt: Формат.
+    :param save_params: Параметры сохранения формата.
+    :param target: QualityTarget или None; для форматов без качества (PNG) не используется.
+    :param guess: Качество, с которого начинать подбор (см. quality.search_quality).
+    :return: Кортеж (текст ошибки или None, размер файла в байтах, отрезки времени стадий,
+             подобранное качество или None).
+    """
+    spans = []
+    quality = None
+    try:
+        with Stopwatch("encode") as encode_watch:
+            if target is not None and fmt in QUALITY_FORMATS:
+                data, quality, _ = search_quality(img, fmt, save_params, target, guess)
+            else:
+                buffer = io.BytesIO()
+                img.save(buffer, fmt, **save_params)
+                data = buffer.getbuffer()
+        spans.append(encode_watch.span)
+        spans.append(write_output(data, out_path))
+    except Exception as e:
+        return str(e), None, spans, None
+    return None, len(data), spans, quality
+
+
+def write_output(data, out_path):
+    """
+    Записывает закодированный файл через временный (см. output.private_partial_path).
+
+    :return: Отрезок времени стадии записи.
+    """
+    with Stopwatch("write") as write_watch:
+        tmp_path = private_partial_path(out_path)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    return write_watch.span
+
+
+def encode_shared(ref, out_path, fmt, save_params, target=None, guess=None):
+    """
+    encode_output для изображения в разделяемой памяти; выполняется в процессе-кодировщике.
+
+    :param ref: shared.FrameRef варианта.
+    :return: См. encode_output.
+    """
+    with attached_image(ref) as img:
+        if fmt == "PNG" and img.mode == "RGBX":
+            # PNG не записывает RGBX: кодировщику нужна собственная копия в RGB
+            return encode_output(img.convert("RGB"), out_path, fmt, save_params, target, guess)
+        return encode_output(img, out_path, fmt, save_params, target, guess)
+
+
+def encode_animation(source_path, durations, size, out_path, fmt, save_params):
+    """
+    Кодирует и сохраняет анимированный вариант, читая и уменьшая кадры исходника по одному
+    (см. animation.FrameFeed).
+
+    Исходник открывается заново, поэтому вариант кодируется параллельно с остальными файлами, в том
+    числе в процессе-кодировщике. Качество не подбирается: используются параметры сохранения.
+
+    :param source_path: Путь к анимированному исходнику.
+    :param durations: Длительности кадров исходника (см. animation.frame_durations).
+    :param size: Размер варианта (ширина, высота).
+    :return: См. encode_output; декодирование и уменьшение кадров входят в отрезок стадии resize.
+    """
+    spans = []
+    try:
+        with open_image(source_path) as source:
+            # Кадры декодируются в память целиком, как и неподвижный исходник в convert_source
+            check_decoded_size(source.size)
+            feed = FrameFeed(source, size, durations)
+            with Stopwatch("encode") as encode_watch:
+                buffer = io.BytesIO()
+                feed.save(buffer, fmt, save_all=True, duration=feed.durations, loop=feed.info["loop"],
+                          **save_params)
+                data = buffer.getbuffer()
+        # Кадры уменьшаются по ходу кодирования, поэтому их время выделяется из общего отрезка
+        _, start, duration, _, _ = encode_watch.span
+        spans.append(make_span("resize", start, feed.resize_time))
+        spans.append(make_span("encode", start + feed.resize_time, duration - feed.resize_time))
+        spans.append(write_output(data, out_path))
+    except Exception as e:
+        return str(e), None, spans, None
+    return None, len(data), spans, None
+
+
+def convert_source(source_path, widths, formats, output_folder, save_params=None, options=None,
+                   on_output=None, cache=None, cancel=None, dedup=None, encoder=None):
+    """
+    Конвертирует одно исходное изображение во все ширины и форматы.
+
+    Ошибки сохранения отдельных файлов не прерывают обработку: они попадают в результаты.
+    Ошибка открытия исходника пробрасывается вызывающему коду.
+
+    :param source_path: Путь к исходному изображению.
+    :param widths: Список ширин.
+    :param formats: Список форматов.
+    :param output_folder: Папка для сохранения.
+    :param save_params: Словарь {формат: параметры сохранения}; по умолчанию DEFAULT_SAVE_PARAMS.
+    :param options: ConversionOptions; по умолчанию — параметры по умолчанию.
+    :param on_output: Функция, вызываемая с OutputResult после каждого выходного файла.
+    :param cache: SourceCache из манифеста сборки или None, если манифест не используется.
+    :param cancel: Объект с методом is_set() (например, threading.Event); если флаг установлен,
+                   следующие ширины не обрабатываются, а уже начатые файлы дописываются.
+    :param dedup: dedup.DedupHint — варианты одинаковых исходников, которые можно взять вместо
+                  кодирования: по хешу файла до декодирования, по хешу пикселей после него.
+    :raises dedup.PixelMatch: Если пиксели совпали с донором из DedupHint.digests.
+    :param encoder: Пул процессов-кодировщиков (см. ConversionOptions.shared_memory) или None —
+                    кодирование в пуле потоков текущего процесса.
+    :return: Список OutputResult (ширины обрабатываются от большей к меньшей); при отмене —
+             только по обработанным ширинам.
+    """
+    if save_params is None:
+        save_params = resolve_save_params(formats)
+    if options is None:
+        options = ConversionOptions()
+    base_name = source_base_name(source_path)
+    results = []
+
+    def emit(result, state=None, key=None):
+        result.source_state = state
+        result.cache_key = key
+        results.append(result)
+        # При удалении лишних вариантов результаты сообщаются после сравнения всех вариантов
+        if on_output and not options.prune:
+            on_output(result)
+
+    def finalize():
+        # После отмены сравнивать не с чем: часть вариантов не построена
+        if options.prune and not (cancel is not None and cancel.is_set()):
+            for result in prune_renditions(results, formats):
+                try:
+                    os.remove(result.out_path)
+                except OSError:
+                    pass
+                result.pruned = True
+        if options.placeholder:
+            attach_placeholder()
+        if options.prune and on_output:
+            for result in results:
+                on_output(result)
+        return results
+
+    def attach_placeholder():
+        # Если исходник не открывался (все варианты актуальны или взяты у одинакового исходника),
+        # заглушка берётся из манифеста или считается по самому маленькому сохранённому варианту
+        found = placeholder or stored_placeholder
+        if found is None:
+            saved = [r for r in results if r.ok and not r.pruned]
+            if saved:
+                try:
+                    found = file_placeholder(min(saved, key=lambda r: r.width).out_path, options.placeholder)
+                except Exception:
+                    pass  # Без заглушки HTML-код остаётся рабочим
+        if found is not None and state is not None:
+            state["placeholder"] = found
+        for result in results:
+            result.placeholder = found
+
+    def cached_result(width, fmt, out_path):
+        result = OutputResult(source_path, out_path, width, fmt, cached=True)
+        entry = cache.outputs.get(out_path, {})
+        result.size_bytes = entry.get("bytes")
+        result.height = entry.get("height")
+        result.quality = entry.get("quality")
+        if result.height is None and state and state.get("image_size"):
+            result.height = target_height(state["image_size"], width)
+        result.pruned = bool(entry.get("pruned"))
+        return result
+
+    state = None
+    if cache is not None:
+        state = source_state(source_path, cache.state)
+
+    # Заглушка неизменённого исходника того же вида уже сохранена в манифесте и не пересчитывается
+    placeholder = None
+    stored_placeholder = state.get("placeholder") if state else None
+    if not stored_placeholder or stored_placeholder.get("kind") != options.placeholder:
+        stored_placeholder = None
+
+    # Политика увеличения меняет состав файлов, поэтому применяется до сверки с манифестом;
+    # размер исходника берётся из манифеста или читается из заголовка
+    if options.upscale != "allow":
+        image_size = state.get("image_size") if state else None
+        if not image_size:
+            image_size = read_image_size(source_path)
+            if state is not None:
+                state["image_size"] = list(image_size)
+        widths = resolve_widths(widths, image_size[0], options.upscale)
+
+    # Сверка с манифестом сборки: какие файлы уже актуальны
+    keys = {}
+    fresh = set()
+    if cache is not None:
+        for width in widths:
+            for fmt in formats:
+                out_path = os.path.join(output_folder, output_filename(base_name, width, fmt))
+                keys[width, fmt] = output_key(state["sha256"], width, fmt, save_params.get(fmt, {}),
+                                              options.cache_key(fmt))
+                if options.incremental and cache.is_fresh(out_path, keys[width, fmt]):
+                    # Удалённый как лишний файл актуален, только пока лишние варианты удаляются
+                    if options.prune or not cache.outputs[out_path].get("pruned"):
+                        fresh.add((width, fmt))
+
+    # Актуальные файлы сообщаются сразу; исходник открывается, только если что-то нужно пересобрать
+    stale_widths = [width for width in widths if any((width, fmt) not in fresh for fmt in formats)]
+    for width in sorted(widths, reverse=True):
+        if width not in stale_widths:
+            for fmt in formats:
+                out_path = os.path.join(output_folder, output_filename(base_name, width, fmt))
+                emit(cached_result(width, fmt, out_path), state, keys.get((width, fmt)))
+
+    linked = set()
+
+    def link_renditions(renditions, decode_scale=1):
+        # Варианты одинакового исходника берутся у него: жёсткой ссылкой или копией файла
+        for width in sorted(stale_widths, reverse=True):
+            for fmt in formats:
+                donor = renditions.get((width, fmt))
+                if donor is None or (width, fmt) in fresh or (width, fmt) in linked:
+                    continue
+                donor_path, height, quality, size_bytes = donor
+                out_path = os.path.join(output_folder, output_filename(base_name, width, fmt))
+                result = OutputResult(source_path, out_path, width, fmt, decode_scale=decode_scale,
+                                      size_bytes=size_bytes)
+                if donor_path is None:
+                    # У донора вариант удалён как лишний — у дубликата он был бы удалён так же
+                    if not options.prune:
+                        continue
+                    try:
+                        os.remove(out_path)
+                    except OSError:
+                        pass
+                    result.pruned = True
+                else:
+                    if donor_path == out_path:
+                        continue
+                    try:
+                        # Изменённый с тех пор файл донора не годится
+                        if os.path.getsize(donor_path) != size_bytes:
+                            continue
+                        result.hardlinked = link_output(donor_path, out_path)
+                    except OSError:
+                        continue  # Файл донора недоступен: вариант будет закодирован
+                    result.linked_from = donor_path
+                result.height = height
+                result.quality = quality
+                linked.add((width, fmt))
+                emit(result, state, keys.get((width, fmt)))
+            # Ширина, все файлы которой получены от донора или актуальны, не масштабируется
+            if all((width, f) in fresh or (width, f) in linked for f in formats):
+                stale_widths.remove(width)
+                for fmt in formats:
+                    if (width, fmt) in fresh:
+                        out_path = os.path.join(output_folder, output_filename(base_name, width, fmt))
+                        emit(cached_result(width, fmt, out_path), state, keys.get((width, fmt)))
+
+    # Побайтно одинаковый исходник: файлы берутся у него, не открывая исходник
+    if dedup is not None and dedup.files and stale_widths:
+        link_renditions(dedup.files)
+    if not stale_widths or (cancel is not None and cancel.is_set()):
+        return finalize()
+
+    # Кодировщики Pillow отпускают GIL, поэтому форматы одного варианта кодируются в пуле потоков
+    stale_formats = max(sum((width, fmt) not in fresh and (width, fmt) not in linked for fmt in formats)
+                        for width in stale_widths)
+    threads = resolve_encode_threads(options.encode_threads, 1, stale_formats)
+    if encoder is not None:
+        executor = encoder
+    else:
+        executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+    # Варианты в разделяемой памяти: ширина -> SharedFrame; сегмент удаляется, когда закодированы все форматы
+    frames = {}
+
+    decode_spans = []
+    # Качество, подобранное для предыдущей ширины каждого формата, — начало поиска для следующей
+    guesses = {}
+
+    def finish(pending):
+        for width, fmt, out_path, outcome, resize_spans in pending:
+            if outcome is _CACHED:
+                emit(cached_result(width, fmt, out_path), state, keys.get((width, fmt)))
+                continue
+            error, size_bytes, spans, quality = outcome.result() if isinstance(outcome, Future) else outcome
+            result = OutputResult(source_path, out_path, width, fmt, error=error, decode_scale=decode_scale,
+                                  size_bytes=size_bytes)
+            result.quality = quality
+            result.height = heights[width]
+            if source_frames > 1 and fmt in ANIMATED_FORMATS:
+                result.frames = source_frames
+            if quality is not None:
+                guesses[fmt] = quality
+            result.timings = {"decode": decode_watch.duration, "resize": resize_watch_by_width[width]}
+            for stage, _, duration, _, _ in spans:
+                result.timings[stage] = duration
+            # Общие отрезки декодирования и масштабирования достаются первому файлу исходника и ширины
+            result.spans = decode_spans + resize_spans + spans
+            decode_spans.clear()
+            resize_spans.clear()
+            emit(result, state, keys.get((width, fmt)))
+        for width in {entry[0] for entry in pending}:
+            frame = frames.pop(width, None)
+            if frame is not None:
+                frame.close()
+
+    resize_watch_by_width = {}
+    heights = {}
+    try:
+        with Stopwatch("decode") as decode_watch:
+            img = open_image(source_path)
+            try:
+                source_size = img.size
+                decode_scale = apply_draft(img, stale_widths) if options.draft else 1
+                # Кадры анимации считаются, только если она попадёт хотя бы в один из форматов
+                source_frames = 1
+                if options.animation and any(fmt in ANIMATED_FORMATS for fmt in formats):
+                    source_frames = frame_count(img)
+                # Очень крупный исходник без сжатия читается полосами при масштабировании, и время
+                # чтения входит в стадию масштабирования
+                strips = stream_reader(img)
+                durations = None
+                if strips is not None:
+                    # Кадры анимации пришлось бы декодировать целиком: такой исходник кодируется как неподвижный
+                    source_frames = 1
+                else:
+                    check_decoded_size(img.size)
+                    # Длительности кадров читаются один раз для всех анимированных вариантов — до загрузки
+                    # первого кадра, который затем масштабируется
+                    if source_frames > 1 and any((width, fmt) not in fresh for width in stale_widths
+                                                 for fmt in formats if fmt in ANIMATED_FORMATS):
+                        durations = frame_durations(img, source_frames)
+                    img.load()
+                digest = None
+                if options.dedup and state is not None:
+                    # Хеш пикселей первого кадра не отличает анимации с разными остальными кадрами
+                    if source_frames == 1:
+                        digest = pixel_digest(img, decode_scale, strips() if strips else None)
+                        state["pixels"] = digest
+                    state["image_size"] = list(source_size)
+            except Exception:
+                img.close()
+                raise
+        decode_spans.append(decode_watch.span)
+
+        with img:
+            # Исходник с теми же пикселями (например, отличающийся только метаданными)
+            if digest is not None and dedup is not None and digest in dedup.pixels:
+                link_renditions(dedup.pixels[digest], decode_scale)
+                if not stale_widths:
+                    return finalize()
+            elif digest is not None and dedup is not None and digest in dedup.digests:
+                # Варианты донора у главного процесса: он отправит задачу заново вместе с ними
+                raise PixelMatch(source_size, digest)
+            if strips:
+                renditions = stream_renditions(img, strips, stale_widths, options.cascade, source_size)
+            else:
+                renditions = resize_renditions(img, stale_widths, options.cascade, source_size)
+            smallest = min(stale_widths)
+            previous = []
+            while cancel is None or not cancel.is_set():
+                with Stopwatch("resize") as resize_watch:
+                    rendition = next(renditions, None)
+                    # Заглушка считается по самому маленькому варианту, пока он в памяти; её время
+                    # (несколько миллисекунд) входит в стадию масштабирования
+                    if options.placeholder and stored_placeholder is None and rendition and rendition[0] == smallest:
+                        placeholder = compute_placeholder(rendition[1], options.placeholder)
+                if rendition is None:
+                    break
+                width, resized_img = rendition
+                resize_watch_by_width[width] = resize_watch.duration
+                heights[width] = resized_img.height
+                resize_spans = [resize_watch.span]
+                current = []
+                first = True
+                for fmt in formats:
+                    out_path = os.path.join(output_folder, output_filename(base_name, width, fmt))
+                    if (width, fmt) in linked:
+                        continue
+                    if (width, fmt) in fresh:
+                        outcome = _CACHED
+                    elif source_frames > 1 and fmt in ANIMATED_FORMATS:
+                        # Кадры анимации читаются из исходника по одному при кодировании; уменьшенный
+                        # первый кадр нужен только для остальных форматов
+                        args = (source_path, durations, resized_img.size, out_path, fmt, save_params.get(fmt, {}))
+                        pool = encoder or executor
+                        outcome = pool.submit(encode_animation, *args) if pool else encode_animation(*args)
+                    elif encoder is not None and SharedFrame.supported(resized_img):
+                        # Кодировщик получает описание сегмента, а не пиксели
+                        if width not in frames:
+                            frames[width] = SharedFrame(resized_img)
+                        outcome = encoder.submit(encode_shared, frames[width].ref, out_path, fmt,
+                                                 save_params.get(fmt, {}), options.target, guesses.get(fmt))
+                    elif executor:
+                        # Pillow сохраняет параметры кодирования в самом объекте изображения, поэтому
+                        # каждый поток получает собственную копию
+                        frame = resized_img if first else resized_img.copy()
+                        first = False
+                        outcome = executor.submit(encode_output, frame, out_path, fmt, save_params.get(fmt, {}),
+                                                  options.target, guesses.get(fmt))
+                    else:
+                        outcome = encode_output(resized_img, out_path, fmt, save_params.get(fmt, {}),
+                                                options.target, guesses.get(fmt))
+                        if outcome[3] is not None:
+                            guesses[fmt] = outcome[3]
+                    current.append((width, fmt, out_path, outcome, resize_spans))
+                # Пока кодируется текущий вариант, результаты предыдущего уже можно сообщить;
+                # одновременно в памяти находится не больше двух вариантов
+                finish(previous)
+                previous = current
+            finish(previous)
+    finally:
+        for frame in frames.values():
+            frame.close()
+        if executor and executor is not encoder:
+            executor.shutdown()
+
+    return finalize()
+
+
+def prune_renditions(results, formats):
+    """
+    Находит лишние варианты исходника по размерам закодированных файлов.
+
+    Лишним считается вариант:
+    - в дополнительном формате, если он не легче варианта той же ширины в первом из выбранных
+      форматов (например, WEBP не меньше JPEG);
+    - если вариант того же формата большей ширины не тяжелее его: он чётче и весит не больше.
+
+    :param results: Результаты конвертации одного исходника.
+    :param formats: Список форматов в порядке выбора.
+    :return: Список результатов, которые нужно удалить.
+    """
+    candidates = [r for r in results if r.ok and not r.pruned and r.size_bytes is not None]
+    dropped = set()
+
+    by_width = {}
+    for result in candidates:
+        by_width.setdefault(result.width, {})[result.fmt] = result
+    for group in by_width.values():
+        base_fmt = next(fmt for fmt in formats if fmt in group)
+        for fmt, result in group.items():
+            if fmt != base_fmt and result.size_bytes >= group[base_fmt].size_bytes:
+                dropped.add(id(result))
+
+    for fmt in formats:
+        lightest_wider = None
+        for result in sorted((r for r in candidates if r.fmt == fmt and id(r) not in dropped),
+                             key=lambda r: r.width, reverse=True):
+            if lightest_wider is not None and result.size_bytes >= lightest_wider:
+                dropped.add(id(result))
+            else:
+                lightest_wider = result.size_bytes if lightest_wider is None else min(lightest_wider, result.size_bytes)
+
+    return [r for r in candidates if id(r) in dropped]
+
+
+def source_html(source_path, results, formats, lazy_loading=True, output_folder=None):
+    """
+    Формирует HTML-код для одного исходного изображения по успешно сохранённым файлам.
+
+    :param source_path: Путь к исходному изображению.
+    :param results: Результаты конвертации этого изображения.
+    :param formats: Список форматов (задаёт порядок внутри одной ширины).
+    :param lazy_loading: Добавлять ли атрибут loading="lazy".
+    :param output_folder: Папка с code.txt; пути к файлам указываются относительно неё. Если не
+                          указана, используются только имена файлов.
+    :return: Строка с HTML-кодом или пустая строка, если ни один файл не сохранён.
+    """
+    saved = [r for r in results if r.ok and not r.pruned]
+    if not saved:
+        return ""
+    # Сортировка файлов по ширине и формату
+    saved.sort(key=lambda r: (r.width, formats.index(r.fmt)))
+    if output_folder:
+        files = [(r.width, os.path.relpath(r.out_path, output_folder).replace(os.sep, "/")) for r in saved]
+    else:
+        files = [(r.width, os.path.basename(r.out_path)) for r in saved]
+    return build_img_tag(source_base_name(source_path), files, lazy_loading, saved[0].placeholder)
+
+
+def available_cpus():
+    """
+    Возвращает число ядер, доступных текущему процессу (с учётом привязки к ядрам в контейнерах).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def resolve_workers(workers):
+    """
+    Определяет число рабочих процессов.
+
+    :param workers: Запрошенное число процессов; 0 или None — по числу ядер процессора.
+    :return: Число процессов (не меньше 1).
+    """
+    if not workers:
+        return available_cpus()
+    return max(1, int(workers))
+
+
+def resolve_encode_threads(encode_threads, workers, formats_count):
+    """
+    Определяет число потоков кодирования для одного процесса.
+
+    При автоматическом выборе ядра делятся между рабочими процессами, чтобы процессы и потоки
+    вместе не занимали больше ядер, чем есть.
+
+    :param encode_threads: Запрошенное число потоков; 0 или None — автоматически.
+    :param workers: Число рабочих процессов.
+    :param formats_count: Число форматов (больше потоков не понадобится).
+    """
+    if not encode_threads:
+        encode_threads = available_cpus() // max(1, workers)
+    return max(1, min(int(encode_threads), formats_count))
+
+
+# Флаг отмены в рабочем процессе пула (см. init_worker)
+_worker_cancel = None
+
+
+def init_worker(cancel):
+    """
+    Инициализирует рабочий процесс пула. Ctrl+C обрабатывает главный процесс: он просит рабочие
+    процессы остановиться через общий флаг, а не прерывает их посреди записи файла.
+
+    :param cancel: multiprocessing.Event, общий для всех рабочих процессов.
+    """
+    global _worker_cancel
+    _worker_cancel = cancel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def convert_source_in_worker(*args, **kwargs):
+    """
+    convert_source в рабочем процессе пула с общим флагом отмены.
+    """
+    return convert_source(*args, cancel=_worker_cancel, **kwargs)
+
+
+def iter_source_results(source_paths, widths, formats, output_folder, save_params, options,
+                        workers=1, on_output=None, manifest=None, scheduler=None, preserve_layout=False,
+                        cancel=None, spool=None, lease=None, metadata=None):
+    """
+    Конвертирует исходные изображения последовательно, в пуле процессов или через общую папку заданий.
+
+    В параллельном режиме каждый исходник (декодирование, масштабирование во все ширины и
+    кодирование во все форматы) обрабатывается отдельным процессом. Одновременно в пуле находится
+    не больше двух задач на процесс, а их суммарная оценка памяти укладывается в бюджет планировщика.
+
+    Исходники берутся из source_paths по мере необходимости, поэтому им может быть генератор,
+    ещё не закончивший обход папок (см. sources.iter_sources).
+
+    Если задан манифест и включён options.dedup, хеш каждого исходника считается перед отправкой
+    задачи, а в задачу передаются варианты одинаковых исходников (см. dedup). Исходник с тем же
+    хешем, что у ещё не завершённой задачи, ждёт её завершения, чтобы не кодировать его дважды.
+
+    :param source_paths: Пути к исходным изображениям или SourceFile.
+    :param widths: Список ширин.
+    :param formats: Список форматов.
+    :param output_folder: Папка для сохранения.
+    :param save_params: Словарь {формат: параметры сохранения}.
+    :param options: ConversionOptions.
+    :param workers: Число рабочих процессов; 1 — обработка в текущем процессе (с options.shared_memory —
+                    кодирование в отдельных процессах).
+    :param on_output: Функция для OutputResult; в параллельном режиме вызывается в текущем
+                      процессе после завершения исходника.
+    :param manifest: BuildManifest; сведения из него передаются в задачу каждого исходника.
+    :param scheduler: MemoryScheduler для параллельного режима; по умолчанию — без бюджета памяти.
+    :param preserve_layout: Повторять ли структуру подпапок исходников в папке результатов.
+    :param cancel: Объект с методом is_set(); после установки флага новые исходники не начинаются,
+                   а начатые останавливаются между ширинами (см. convert_source).
+    :param spool: Общая папка заданий: исходники конвертируют рабочие процессы, забирающие задания
+                  из неё (см. spool); workers и scheduler при этом не используются.
+    :param lease: Аренда задания в общей папке в секундах; None — spool.DEFAULT_LEASE.
+    :param metadata: metadata.MetadataIndex — хеши и размеры неизменённых исходников берутся из него,
+                     а посчитанные при конвертации записываются в него; None — без индекса.
+    :return: Генератор кортежей (индекс исходника, путь, список OutputResult или исключение)
+             в порядке завершения.
+    """
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    def lookup(source_path, folder):
+        if manifest is None:
+            return None
+        # Ширины после политики увеличения можно узнать по сохранённому размеру исходника
+        known = manifest.source(source_path) or {}
+        image_size = known.get("image_size")
+        planned = set(widths) | set(resolve_widths(widths, image_size[0] if image_size else None, options.upscale))
+        base_name = source_base_name(source_path)
+        out_paths = [os.path.join(folder, output_filename(base_name, width, fmt))
+                     for width in sorted(planned) for fmt in formats]
+        return manifest.lookup(source_path, out_paths)
+
+    dedup_index = None
+    if manifest is not None and options.dedup:
+        if options.incremental:
+            def dedup_keys(width, fmt):
+                if fmt not in formats:
+                    return None
+                return {"params": dict(save_params.get(fmt, {})), "pipeline": options.cache_key(fmt)}
+
+            dedup_index = DedupIndex.from_manifest(manifest, dedup_keys)
+        else:
+            dedup_index = DedupIndex()
+
+    def prepare(source_path, folder, state=None, digests_only=False):
+        # Сведения манифеста и доноры для задачи; хеш исходника считается здесь, а не в задаче.
+        # Задаче в другом процессе передаются только хеши пикселей кандидатов (см. dedup.PixelMatch)
+        cache = lookup(source_path, folder)
+        if cache is None:
+            return cache, None
+        if metadata is not None and not state:
+            # Хеш и размер неизменённого исходника известны по индексу, даже если в этой папке
+            # результатов он ещё не конвертировался; без индекса хеш посчитает задача
+            cache.state = metadata.cached_state(source_path, cache.state)
+        if dedup_index is None:
+            return cache, None
+        try:
+            if state:
+                cache.state = state
+            elif metadata is not None:
+                cache.state = metadata.source_state(source_path, cache.state)
+            else:
+                cache.state = source_state(source_path, cache.state)
+        except OSError:
+            return cache, None  # Ошибку открытия сообщит конвертация
+        if dedup_index.by_pixels and not cache.state.get("image_size"):
+            try:
+                image_size = metadata.image_size(source_path) if metadata is not None else read_image_size(source_path)
+                cache.state["image_size"] = list(image_size)
+            except Exception:
+                pass
+        return cache, dedup_index.hint(cache.state["sha256"], cache.state.get("image_size"), digests_only)
+
+    def remember(results):
+        if not results:
+            return
+        if dedup_index is not None:
+            dedup_index.add(results[0].source_state, results)
+        if metadata is not None:
+            metadata.record(results[0].source_path, results[0].source_state)
+
+    def tasks():
+        # Папка результатов каждого исходника создаётся перед отправкой задачи
+        for index, source in enumerate(source_paths):
+            source_path, subdir = split_source(source)
+            folder = source_output_folder(output_folder, subdir, preserve_layout)
+            if folder != output_folder:
+                try:
+                    os.makedirs(folder, exist_ok=True)
+                except OSError as e:
+                    yield index, source_path, folder, e
+                    continue
+            yield index, source_path, folder, None
+
+    if spool is not None:
+        from .spool import DEFAULT_LEASE, iter_spool_results
+
+        # Доноры одинаковых исходников в задания не передаются: хеш исходника считается здесь,
+        # а варианты кодирует тот рабочий процесс, который забрал задание
+        for index, source_path, results in iter_spool_results(
+                spool, tasks(), widths, formats, save_params, options, on_output,
+                lambda source_path, folder: prepare(source_path, folder)[0], cancel,
+                DEFAULT_LEASE if lease is None else lease):
+            if not isinstance(results, Exception):
+                remember(results)
+            yield index, source_path, results
+        return
+
+    if workers <= 1:
+        # Процессы-кодировщики живут весь запуск: исходники масштабируются здесь, пока кодируются
+        # варианты предыдущей ширины
+        encoder = None
+        if options.shared_memory:
+            start_tracker()
+            encoder = ProcessPoolExecutor(max_workers=resolve_encode_threads(options.encode_threads, 1, len(formats)),
+                                          initializer=init_worker, initargs=(None,))
+        try:
+            for index, source_path, folder, error in tasks():
+                if cancelled():
+                    return
+                if error is not None:
+                    yield index, source_path, error
+                    continue
+                try:
+                    cache, hint = prepare(source_path, folder)
+                    results = convert_source(source_path, widths, formats, folder, save_params, options,
+                                             on_output, cache, cancel, hint, encoder)
+                except Exception as e:
+                    yield index, source_path, e
+                    continue
+                remember(results)
+                yield index, source_path, results
+        finally:
+            if encoder is not None:
+                encoder.shutdown()
+        return
+
+    if scheduler is None:
+        scheduler = MemoryScheduler(None, workers * 2)
+
+    def estimate(source_path):
+        try:
+            return estimate_source_memory(source_path, widths, options.draft, options.encode_threads, metadata)
+        except Exception:
+            return 0  # Ошибку открытия сообщит рабочий процесс
+
+    pending = {}
+    in_flight = set()  # Хеши исходников, задачи которых ещё выполняются
+    deferred = {}      # Хеш -> исходники, ждущие завершения задачи с тем же хешем
+    sources = tasks()
+    worker_cancel = multiprocessing.Event()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(worker_cancel,)) as executor:
+        try:
+            while True:
+                if cancelled():
+                    # Новые задачи не запускаются, начатые останавливаются между ширинами
+                    worker_cancel.set()
+                    for future in list(pending):
+                        if future.cancel():
+                            scheduler.release(pending.pop(future)[2])
+                else:
+                    # Оценка памяти по заголовкам для окна очереди и запуск задач, укладывающихся в бюджет
+                    for index, source_path, folder, error in sources:
+                        if error is not None:
+                            yield index, source_path, error
+                            continue
+                        scheduler.add((index, source_path, folder, None), estimate(source_path))
+                        if len(scheduler) >= workers * 4:
+                            break
+                    for (index, source_path, folder, state), cost in scheduler.admit():
+                        cache, hint = prepare(source_path, folder, state, digests_only=True)
+                        sha256 = cache.state.get("sha256") if cache is not None and cache.state else None
+                        if dedup_index is not None and sha256 in in_flight:
+                            # Такой же файл уже конвертируется: варианты будут взяты у него
+                            scheduler.release(cost)
+                            deferred.setdefault(sha256, []).append((index, source_path, folder, cache.state))
+                            continue
+                        future = executor.submit(convert_source_in_worker, source_path, widths, formats, folder,
+                                                 save_params, options, None, cache, dedup=hint)
+                        pending[future] = (index, source_path, cost, sha256, folder, cache, hint)
+                        if sha256 is not None:
+                            in_flight.add(sha256)
+                if not pending:
+                    break
+
+                done, _ = wait(pending, timeout=CANCEL_POLL_INTERVAL if cancel is not None else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, source_path, cost, sha256, folder, cache, hint = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except PixelMatch as match:
+                        # Пиксели совпали с донором: задача отправляется заново с его вариантами
+                        hint = dedup_index.pixel_match(hint, match)
+                        future = executor.submit(convert_source_in_worker, source_path, widths, formats, folder,
+                                                 save_params, options, None, cache, dedup=hint)
+                        pending[future] = (index, source_path, cost, sha256, folder, cache, hint)
+                        continue
+                    except Exception as e:
+                        results = e
+                    scheduler.release(cost)
+                    in_flight.discard(sha256)
+                    if not isinstance(results, Exception):
+                        remember(results)
+                    # Ждавшие этот исходник дубликаты возвращаются в очередь
+                    for task in deferred.pop(sha256, ()):
+                        scheduler.add(task, estimate(task[1]))
+                    if isinstance(results, Exception):
+                        yield index, source_path, results
+                        continue
+                    if on_output:
+                        for result in results:
+                            on_output(result)
+                    yield index, source_path, results
+        except BaseException:
+            # При прерывании (в том числе закрытии генератора) рабочие процессы дописывают
+            # начатые файлы и останавливаются, не начиная новых ширин
+            worker_cancel.set()
+            raise
+
+
+def record_manifest(manifest, source_path, results):
+    """
+    Заносит в манифест сборки результаты конвертации одного исходника.
+
+    :param manifest: BuildManifest.
+    :param source_path: Путь к исходнику.
+    :param results: Результаты конвертации исходника.
+    """
+    for result in results:
+        if result.cache_key is None:
+            continue
+        if not result.ok:
+            manifest.forget_output(result.out_path)
+        elif result.pruned:
+            # Размер удалённого варианта сохраняется для сравнения при следующих запусках
+            if not result.cached or not manifest.is_pruned(result.out_path):
+                manifest.record_output(result.out_path, result.cache_key, result.size_bytes, pruned=True,
+                                       height=result.height, quality=result.quality)
+        elif not result.cached:
+            try:
+                manifest.record_output(result.out_path, result.cache_key, result.size_bytes,
+                                       height=result.height, quality=result.quality)
+            except OSError:
+                manifest.forget_output(result.out_path)
+    if results and results[0].source_state:
+        manifest.record_source(source_path, results[0].source_state)
+
+
+def convert_images(source_paths, widths, formats, output_folder=None, save_params=None,
+                   generate_html=True, lazy_loading=True, on_output=None, on_error=None, workers=1,
+                   options=None, memory_budget=None, trace_path=None, preserve_layout=False, manifest=None,
+                   generate_index=True, cancel=None, job=None, spool=None, lease=None, metadata=None):
+    """
+    Конвертирует набор изображений и записывает HTML-код в code.txt и список вариантов в images.json.
+
+    Исходники читаются из source_paths по ходу конвертации: можно передать генератор
+    sources.iter_sources, и конвертация начнётся до окончания обхода папок. Описание каждого
+    исходника дописывается в файлы сразу после его обработки (см. output.OutputWriter).
+
+    :param source_paths: Пути к исходным изображениям или SourceFile (итерируемый объект).
+    :param widths: Список ширин.
+    :param formats: Список форматов (подмножество SUPPORTED_FORMATS).
+    :param output_folder: Папка для сохранения; по умолчанию — папка первого исходника
+                          (для найденных в папке — корень обхода).
+    :param save_params: Дополнительные параметры сохранения {формат: {параметр: значение}}.
+    :param generate_html: Генерировать ли HTML-код и файл code.txt.
+    :param lazy_loading: Добавлять ли атрибут loading="lazy".
+    :param on_output: Функция, вызываемая с OutputResult после каждого выходного файла.
+    :param on_error: Функция, вызываемая с текстом ошибки.
+    :param workers: Число рабочих процессов; 1 — последовательная обработка, 0 — по числу ядер.
+    :param options: ConversionOptions; по умолчанию — параметры по умолчанию.
+    :param memory_budget: Бюджет памяти параллельной конвертации в байтах; None — половина
+                          физической памяти, 0 — без ограничения (см. scheduler).
+    :param trace_path: Путь к файлу трассировки стадий (".jsonl" — JSON Lines, иначе Chrome Trace).
+    :param preserve_layout: Повторять ли структуру подпапок исходников в папке результатов.
+    :param manifest: Уже загруженный BuildManifest папки результатов (например, в режиме наблюдения,
+                     чтобы не перечитывать его при каждом запуске); по умолчанию загружается из папки.
+    :param generate_index: Записывать ли images.json (ширины, форматы, размеры в пикселях и байтах).
+    :param cancel: Объект с методом is_set() (например, threading.Event). После установки флага
+                   начатые файлы дописываются, манифест сохраняется, а code.txt и images.json
+                   не заменяются; повторный запуск продолжит с того же места.
+    :param job: Описание задания для продолжения (см. cache.save_job); записывается в папку
+                результатов перед началом и удаляется, если все исходники обработаны.
+    :param spool: Общая папка заданий: исходники раздаются рабочим процессам на этой и других машинах
+                  (см. spool), а результаты собираются здесь; workers при этом не используется.
+    :param lease: Аренда задания в общей папке в секундах; None — по умолчанию.
+    :param metadata: metadata.MetadataIndex — постоянный индекс хешей и заголовков исходников, общий
+                     для всех папок результатов; None — сведения берутся только из манифеста сборки.
+    :return: ConversionReport.
+    """
+    unknown = [fmt for fmt in formats if fmt not in SUPPORTED_FORMATS]
+    if unknown:
+        raise ValueError(f"Неподдерживаемые форматы: {', '.join(unknown)}")
+    if not formats:
+        raise ValueError("Не выбран ни один формат для конвертации.")
+    # Число исходников известно заранее, только если передан список, а не генератор
+    count = len(source_paths) if hasattr(source_paths, "__len__") else None
+    sources = iter(source_paths)
+    if not output_folder:
+        first = next(sources, None)
+        if first is not None:
+            output_folder = source_root(first)
+            sources = itertools.chain([first], sources)
+    params = resolve_save_params(formats, save_params)
+    if options is None:
+        options = ConversionOptions()
+
+    workers = resolve_workers(workers)
+    if count is not None:
+        workers = min(workers, max(1, count))
+    options = copy.copy(options)
+    options.encode_threads = resolve_encode_threads(options.encode_threads, workers, len(formats))
+
+    if manifest is None:
+        manifest = BuildManifest.load(output_folder)
+    scheduler = MemoryScheduler(resolve_memory_budget(memory_budget), workers * 2)
+    report = ConversionReport()
+    report.scheduler = scheduler
+    report.output_folder = output_folder
+
+    def report_error(message):
+        report.errors.append(message)
+        if on_error:
+            on_error(message)
+
+    def save_manifest():
+        try:
+            manifest.save()
+        except OSError as e:
+            report_error(f"Ошибка записи манифеста сборки: {e}")
+
+    def flush_journal():
+        try:
+            manifest.flush_journal()
+        except OSError as e:
+            report_error(f"Ошибка записи журнала сборки: {e}")
+
+    if job is not None:
+        try:
+            save_job(output_folder, job)
+        except OSError as e:
+            report_error(f"Ошибка записи описания задания: {e}")
+
+    trace = TraceWriter(trace_path) if trace_path else None
+    writer = None
+    if generate_html or generate_index:
+        try:
+            writer = OutputWriter(output_folder, widths, formats, generate_html, generate_index)
+        except OSError as e:
+            report_error(f"Ошибка записи code.txt и images.json: {e}")
+
+    def write_source(index, source_path=None, results=()):
+        # Ошибка записи описаний не прерывает конвертацию: файлы вариантов важнее
+        nonlocal writer
+        if not writer:
+            return
+        html_code = entry = None
+        if results:
+            if generate_html:
+                html_code = source_html(source_path, results, formats, lazy_loading, output_folder)
+            entry = source_entry(source_path, results, output_folder)
+        try:
+            writer.add(index, html_code, entry)
+        except OSError as e:
+            writer.abort()
+            writer = None
+            report_error(f"Ошибка записи code.txt и images.json: {e}")
+
+    # Результаты прошлых запусков в обходимой папке не считаются исходниками
+    sources = (source for source in sources if not manifest.is_output(split_source(source)[0]))
+
+    try:
+        for index, source_path, results in iter_source_results(
+                sources, widths, formats, output_folder, params, options, workers, on_output, manifest,
+                scheduler, preserve_layout, cancel, spool, lease, metadata):
+            if isinstance(results, Exception):
+                report_error(f"Не удалось обработать файл {source_path}: {results}")
+                write_source(index)
+                continue
+            report.results.extend(results)
+            report.sources_converted += 1
+            if trace:
+                for result in results:
+                    trace.write_result(result)
+            # Время декодирования есть только у файлов, закодированных заново: актуальные и взятые
+            # у одинакового исходника файлы его не имеют
+            decoded = [r for r in results if "decode" in r.timings]
+            if decoded:
+                report.sources_decoded += 1
+                if any(r.decode_scale > 1 for r in decoded):
+                    report.draft_decodes += 1
+            record_manifest(manifest, source_path, results)
+            if report.sources_converted % MANIFEST_SAVE_INTERVAL == 0:
+                save_manifest()
+            else:
+                flush_journal()
+            write_source(index, source_path, results)
+    except BaseException:
+        # При прерывании прежние code.txt и images.json не заменяются; записанное остаётся во временных файлах
+        if writer:
+            writer.abort()
+        raise
+    finally:
+        # Манифест сохраняется и при прерывании: уже собранные файлы не придётся пересобирать
+        save_manifest()
+        if trace:
+            trace.close()
+        if metadata is not None:
+            metadata.flush()
+
+    report.cancelled = cancel is not None and cancel.is_set()
+    if report.cancelled:
+        # Описания неполные: прежние файлы остаются, записанное — во временных файлах
+        if writer:
+            writer.abort()
+        return report
+
+    if writer:
+        try:
+            report.code_path, report.index_path = writer.close()
+        except OSError as e:
+            writer.abort()
+            report_error(f"Ошибка записи code.txt и images.json: {e}")
+    if job is not None:
+        try:
+            clear_job(output_folder)
+        except OSError:
+            pass
+
+    return report
@@ -0,0 +1,308 @@
+"""
+Постоянный индекс сведений об исходниках.
+
+Предпросмотр, политика увеличения и оценка памяти задач читают размер, режим и формат исходника
+из заголовка файла, а инкрементальная конвертация — хеш его содержимого. Индекс запоминает эти
+сведения между запусками в базе SQLite (по умолчанию в папке кэша пользователя, общей для всех
+папок результатов). Ключ — путь, размер файла и время изменения: для неизменённого файла хватает
+os.stat, а заголовок читается и хеш считается заново, только если файл изменился.
+
+Индекс — только кэш: его можно удалить в любой момент, а ошибки записи в него (например, если
+база дольше BUSY_TIMEOUT занята другим процессом) не прерывают работу.
+"""
+import os
+import sqlite3
+import threading
+
+from .cache import file_digest
+from .stream import open_image, stream_reader
+
+# Имя файла индекса в папке кэша
+METADATA_FILENAME = "metadata.sqlite"
+
+# Версия схемы индекса; при несовпадении индекс создаётся заново
+SCHEMA_VERSION = 1
+
+# Сколько секунд ждать, пока база занята другим процессом
+BUSY_TIMEOUT = 5.0
+
+# Сколько изменений накапливается перед записью в базу одной транзакцией
+WRITE_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    mode TEXT,
+    format TEXT,
+    streamed INTEGER,
+    sha256 TEXT
+)
+"""
+
+
+def default_metadata_path():
+    """
+    Путь к индексу по умолчанию: папка кэша пользователя (LOCALAPPDATA в Windows, XDG_CACHE_HOME
+    или ~/.cache в остальных системах).
+    """
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "optimagegen", METADATA_FILENAME)
+
+
+def open_metadata(path=None):
+    """
+    Открывает индекс или возвращает None, если это не удалось (например, папка кэша недоступна
+    для записи): без индекса сведения читаются из файлов, как обычно.
+
+    :param path: Путь к файлу базы; по умолчанию default_metadata_path().
+    """
+    try:
+        return MetadataIndex(path or default_metadata_path())
+    except (OSError, sqlite3.Error):
+        return None
+
+
+class SourceInfo:
+    """
+    Сведения об исходнике из заголовка файла.
+    """
+
+    def __init__(self, size, mode, fmt, streamed=False):
+        """
+        :param size: Размер изображения (ширина, высота).
+        :param mode: Режим изображения.
+        :param fmt: Формат файла (img.format).
+        :param streamed: Масштабируется ли исходник полосами, без декодирования целиком (см. stream).
+        """
+        self.size = tuple(size)
+        self.mode = mode
+        self.format = fmt
+        self.streamed = streamed
+
+
+def read_source_info(source_path):
+    """
+    Читает сведения об исходнике из заголовка файла, не декодируя пиксели.
+
+    :param source_path: Путь к исходнику.
+    :return: SourceInfo.
+    """
+    with open_image(source_path) as img:
+        return SourceInfo(img.size, img.mode, img.format, stream_reader(img) is not None)
+
+
+# Столбцы сведений об исходнике (кроме ключа)
+_INFO_COLUMNS = ("width", "height", "mode", "format", "streamed", "sha256")
+
+
+class _Stat:
+    # Размер и время изменения файла, известные из сохранённого состояния
+    def __init__(self, size, mtime_ns):
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+
+
+def _is_fresh(state, stat):
+    return bool(state) and state.get("size") == stat.st_size and state.get("mtime_ns") == stat.st_mtime_ns
+
+
+class MetadataIndex:
+    """
+    Индекс сведений об исходниках в базе SQLite.
+
+    Объект можно использовать из нескольких потоков (например, предпросмотр окна и поток
+    конвертации), а одну базу — из нескольких процессов. Изменения накапливаются в памяти и
+    записываются короткими транзакциями по WRITE_BATCH штук, а остаток — при вызове flush или close,
+    поэтому база не остаётся заблокированной между обращениями.
+    """
+
+    def __init__(self, path):
+        """
+        Открывает индекс, создавая базу и папку для неё при необходимости.
+
+        :param path: Путь к файлу базы (см. default_metadata_path).
+        :raises OSError, sqlite3.Error: Если базу не удалось открыть или создать.
+        """
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.hits = 0    # Сколько раз сведения взяты из индекса
+        self.misses = 0  # Сколько раз пришлось читать заголовок или считать хеш
+        self._lock = threading.Lock()
+        self._pending = []         # Ещё не записанные изменения: (запрос, параметры)
+        self._pending_paths = set()
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        try:
+            # Журнал WAL позволяет читать индекс, пока другой процесс в него пишет
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS sources")
+                self._db.execute(_SCHEMA)
+                self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        except sqlite3.Error:
+            self._db.close()
+            raise
+
+    @staticmethod
+    def _key(source_path):
+        return os.path.normcase(os.path.abspath(source_path))
+
+    def _row(self, source_path, stat):
+        # Запись о файле в его текущем состоянии или None, если файл с тех пор изменился
+        key = self._key(source_path)
+        try:
+            with self._lock:
+                if key in self._pending_paths:
+                    self._write()
+                return self._db.execute(
+                    "SELECT width, height, mode, format, streamed, sha256 FROM sources "
+                    "WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    (key, stat.st_size, stat.st_mtime_ns),
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+
+    def _write(self):
+        # Записывает накопленные изменения одной транзакцией; вызывается под блокировкой
+        pending, self._pending = self._pending, []
+        self._pending_paths.clear()
+        try:
+            self._db.execute("BEGIN")
+            try:
+                for sql, params in pending:
+                    self._db.execute(sql, params)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        except sqlite3.Error:
+            pass  # Индекс — только кэш
+
+    def flush(self):
+        """
+        Записывает в базу накопленные изменения.
+        """
+        with self._lock:
+            if self._pending:
+                self._write()
+
+    def _store(self, source_path, stat, **fields):
+        # Сведения о неизменённом файле дополняются, а об изменённом — заменяются: прочие столбцы
+        # прежней записи к новому содержимому не относятся
+        columns = ["path", "size", "mtime_ns", *fields]
+        kept = ", ".join(
+            f"{name} = CASE WHEN sources.size = excluded.size AND sources.mtime_ns = excluded.mtime_ns "
+            f"THEN sources.{name} ELSE NULL END"
+            for name in _INFO_COLUMNS if name not in fields
+        )
+        updates = ", ".join(f"{name} = excluded.{name}" for name in fields)
+        sql = (f"INSERT INTO sources ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+               f"ON CONFLICT(path) DO UPDATE SET {', '.join(filter(None, [kept, updates]))}, "
+               "size = excluded.size, mtime_ns = excluded.mtime_ns")
+        key = self._key(source_path)
+        with self._lock:
+            self._pending.append((sql, (key, stat.st_size, stat.st_mtime_ns, *fields.values())))
+            self._pending_paths.add(key)
+            if len(self._pending) >= WRITE_BATCH:
+                self._write()
+
+    def info(self, source_path):
+        """
+        Сведения об исходнике: из индекса, если файл не менялся, иначе из заголовка (с записью в индекс).
+
+        :param source_path: Путь к исходнику.
+        :return: SourceInfo.
+        :raises Exception: Если файл не существует или не открывается как изображение.
+        """
+        stat = os.stat(source_path)
+        row = self._row(source_path, stat)
+        if row is not None and row[2] is not None:
+            self.hits += 1
+            return SourceInfo(row[:2], row[2], row[3], bool(row[4]))
+        self.misses += 1
+        info = read_source_info(source_path)
+        self._store(source_path, stat, width=info.size[0], height=info.size[1], mode=info.mode, format=info.format,
+                    streamed=int(info.streamed))
+        return info
+
+    def image_size(self, source_path):
+        """
+        Размер изображения (ширина, высота); заголовок читается, только если файл изменился.
+
+        :raises Exception: См. info.
+        """
+        row = self._row(source_path, os.stat(source_path))
+        if row is not None and row[0] is not None:
+            self.hits += 1
+            return tuple(row[:2])
+        return self.info(source_path).size
+
+    def cached_state(self, source_path, known_state=None):
+        """
+        Состояние исходника (см. cache.source_state) без чтения файла.
+
+        :param source_path: Путь к исходнику.
+        :param known_state: Состояние из манифеста сборки или None.
+        :return: known_state, если файл с тех пор не менялся; иначе состояние из индекса (с размером
+                 изображения, если он известен); иначе known_state — хеш посчитает конвертация.
+        """
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return known_state  # Ошибку открытия сообщит конвертация
+        if _is_fresh(known_state, stat):
+            return known_state
+        row = self._row(source_path, stat)
+        if row is None or row[5] is None:
+            return known_state
+        self.hits += 1
+        state = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": row[5]}
+        if row[0] is not None:
+            state["image_size"] = list(row[:2])
+        return state
+
+    def source_state(self, source_path, known_state=None):
+        """
+        То же, что cache.source_state, но хеш неизменённого файла берётся из индекса, а посчитанный
+        заново — записывается в него.
+        """
+        state = self.cached_state(source_path, known_state)
+        stat = os.stat(source_path)
+        if _is_fresh(state, stat):
+            return dict(state)
+        self.misses += 1
+        state = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_digest(source_path)}
+        self._store(source_path, stat, sha256=state["sha256"])
+        return state
+
+    def record(self, source_path, state):
+        """
+        Запоминает состояние исходника, посчитанное при конвертации (в том числе в рабочем процессе).
+
+        :param source_path: Путь к исходнику.
+        :param state: Состояние (см. cache.source_state), возможно с размером изображения.
+        """
+        if not state or not state.get("sha256"):
+            return
+        fields = {"sha256": state["sha256"]}
+        if state.get("image_size"):
+            fields["width"], fields["height"] = state["image_size"]
+        self._store(source_path, _Stat(state["size"], state["mtime_ns"]), **fields)
+
+    def close(self):
+        """
+        Записывает накопленные изменения и закрывает базу.
+        """
+        with self._lock:
+            if self._pending:
+                self._write()
+            self._db.close()
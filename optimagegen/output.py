@@ -0,0 +1,236 @@
+"""
+Запись описаний результатов: HTML-кода (code.txt) и машиночитаемого списка вариантов (images.json).
+
+Описание каждого исходника дописывается в файл, как только исходник обработан, поэтому память
+не растёт с размером пакета. Запись идёт во временные файлы с суффиксом PARTIAL_SUFFIX, которые
+переименовываются в итоговые только после завершения конвертации: прежние code.txt и images.json
+остаются целыми до конца запуска, а после сбоя всё обработанное можно найти во временных файлах.
+"""
+import json
+import os
+import uuid
+
+# Имя файла с накопленным HTML-кодом
+CODE_FILENAME = "code.txt"
+
+# Имя файла со списком вариантов каждого исходника
+INDEX_FILENAME = "images.json"
+
+# Суффикс файлов, которые ещё дописываются; имя начинается с точки, поэтому обход папок их пропускает
+PARTIAL_SUFFIX = ".part"
+
+# Разделитель HTML-кода разных исходников
+HTML_SEPARATOR = "\n\n"
+
+# Окончание images.json: закрытие списка исходников
+INDEX_FOOTER = "\n]\n}\n"
+
+
+def relative_url(path, output_folder):
+    """
+    Путь к файлу относительно папки результатов с разделителем "/".
+    """
+    return os.path.relpath(path, output_folder).replace(os.sep, "/")
+
+
+def source_entry(source_path, results, output_folder):
+    """
+    Описание вариантов одного исходника для images.json.
+
+    :param source_path: Путь к исходному изображению.
+    :param results: Результаты конвертации этого исходника (OutputResult).
+    :param output_folder: Папка результатов; пути к вариантам указываются относительно неё.
+    :return: Словарь или None, если ни один вариант не сохранён.
+    """
+    saved = sorted((r for r in results if r.ok and not r.pruned), key=lambda r: (r.width, r.fmt))
+    if not saved:
+        return None
+    renditions = []
+    for result in saved:
+        rendition = {
+            "path": relative_url(result.out_path, output_folder),
+            "format": result.fmt,
+            "width": result.width,
+            "height": result.height,
+            "bytes": result.size_bytes,
+        }
+        if result.quality is not None:
+            rendition["quality"] = result.quality
+        renditions.append(rendition)
+    entry = {"source": source_path, "renditions": renditions}
+    if saved[0].placeholder:
+        entry["placeholder"] = saved[0].placeholder
+    return entry
+
+
+def partial_path(path):
+    """
+    Путь временного файла, в который дописывается файл path.
+    """
+    folder, name = os.path.split(path)
+    return os.path.join(folder, "." + name + PARTIAL_SUFFIX)
+
+
+def private_partial_path(path):
+    """
+    Путь временного файла, принадлежащего только текущему пишущему.
+
+    Один выходной файл могут одновременно пересобирать два процесса — например, задание общей папки,
+    возвращённое в очередь после истечения аренды, и рабочий процесс, который его всё ещё выполняет.
+    С общим временным файлом они обрезали бы записанное друг другом, и переименование могло бы
+    выдать недописанный файл за готовый.
+    """
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f".{name}.{os.getpid()}-{uuid.uuid4().hex[:8]}{PARTIAL_SUFFIX}")
+
+
+def index_header(widths, formats):
+    """
+    Начало images.json: общие параметры и открытие списка исходников.
+    """
+    return (f'{{\n"widths": {json.dumps(list(widths))},\n'
+            f'"formats": {json.dumps(list(formats))},\n"images": [\n')
+
+
+def commit_file(f, path):
+    """
+    Сбрасывает дописанный временный файл на диск и атомарно переименовывает его в итоговый.
+
+    :param f: Открытый временный файл (см. partial_path).
+    :param path: Путь итогового файла.
+    """
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(f.name, path)
+
+
+def write_code_file(path, html_parts):
+    """
+    Атомарно перезаписывает code.txt: сначала во временный файл, затем переименованием.
+
+    :param path: Путь к code.txt.
+    :param html_parts: HTML-код исходников в порядке следования.
+    """
+    with open(partial_path(path), "w", encoding="utf-8") as f:
+        f.write(HTML_SEPARATOR.join(html_parts))
+        commit_file(f, path)
+
+
+def write_index_file(path, widths, formats, entries):
+    """
+    Атомарно перезаписывает images.json.
+
+    :param path: Путь к images.json.
+    :param widths: Запрошенные ширины.
+    :param formats: Форматы.
+    :param entries: Описания исходников (см. source_entry) в порядке следования.
+    """
+    with open(partial_path(path), "w", encoding="utf-8") as f:
+        f.write(index_header(widths, formats))
+        f.write(",\n".join(json.dumps(entry, ensure_ascii=False) for entry in entries))
+        f.write(INDEX_FOOTER)
+        commit_file(f, path)
+
+
+class OutputWriter:
+    """
+    Потоковая запись code.txt и images.json по мере обработки исходников.
+
+    В параллельном режиме исходники завершаются в произвольном порядке; описания, пришедшие раньше
+    предыдущих, ждут в памяти, пока не придут все предыдущие, так что порядок в файлах совпадает
+    с порядком исходников, а в памяти держится не больше окна опережения пула.
+    """
+
+    def __init__(self, output_folder, widths, formats, write_html=True, write_index=True):
+        """
+        :param output_folder: Папка результатов.
+        :param widths: Запрошенные ширины (записываются в images.json).
+        :param formats: Форматы (записываются в images.json).
+        :param write_html: Записывать ли code.txt.
+        :param write_index: Записывать ли images.json.
+        """
+        self.code_path = os.path.join(output_folder, CODE_FILENAME)
+        self.index_path = os.path.join(output_folder, INDEX_FILENAME)
+        self.html_count = 0     # Сколько исходников записано в code.txt
+        self.index_count = 0    # Сколько исходников записано в images.json
+        self._next = 0          # Индекс исходника, который должен быть записан следующим
+        self._waiting = {}      # Индекс -> (HTML-код, описание), пришедшие раньше предыдущих
+        self._html = open(partial_path(self.code_path), "w", encoding="utf-8") if write_html else None
+        self._index = None
+        if write_index:
+            self._index = open(partial_path(self.index_path), "w", encoding="utf-8")
+            self._index.write(index_header(widths, formats))
+
+    def add(self, index, html_code=None, entry=None):
+        """
+        Передаёт описание исходника. Вызывается для каждого индекса, в том числе для исходников,
+        которые не удалось обработать (с пустыми значениями), — иначе следующие будут ждать до close.
+
+        :param index: Порядковый номер исходника.
+        :param html_code: HTML-код исходника или пустое значение.
+        :param entry: Описание для images.json (см. source_entry) или None.
+        """
+        self._waiting[index] = (html_code, entry)
+        while self._next in self._waiting:
+            self._write(*self._waiting.pop(self._next))
+            self._next += 1
+
+    def _write(self, html_code, entry):
+        if html_code and self._html:
+            if self.html_count:
+                self._html.write(HTML_SEPARATOR)
+            self._html.write(html_code)
+            self._html.flush()
+            self.html_count += 1
+        if entry and self._index:
+            if self.index_count:
+                self._index.write(",\n")
+            self._index.write(json.dumps(entry, ensure_ascii=False))
+            self._index.flush()
+            self.index_count += 1
+
+    def close(self):
+        """
+        Дописывает оставшиеся описания и атомарно заменяет code.txt и images.json.
+        Файл без единого исходника не записывается, а прежний остаётся на месте.
+
+        :return: Пара путей (code.txt, images.json); None вместо пути файла, который не записан.
+        """
+        for index in sorted(self._waiting):
+            self._write(*self._waiting.pop(index))
+        code_path = index_path = None
+        if self._html:
+            if self.html_count:
+                commit_file(self._html, self.code_path)
+                code_path = self.code_path
+            else:
+                self._discard(self._html)
+            self._html = None
+        if self._index:
+            if self.index_count:
+                self._index.write(INDEX_FOOTER)
+                commit_file(self._index, self.index_path)
+                index_path = self.index_path
+            else:
+                self._discard(self._index)
+            self._index = None
+        return code_path, index_path
+
+    def abort(self):
+        """
+        Закрывает временные файлы без замены итоговых: записанное до прерывания остаётся
+        во временных файлах.
+        """
+        for f in (self._html, self._index):
+            if f:
+                f.close()
+        self._html = self._index = None
+
+    @staticmethod
+    def _discard(f):
+        f.close()
+        try:
+            os.remove(f.name)
+        except OSError:
+            pass
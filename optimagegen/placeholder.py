@@ -0,0 +1,240 @@
+"""
+Заглушки, которые браузер показывает на месте изображения, пока оно загружается.
+
+Заглушка считается по самому маленькому варианту, уже находящемуся в памяти после масштабирования:
+вариант уменьшается до SAMPLE_SIDE пикселей по большей стороне, а дальнейшие вычисления выполняются
+над массивом numpy целиком, без циклов по пикселям, поэтому заглушка добавляет к исходнику
+несколько миллисекунд. Заглушка бывает двух видов (PLACEHOLDER_KINDS):
+
+- "blurhash" — строка BlurHash (https://blurha.sh): размытое изображение из нескольких
+  косинусных компонент, которое раскодирует сценарий на странице;
+- "lqip" — крошечная уменьшенная копия в WEBP, встроенная в HTML как data: URL.
+
+В обоих случаях запоминается и преобладающий цвет: его браузер показывает без сценариев.
+
+Для вычислений нужна библиотека numpy.
+"""
+import base64
+import io
+
+from PIL import Image
+
+# Виды заглушек
+PLACEHOLDER_KINDS = ("blurhash", "lqip")
+
+# Сторона, до которой вариант уменьшается перед вычислениями
+SAMPLE_SIDE = 32
+
+# Число компонент BlurHash по большей и меньшей стороне изображения (от 1 до 9)
+BLURHASH_COMPONENTS = (4, 3)
+
+# Большая сторона и качество встроенной уменьшенной копии
+LQIP_SIDE = 16
+LQIP_QUALITY = 30
+
+# Сколько старших бит каждого канала учитывается при поиске преобладающего цвета
+COLOR_BITS = 4
+
+# Алфавит base83 из спецификации BlurHash
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _encode83(value, length):
+    return "".join(_BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def _sample(img):
+    # Уменьшенная копия в RGB или RGBA (если есть прозрачность) и признак прозрачности
+    mode = "RGBA" if img.mode in ("RGBA", "LA", "La", "RGBa", "PA") or img.has_transparency_data else "RGB"
+    sample = img if img.mode == mode else img.convert(mode)
+    scale = SAMPLE_SIDE / max(img.size)
+    if scale < 1:
+        sample = sample.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BOX)
+    if mode == "RGBA" and sample.getextrema()[3][0] == 255:
+        return sample.convert("RGB"), False
+    return sample, mode == "RGBA"
+
+
+def srgb_to_linear(values):
+    """
+    Переводит 8-битные значения sRGB в линейную яркость 0–1.
+
+    :param values: Массив numpy uint8.
+    """
+    import numpy as np
+
+    table = np.arange(256, dtype=np.float64) / 255
+    table = np.where(table <= 0.04045, table / 12.92, ((table + 0.055) / 1.055) ** 2.4)
+    return table[values]
+
+
+def linear_to_srgb(values):
+    """
+    Переводит линейную яркость 0–1 в 8-битные значения sRGB.
+
+    :param values: Массив numpy с плавающей точкой.
+    :return: Массив целых чисел 0–255.
+    """
+    import numpy as np
+
+    values = np.clip(values, 0, 1)
+    srgb = np.where(values <= 0.0031308, values * 12.92, 1.055 * values ** (1 / 2.4) - 0.055)
+    return (srgb * 255 + 0.5).astype(np.int64)
+
+
+def blurhash(pixels, components_x, components_y):
+    """
+    Строка BlurHash изображения.
+
+    Коэффициенты всех компонент считаются одним свёртыванием массива пикселей с таблицами
+    косинусов по строкам и столбцам.
+
+    :param pixels: Массив numpy uint8 формы (высота, ширина, 3) в sRGB.
+    :param components_x: Число компонент по горизонтали (1–9).
+    :param components_y: Число компонент по вертикали (1–9).
+    """
+    import numpy as np
+
+    height, width = pixels.shape[:2]
+    linear = srgb_to_linear(pixels)
+    basis_x = np.cos(np.pi * np.outer(np.arange(components_x), np.arange(width)) / width)
+    basis_y = np.cos(np.pi * np.outer(np.arange(components_y), np.arange(height)) / height)
+    # factors[j, i] — цвет компоненты i по горизонтали и j по вертикали
+    factors = np.einsum("jy,ix,yxc->jic", basis_y, basis_x, linear) / (width * height)
+    factors[1:] *= 2
+    factors[0, 1:] *= 2
+
+    dc = linear_to_srgb(factors[0, 0])
+    ac = factors.reshape(-1, 3)[1:]
+    parts = [_encode83(components_x - 1 + (components_y - 1) * 9, 1)]
+    if len(ac):
+        quantised_max = int(max(0, min(82, np.floor(np.abs(ac).max() * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+        parts.append(_encode83(quantised_max, 1))
+    else:
+        max_value = 1
+        parts.append(_encode83(0, 1))
+    parts.append(_encode83(int((dc[0] << 16) + (dc[1] << 8) + dc[2]), 4))
+    if len(ac):
+        scaled = ac / max_value
+        quantised = np.clip(np.floor(np.sign(scaled) * np.sqrt(np.abs(scaled)) * 9 + 9.5), 0, 18).astype(np.int64)
+        for value in quantised @ np.array([19 * 19, 19, 1]):
+            parts.append(_encode83(int(value), 2))
+    return "".join(parts)
+
+
+def dominant_color(pixels, alpha=None):
+    """
+    Преобладающий цвет изображения в виде "#rrggbb".
+
+    Цвета группируются по COLOR_BITS старшим битам каждого канала; результат — средний цвет
+    самой многочисленной группы.
+
+    :param pixels: Массив numpy uint8 формы (высота, ширина, 3).
+    :param alpha: Массив непрозрачности той же высоты и ширины или None; прозрачные пиксели
+                  учитываются с меньшим весом.
+    """
+    import numpy as np
+
+    colors = pixels.reshape(-1, 3)
+    shift = 8 - COLOR_BITS
+    groups = ((colors[:, 0] >> shift).astype(np.int64) << 2 * COLOR_BITS
+              | (colors[:, 1] >> shift).astype(np.int64) << COLOR_BITS
+              | (colors[:, 2] >> shift))
+    weights = None if alpha is None else alpha.reshape(-1).astype(np.float64)
+    counts = np.bincount(groups, weights, minlength=1 << 3 * COLOR_BITS)
+    if weights is not None and not counts.any():
+        weights = None  # Полностью прозрачное изображение
+        counts = np.bincount(groups, minlength=1 << 3 * COLOR_BITS)
+    chosen = groups == counts.argmax()
+    mean = np.average(colors[chosen], axis=0, weights=None if weights is None else weights[chosen])
+    r, g, b = np.rint(mean).astype(int)
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def thumbnail_uri(sample):
+    """
+    Крошечная копия изображения в WEBP в виде data: URL.
+
+    :param sample: Уменьшенная копия (см. compute_placeholder).
+    """
+    img = sample.copy()
+    img.thumbnail((LQIP_SIDE, LQIP_SIDE), Image.BOX)
+    buffer = io.BytesIO()
+    img.save(buffer, "WEBP", quality=LQIP_QUALITY, method=6)
+    return "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def compute_placeholder(img, kind):
+    """
+    Считает заглушку изображения.
+
+    :param img: Вариант изображения (лучше всего самый маленький).
+    :param kind: Вид заглушки (см. PLACEHOLDER_KINDS).
+    :return: Словарь, пригодный для JSON: "kind" — вид, "color" — преобладающий цвет, "opaque" — нет
+             ли прозрачных пикселей, и "blurhash" или "thumbnail" (data: URL) в зависимости от вида.
+    """
+    import numpy as np
+
+    if kind not in PLACEHOLDER_KINDS:
+        raise ValueError(f"Неизвестный вид заглушки: {kind}")
+    sample, transparent = _sample(img)
+    pixels = np.asarray(sample)
+    alpha = pixels[..., 3] if transparent else None
+    colors = pixels[..., :3]
+    placeholder = {"kind": kind, "color": dominant_color(colors, alpha), "opaque": not transparent}
+    if kind == "blurhash":
+        if transparent:
+            # BlurHash не хранит прозрачность: изображение накладывается на белый фон
+            weight = alpha[..., None].astype(np.float64) / 255
+            colors = np.rint(colors * weight + 255 * (1 - weight)).astype(np.uint8)
+        large, small = BLURHASH_COMPONENTS
+        components = (large, small) if sample.width >= sample.height else (small, large)
+        placeholder["blurhash"] = blurhash(colors, *components)
+    else:
+        placeholder["thumbnail"] = thumbnail_uri(sample)
+    return placeholder
+
+
+def file_placeholder(path, kind, max_pixels=None):
+    """
+    Считает заглушку по файлу изображения: по уже сохранённому варианту, если исходник не
+    открывался (все варианты актуальны или взяты у одинакового исходника), или по исходнику
+    для предпросмотра HTML-кода.
+
+    :param path: Путь к файлу.
+    :param kind: Вид заглушки.
+    :param max_pixels: Наибольшее число декодируемых пикселей (после уменьшенного декодирования
+                       JPEG) или None — без ограничения.
+    :return: См. compute_placeholder; None, если изображение больше max_pixels.
+    """
+    with Image.open(path) as img:
+        img.draft("RGB", (SAMPLE_SIDE, SAMPLE_SIDE))
+        if max_pixels and img.width * img.height > max_pixels:
+            return None
+        return compute_placeholder(img, kind)
+
+
+def placeholder_attributes(placeholder):
+    """
+    Атрибуты тега <img> с заглушкой.
+
+    Фон (style) показывает заглушку до загрузки изображения без сценариев, но остаётся под ним и
+    после загрузки, поэтому изображениям с прозрачностью он не задаётся. Строку BlurHash из
+    атрибута data-blurhash раскодирует сценарий на странице.
+
+    :param placeholder: Заглушка (см. compute_placeholder) или None.
+    :return: Список пар (имя атрибута, значение).
+    """
+    attributes = []
+    if not placeholder:
+        return attributes
+    if placeholder.get("opaque"):
+        if placeholder.get("thumbnail"):
+            style = f"background: {placeholder['color']} url({placeholder['thumbnail']}) center / cover no-repeat"
+        else:
+            style = f"background-color: {placeholder['color']}"
+        attributes.append(("style", style))
+    if placeholder.get("blurhash"):
+        attributes.append(("data-blurhash", placeholder["blurhash"]))
+    return attributes
@@ -0,0 +1,323 @@
+"""
+Модель списка предпросмотра.
+
+Список запланированных файлов и их состояние хранятся отдельно от Treeview: поиск строки по пути
+выполняется по словарю, номер строки (и цвет её фона) известен заранее, а изменения статусов
+накапливаются и применяются к виджету пачками. Строки добавляются в Treeview порциями, поэтому
+окно не замирает даже на сотнях тысяч запланированных файлов; обновления для ещё не добавленных
+строк просто запоминаются и попадут в виджет вместе со строкой.
+
+При изменении ширин или форматов новый план сравнивается с предыдущим: строки оставшихся файлов
+сохраняются вместе со статусами, а в Treeview удаляются и добавляются только разница.
+"""
+import os
+import time
+from itertools import islice
+
+from .engine import read_image_size
+from .placeholder import file_placeholder
+from .trace import STAGES
+
+# Сколько строк добавлять в Treeview за один проход главного цикла
+PREVIEW_CHUNK = 2000
+
+# Сколько изменённых строк применять к Treeview за один проход главного цикла
+UPDATE_BATCH = 2000
+
+# Задержка пересчёта плана после ввода в поле ширин, мс
+PREVIEW_DEBOUNCE_MS = 300
+
+# Сколько секунд результаты проверок файловой системы считаются актуальными
+PATH_CHECK_TTL = 10.0
+
+# Наибольшее число пикселей исходника, который декодируется ради заглушки в предпросмотре HTML-кода
+PREVIEW_PLACEHOLDER_PIXELS = 4_000_000
+
+
+def format_stats(timings, size_bytes):
+    """
+    Форматирует время стадий и размер файла для столбцов предпросмотра.
+
+    :param timings: Словарь {стадия: длительность в секундах}.
+    :param size_bytes: Размер файла в байтах или None.
+    :return: Кортеж строк: по одной на стадию из STAGES и размер.
+    """
+    values = tuple(f"{timings[stage] * 1000:.0f}" if stage in timings else "" for stage in STAGES)
+    size = f"{size_bytes / 1024:.1f} КБ" if size_bytes is not None else ""
+    return values + (size,)
+
+
+class PreviewRow:
+    """
+    Строка предпросмотра: запланированный файл и его текущее состояние.
+    """
+
+    __slots__ = ("path", "group", "index", "item_id", "status", "stats")
+
+    def __init__(self, path, group, index):
+        """
+        :param path: Путь к файлу.
+        :param group: Номер исходника, к которому относится файл.
+        :param index: Номер строки в списке.
+        """
+        self.path = path
+        self.group = group
+        self.index = index
+        self.item_id = None  # ID элемента Treeview; None, пока строка не добавлена в виджет
+        self.status = ""
+        self.stats = ("",) * (len(STAGES) + 1)
+
+    @property
+    def tag(self):
+        """
+        Тег чередования цвета фона. Цвет чередуется по исходникам, а не по строкам, чтобы
+        добавление и удаление строк одного исходника не меняло цвет остальных.
+        """
+        return "evenrow" if self.group % 2 == 0 else "oddrow"
+
+    def values(self):
+        """Значения столбцов Treeview: путь, статус, время стадий и размер."""
+        return (self.path, self.status) + self.stats
+
+
+class PreviewModel:
+    """
+    Запланированные файлы в порядке отображения и ожидающие применения изменения.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.by_path = {}
+        self.inserted = 0   # Сколько первых строк уже добавлено в Treeview
+        self.changed = {}   # Путь -> строка, изменённая после добавления в Treeview
+        self.source_groups = {}  # Исходник -> номер для строк, добавленных во время конвертации
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, path):
+        return path in self.by_path
+
+    def get(self, path):
+        """
+        Возвращает строку по пути к файлу или None.
+        """
+        return self.by_path.get(path)
+
+    @property
+    def complete(self):
+        """Все ли строки добавлены в Treeview."""
+        return self.inserted == len(self.rows)
+
+    def set_plan(self, entries):
+        """
+        Заменяет список запланированных файлов. Строки Treeview при этом нужно удалить отдельно.
+
+        :param entries: Пары (путь к файлу, номер исходника) в порядке отображения.
+        """
+        self.rows = []
+        self.by_path = {}
+        self.inserted = 0
+        self.changed = {}
+        self.source_groups = {}
+        for path, group in entries:
+            self.append(path, group)
+
+    def apply_plan(self, entries):
+        """
+        Переходит к новому плану, сохраняя строки файлов, которые в нём остались.
+
+        Вызывающий код удаляет из Treeview возвращённые удалённые строки и добавляет новые строки
+        на позиции row.index в порядке возрастания; после этого все строки считаются добавленными.
+        Модель должна быть полностью добавлена в Treeview (см. complete).
+
+        :param entries: Пары (путь к файлу, номер исходника) в порядке отображения.
+        :return: Пара (удалённые строки, новые строки в порядке отображения).
+        """
+        previous = self.by_path
+        self.rows = []
+        self.by_path = {}
+        added = []
+        for path, group in entries:
+            if path in self.by_path:
+                continue
+            row = previous.get(path)
+            if row is None or row.group != group:
+                row = PreviewRow(path, group, len(self.rows))
+                added.append(row)
+            else:
+                row.index = len(self.rows)
+            self.rows.append(row)
+            self.by_path[path] = row
+        removed = [row for path, row in previous.items() if self.by_path.get(path) is not row]
+        for row in removed:
+            self.changed.pop(row.path, None)
+        self.inserted = len(self.rows)
+        return removed, added
+
+    def append(self, path, group):
+        """
+        Добавляет файл в конец списка, если его там ещё нет.
+
+        :param path: Путь к файлу.
+        :param group: Номер исходника, к которому относится файл.
+        :return: Строка PreviewRow.
+        """
+        row = self.by_path.get(path)
+        if row is None:
+            row = PreviewRow(path, group, len(self.rows))
+            self.rows.append(row)
+            self.by_path[path] = row
+        return row
+
+    def next_group(self):
+        """
+        Номер для следующего исходника, строки которого добавляются в конец списка.
+        """
+        return self.rows[-1].group + 1 if self.rows else 0
+
+    def append_output(self, path, source_path):
+        """
+        Добавляет файл, о котором стало известно только во время конвертации (например, исходник
+        найден при обходе папки). Файлы одного исходника получают общий номер.
+
+        :param path: Путь к файлу.
+        :param source_path: Путь к исходнику.
+        :return: Строка PreviewRow.
+        """
+        group = self.source_groups.get(source_path)
+        if group is None:
+            group = self.source_groups[source_path] = self.next_group()
+        return self.append(path, group)
+
+    def pending_rows(self, limit=PREVIEW_CHUNK):
+        """
+        Возвращает следующую порцию строк, ещё не добавленных в Treeview, и считает их добавленными.
+
+        :param limit: Наибольшее число строк.
+        :return: Список PreviewRow; пустой, если все строки уже добавлены.
+        """
+        chunk = self.rows[self.inserted:self.inserted + limit]
+        self.inserted += len(chunk)
+        return chunk
+
+    def update(self, path, status=None, stats=None):
+        """
+        Изменяет состояние файла. Повторные изменения одной строки до её применения к Treeview
+        объединяются.
+
+        :param path: Путь к файлу.
+        :param status: Новый статус или None, чтобы оставить прежний.
+        :param stats: Значения столбцов времени и размера (см. format_stats) или None.
+        :return: Строка PreviewRow или None, если файла нет в списке.
+        """
+        row = self.by_path.get(path)
+        if row is None:
+            return None
+        if status is not None:
+            row.status = status
+        if stats is not None:
+            row.stats = stats
+        if row.item_id is not None:
+            self.changed[path] = row
+        return row
+
+    def take_changed(self, limit=UPDATE_BATCH):
+        """
+        Забирает порцию изменённых строк для применения к Treeview.
+
+        :param limit: Наибольшее число строк.
+        :return: Список PreviewRow.
+        """
+        if len(self.changed) <= limit:
+            rows = list(self.changed.values())
+            self.changed = {}
+            return rows
+        return [self.changed.pop(path) for path in list(islice(self.changed, limit))]
+
+
+def safe_image_size(path, metadata=None):
+    """
+    Размер изображения из заголовка или None, если файл не удалось открыть.
+
+    :param metadata: metadata.MetadataIndex — размер неизменённого файла берётся из индекса.
+    """
+    try:
+        return metadata.image_size(path) if metadata is not None else read_image_size(path)
+    except Exception:
+        return None
+
+
+def safe_placeholder(path, kind):
+    """
+    Заглушка для предпросмотра HTML-кода, посчитанная по исходнику (вариантов ещё нет), или None,
+    если файл не открывается или слишком велик (см. PREVIEW_PLACEHOLDER_PIXELS).
+
+    :param kind: Вид заглушки (см. placeholder.PLACEHOLDER_KINDS).
+    """
+    try:
+        return file_placeholder(path, kind, PREVIEW_PLACEHOLDER_PIXELS)
+    except Exception:
+        return None
+
+
+class PathChecks:
+    """
+    Кэш проверок существования файлов и папок, размеров изображений и заглушек.
+
+    Предпросмотр пересчитывается при каждом изменении настроек; на сетевых дисках проверка каждого
+    исходника заметно тормозит ввод, поэтому результаты запоминаются на PATH_CHECK_TTL секунд.
+    """
+
+    def __init__(self, ttl=PATH_CHECK_TTL, metadata=None):
+        """
+        :param ttl: Время жизни результата проверки в секундах.
+        :param metadata: metadata.MetadataIndex — размеры изображений запоминаются и между запусками,
+                         а после истечения ttl для неизменённого файла выполняется только os.stat.
+        """
+        self.ttl = ttl
+        self.metadata = metadata
+        self._results = {}  # (проверка, путь, параметры) -> (время проверки, результат)
+
+    def _check(self, check, path, *args):
+        now = time.monotonic()
+        key = (check, path, *args)
+        cached = self._results.get(key)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+        result = check(path, *args)
+        self._results[key] = (now, result)
+        return result
+
+    def isfile(self, path):
+        """
+        Кэширующий аналог os.path.isfile.
+        """
+        return self._check(os.path.isfile, path)
+
+    def isdir(self, path):
+        """
+        Кэширующий аналог os.path.isdir.
+        """
+        return self._check(os.path.isdir, path)
+
+    def image_size(self, path):
+        """
+        Кэширующее чтение размера изображения из заголовка; None, если файл не открывается.
+        """
+        return self._check(self._image_size, path)
+
+    def _image_size(self, path):
+        return safe_image_size(path, self.metadata)
+
+    def placeholder(self, path, kind):
+        """
+        Кэширующий расчёт заглушки по исходнику (см. safe_placeholder).
+        """
+        return self._check(safe_placeholder, path, kind)
+
+    def clear(self):
+        """
+        Забывает все результаты, например после выбора новых файлов в диалоге.
+        """
+        self._results.clear()
@@ -0,0 +1,222 @@
+"""
+Подбор качества кодирования под целевой размер файла или целевое сходство.
+
+Вместо фиксированного качества для каждого варианта ищется самое низкое качество, при котором
+вариант похож на несжатый не меньше заданного (SSIM), и/или самое высокое качество, при котором
+файл укладывается в бюджет байт. Пробные кодирования выполняются в памяти, каждое качество
+кодируется не больше одного раза, а поиск начинается с качества, выбранного для предыдущей ширины
+того же формата: обычно хватает 3–5 пробных кодирований вместо перебора всей шкалы.
+
+Для SSIM нужна библиотека numpy; подбор только по размеру работает без неё.
+"""
+import io
+
+from PIL import Image
+
+# Форматы с параметром quality
+QUALITY_FORMATS = ("JPEG", "WEBP")
+
+# Границы поиска качества по умолчанию
+DEFAULT_MIN_QUALITY = 30
+DEFAULT_MAX_QUALITY = 95
+
+# Начальный шаг расширения диапазона вокруг подсказки
+GALLOP_STEP = 2
+
+# Окно и константы SSIM (Wang et al., 2004) для 8-битной яркости
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Сторона, к которой перед сравнением уменьшается меньшая сторона изображения: так рекомендуют
+# авторы SSIM для изображений, рассматриваемых с обычного расстояния, и так сравнение дешевле
+SSIM_SCALE_SIDE = 256
+
+
+class QualityTarget:
+    """
+    Цель подбора качества.
+
+    Объект передаётся в рабочие процессы, поэтому содержит только простые значения.
+    """
+
+    def __init__(self, max_bytes=None, min_ssim=None, min_quality=DEFAULT_MIN_QUALITY,
+                 max_quality=DEFAULT_MAX_QUALITY):
+        """
+        :param max_bytes: Бюджет размера одного варианта в байтах или None.
+        :param min_ssim: Наименьшее допустимое сходство SSIM с несжатым вариантом (0–1) или None.
+        :param min_quality: Нижняя граница поиска качества.
+        :param max_quality: Верхняя граница поиска качества.
+        """
+        self.max_bytes = max_bytes
+        self.min_ssim = min_ssim
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+
+    def cache_key(self):
+        """
+        Параметры цели для записи манифеста сборки.
+        """
+        return {"max_bytes": self.max_bytes, "min_ssim": self.min_ssim,
+                "min_quality": self.min_quality, "max_quality": self.max_quality}
+
+    def __repr__(self):
+        return f"QualityTarget(max_bytes={self.max_bytes}, min_ssim={self.min_ssim})"
+
+
+def ssim_factor(size):
+    """
+    Во сколько раз уменьшать изображение перед вычислением SSIM.
+
+    :param size: Размер изображения (ширина, высота).
+    """
+    return max(1, round(min(size) / SSIM_SCALE_SIDE))
+
+
+def luminance(img, factor=1):
+    """
+    Яркость изображения как массив numpy float64.
+
+    :param img: Изображение.
+    :param factor: Во сколько раз уменьшить изображение усреднением блоков.
+    """
+    import numpy as np
+
+    gray = img.convert("L")
+    if factor > 1:
+        gray = gray.reduce(factor)
+    return np.asarray(gray, dtype=np.float64)
+
+
+def box_mean(values, window):
+    """
+    Среднее по скользящему квадратному окну через интегральное изображение.
+    """
+    import numpy as np
+
+    integral = np.pad(values, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (integral[window:, window:] - integral[:-window, window:]
+            - integral[window:, :-window] + integral[:-window, :-window]) / (window * window)
+
+
+class SsimReference:
+    """
+    Эталон для сравнения по SSIM: яркость и её локальные статистики считаются один раз,
+    а не при каждом пробном кодировании.
+    """
+
+    def __init__(self, img):
+        """
+        :param img: Несжатое изображение.
+        """
+        self.factor = ssim_factor(img.size)
+        self.values = luminance(img, self.factor)
+        self.window = min(SSIM_WINDOW, *self.values.shape)
+        self.mean = box_mean(self.values, self.window)
+        self.variance = box_mean(self.values * self.values, self.window) - self.mean * self.mean
+
+    def ssim(self, img):
+        """
+        Среднее значение SSIM изображения относительно эталона.
+
+        :param img: Изображение того же размера, что и эталон.
+        :return: Значение от -1 до 1 (1 — изображения совпадают).
+        """
+        values = luminance(img, self.factor)
+        mu_x, mu_y = self.mean, box_mean(values, self.window)
+        sigma_y = box_mean(values * values, self.window) - mu_y * mu_y
+        sigma_xy = box_mean(self.values * values, self.window) - mu_x * mu_y
+        ssim_map = ((2 * mu_x * mu_y + SSIM_C1) * (2 * sigma_xy + SSIM_C2)
+                    / ((mu_x * mu_x + mu_y * mu_y + SSIM_C1) * (self.variance + sigma_y + SSIM_C2)))
+        return float(ssim_map.mean())
+
+
+def lowest_passing(low, high, passes, guess=None):
+    """
+    Находит наименьшее значение из [low, high], для которого монотонное условие выполняется.
+
+    Если задана подсказка, сначала проверяется она, затем диапазон расширяется от неё шагами
+    GALLOP_STEP, 2·GALLOP_STEP, ... до смены результата, и только после этого делится пополам.
+
+    :param low: Нижняя граница.
+    :param high: Верхняя граница.
+    :param passes: Функция качества -> bool, ложная ниже порога и истинная начиная с него.
+    :param guess: Ожидаемый ответ (например, качество предыдущей ширины) или None.
+    :return: Найденное значение или None, если условие не выполняется и при high.
+    """
+    if guess is not None and low <= guess <= high:
+        step = GALLOP_STEP
+        if passes(guess):
+            high = guess
+            while high - step >= low:
+                if not passes(high - step):
+                    low = high - step + 1
+                    break
+                high -= step
+                step *= 2
+        else:
+            low = guess + 1
+            while low + step - 1 <= high:
+                probe = low + step - 1
+                if passes(probe):
+                    high = probe
+                    break
+                low = probe + 1
+                step *= 2
+    if low > high:
+        return None
+    while low < high:
+        middle = (low + high) // 2
+        if passes(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return low if passes(low) else None
+
+
+def search_quality(img, fmt, save_params, target, guess=None):
+    """
+    Подбирает качество кодирования варианта.
+
+    Сначала ищется самое низкое качество, дающее сходство не ниже target.min_ssim (без этой цели —
+    верхняя граница), затем, если файл не укладывается в бюджет, — самое высокое качество, при
+    котором укладывается. Если бюджет недостижим, используется нижняя граница.
+
+    :param img: Изображение нужного размера.
+    :param fmt: Формат (из QUALITY_FORMATS).
+    :param save_params: Параметры сохранения формата; quality в них заменяется подобранным.
+    :param target: QualityTarget.
+    :param guess: Качество, выбранное для предыдущего варианта того же формата, или None.
+    :return: Кортеж (закодированные байты, качество, число пробных кодирований).
+    """
+    encoded = {}
+
+    def encode(quality):
+        if quality not in encoded:
+            buffer = io.BytesIO()
+            params = dict(save_params)
+            params["quality"] = quality
+            img.save(buffer, fmt, **params)
+            encoded[quality] = buffer.getvalue()
+        return encoded[quality]
+
+    low, high = target.min_quality, target.max_quality
+    quality = high
+    if target.min_ssim is not None:
+        reference = SsimReference(img)
+
+        def similar(q):
+            with Image.open(io.BytesIO(encode(q))) as decoded:
+                return reference.ssim(decoded) >= target.min_ssim
+
+        quality = lowest_passing(low, high, similar, guess)
+        if quality is None:
+            quality = high  # Сходство недостижимо: наилучшее качество из допустимых
+
+    if target.max_bytes is not None and len(encode(quality)) > target.max_bytes:
+        # Наименьшее качество, не укладывающееся в бюджет; ответ — на единицу ниже
+        too_large = lowest_passing(low, quality, lambda q: len(encode(q)) > target.max_bytes,
+                                   guess + 1 if guess is not None and guess < quality else None)
+        quality = max(low, too_large - 1) if too_large is not None else quality
+
+    return encode(quality), quality, len(encoded)
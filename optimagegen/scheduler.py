@@ -0,0 +1,189 @@
+"""
+Планировщик задач с ограничением по памяти.
+
+Перед отправкой исходника в рабочий процесс его потребность в памяти оценивается по заголовку
+файла (ширина × высота × число каналов), без декодирования пикселей. Задачи запускаются, пока
+сумма оценок запущенных задач укладывается в бюджет; остальные ждут в очереди. Так 100-мегапиксельные
+панорамы в пакете с миниатюрами не приводят к нехватке памяти на машине конвертации.
+"""
+import os
+from collections import deque
+
+from PIL import Image
+
+from .metadata import read_source_info
+from .resize import DRAFT_GAP, target_height
+from .stream import STRIP_HEIGHT
+
+# Байт на канал для режимов, у которых канал занимает больше одного байта
+BYTES_PER_BAND = {"I": 4, "F": 4, "I;16": 2, "I;16B": 2, "I;16L": 2, "I;16N": 2}
+
+# Доля физической памяти, используемая как бюджет по умолчанию
+DEFAULT_BUDGET_FRACTION = 0.5
+
+# Сколько раз задачу в начале очереди могут обогнать меньшие задачи, прежде чем планировщик
+# перестанет пропускать их вперёд и дождётся освобождения памяти для неё
+MAX_BYPASS = 8
+
+
+def physical_memory():
+    """
+    Возвращает объём физической памяти в байтах или None, если его не удалось определить.
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def resolve_memory_budget(budget):
+    """
+    Определяет бюджет памяти в байтах.
+
+    :param budget: Бюджет в байтах; None — половина физической памяти, 0 — без ограничения.
+    :return: Бюджет в байтах или None, если ограничения нет.
+    """
+    if budget is None:
+        total = physical_memory()
+        return int(total * DEFAULT_BUDGET_FRACTION) if total else None
+    return int(budget) or None
+
+
+def pixel_bytes(size, mode):
+    """
+    Размер декодированного изображения в байтах.
+
+    :param size: Размер (ширина, высота).
+    :param mode: Режим Pillow.
+    """
+    return size[0] * size[1] * Image.getmodebands(mode) * BYTES_PER_BAND.get(mode, 1)
+
+
+def draft_size(size, fmt, widths):
+    """
+    Оценивает размер, в котором будет декодирован исходник с учётом resize.apply_draft.
+
+    :param size: Размер исходника в файле.
+    :param fmt: Формат исходника.
+    :param widths: Список ширин.
+    """
+    if fmt != "JPEG":
+        return size
+    largest = max(widths)
+    requested = (largest * DRAFT_GAP, target_height(size, largest) * DRAFT_GAP)
+    scale = 1
+    while scale < 8 and size[0] / (scale * 2) >= requested[0] and size[1] / (scale * 2) >= requested[1]:
+        scale *= 2
+    return (-(-size[0] // scale), -(-size[1] // scale))
+
+
+def estimate_source_memory(source_path, widths, draft=True, encode_threads=1, metadata=None):
+    """
+    Оценивает пиковую потребность задачи конвертации исходника в памяти, читая только заголовок.
+
+    Учитываются декодированный исходник, копия после Image.reduce и два варианта наибольшей ширины
+    в конвейере масштабирования, каждый с копиями для потоков кодирования. Исходник, читаемый
+    полосами (см. stream), занимает в памяти полосу, а не всё изображение.
+
+    :param source_path: Путь к исходнику.
+    :param widths: Список ширин.
+    :param draft: Учитывать ли уменьшенное декодирование JPEG.
+    :param encode_threads: Число потоков кодирования.
+    :param metadata: metadata.MetadataIndex — заголовок неизменённого исходника не читается повторно.
+    :return: Оценка в байтах.
+    """
+    info = metadata.info(source_path) if metadata is not None else read_source_info(source_path)
+    size, mode, fmt, streamed = info.size, info.mode, info.format, info.streamed
+    largest = max(widths)
+    rendition = pixel_bytes((largest, target_height(size, largest)), mode)
+    if streamed:
+        # Полоса исходника и результаты всех ширин, которые строятся за один проход
+        strip = pixel_bytes((size[0], STRIP_HEIGHT), mode)
+        return 2 * strip + len(widths) * rendition + 2 * rendition * max(1, encode_threads)
+    decoded_size = draft_size(size, fmt, widths) if draft else size
+    decoded = pixel_bytes(decoded_size, mode)
+    return decoded + decoded // 4 + 2 * rendition * max(1, encode_threads)
+
+
+class MemoryScheduler:
+    """
+    Очередь задач, допускающая к выполнению только задачи, укладывающиеся в бюджет памяти.
+
+    Задачи допускаются в порядке очереди; меньшая задача может обогнать не помещающуюся большую,
+    но не больше MAX_BYPASS раз подряд, чтобы большие задачи не ждали бесконечно. Если ничего не
+    выполняется, первая задача допускается в любом случае, даже если её оценка превышает бюджет.
+    """
+
+    def __init__(self, budget, max_in_flight):
+        """
+        :param budget: Бюджет в байтах или None, если ограничения нет.
+        :param max_in_flight: Наибольшее число одновременно выполняемых задач.
+        """
+        self.budget = budget
+        self.max_in_flight = max_in_flight
+        self.waiting = deque()  # Пары (задача, оценка)
+        self.in_use = 0
+        self.in_flight = 0
+        self.peak = 0        # Наибольшая сумма оценок одновременно выполнявшихся задач
+        self.deferred = 0    # Сколько задач ждало своей очереди из-за бюджета (каждая считается один раз)
+        self._bypassed = 0
+        self._head_deferred = False  # Первая задача очереди уже учтена в deferred
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def add(self, task, cost):
+        """
+        Ставит задачу в очередь.
+
+        :param task: Произвольный объект задачи.
+        :param cost: Оценка памяти в байтах.
+        """
+        self.waiting.append((task, cost))
+
+    def fits(self, cost):
+        """
+        Проверяет, укладывается ли задача в оставшийся бюджет.
+        """
+        return self.budget is None or self.in_flight == 0 or self.in_use + cost <= self.budget
+
+    def admit(self):
+        """
+        Допускает к выполнению задачи, помещающиеся в бюджет.
+
+        :return: Список пар (задача, оценка), которые нужно запустить.
+        """
+        admitted = []
+        index = 0
+        while index < len(self.waiting) and self.in_flight < self.max_in_flight:
+            task, cost = self.waiting[index]
+            if self.fits(cost):
+                del self.waiting[index]
+                if index:
+                    self._bypassed += 1
+                else:
+                    self._bypassed = 0
+                    self._head_deferred = False
+                self.in_use += cost
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_use)
+                admitted.append((task, cost))
+                continue
+            if index == 0:
+                # admit вызывается при каждом освобождении памяти: задача учитывается при первом отказе
+                if not self._head_deferred:
+                    self.deferred += 1
+                    self._head_deferred = True
+                if self._bypassed >= MAX_BYPASS:
+                    break
+            index += 1
+        return admitted
+
+    def release(self, cost):
+        """
+        Возвращает в бюджет память завершившейся задачи.
+
+        :param cost: Оценка памяти задачи.
+        """
+        self.in_use -= cost
+        self.in_flight -= 1
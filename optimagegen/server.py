@@ -0,0 +1,520 @@
+"""
+Сервер вариантов по запросу.
+
+Отдаёт по HTTP файлы вида `/{имя}-{ширина}w.{ext}`, строя их при первом запросе тем же конвейером,
+что и пакетная конвертация (engine.convert_source). Варианты ищутся по очереди:
+
+1. в памяти — LRU-кэш с ограничением по байтам;
+2. на диске — в папке результатов по манифесту сборки, поэтому файлы, собранные пакетным режимом
+   с теми же параметрами, отдаются без перекодирования, а построенные сервером видны пакетному режиму;
+3. строятся в пуле процессов.
+
+Одновременные запросы одного варианта ждут одну сборку. Число процессов сборки ограничено, а если
+в очереди больше max_queue разных вариантов, новые холодные запросы получают 503, так что всплеск
+запросов не занимает машину целиком. По адресу /stats отдаются задержки (p50, p90, p99) отдельно
+для ответов из памяти, с диска и со сборкой.
+
+Реализован минимальный HTTP/1.1 (GET и HEAD, keep-alive) на asyncio из стандартной библиотеки;
+сервер рассчитан на локальную работу и нагрузочные замеры, а не на работу в интернете без
+обратного прокси.
+"""
+import asyncio
+import copy
+import json
+import math
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from .cache import BuildManifest, output_key, source_state
+from .engine import (
+    SUPPORTED_FORMATS,
+    ConversionOptions,
+    convert_source,
+    init_worker,
+    output_filename,
+    read_image_size,
+    record_manifest,
+    resolve_encode_threads,
+    resolve_save_params,
+    resolve_workers,
+    source_base_name,
+)
+from .resize import resolve_widths
+from .sources import iter_sources, split_source
+
+# Размер кэша вариантов в памяти по умолчанию, в байтах
+DEFAULT_MEMORY_CACHE = 64 * 1024 * 1024
+
+# Сколько разных вариантов может одновременно ждать сборки; следующие холодные запросы получают 503
+DEFAULT_MAX_QUEUE = 64
+
+# Как часто при запросе неизвестного имени папки исходников обходятся заново, в секундах
+RESCAN_INTERVAL = 2.0
+
+# Наибольший размер строки запроса с заголовками
+MAX_HEADER_BYTES = 16 * 1024
+
+# Сколько последних задержек каждого пути хранится для процентилей
+LATENCY_SAMPLES = 10000
+
+# Пути ответа, для которых считаются задержки: из памяти, с диска, со сборкой, в ожидании чужой сборки
+LATENCY_KINDS = ("memory", "disk", "render", "coalesced")
+
+# Расширения в имени запрошенного файла
+EXTENSION_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+# MIME-типы форматов
+CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# Тексты статусов HTTP
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+# Имя варианта: "{имя}-{ширина}w.{ext}"
+RENDITION_NAME = re.compile(r"^(?P<base>.+)-(?P<width>\d+)w\.(?P<ext>[A-Za-z]+)$")
+
+
+def parse_rendition_name(name):
+    """
+    Разбирает имя варианта.
+
+    :param name: Имя файла вида "photo-800w.webp".
+    :return: Кортеж (имя исходника без расширения, ширина, формат) или None, если имя не подходит.
+    """
+    match = RENDITION_NAME.match(name)
+    if not match:
+        return None
+    fmt = EXTENSION_FORMATS.get(match.group("ext").lower())
+    width = int(match.group("width"))
+    if fmt is None or width <= 0:
+        return None
+    return match.group("base"), width, fmt
+
+
+def read_file(path):
+    """
+    Читает файл целиком.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def percentile(values, fraction):
+    """
+    Процентиль по методу ближайшего ранга.
+
+    :param values: Отсортированный список значений.
+    :param fraction: Доля от 0 до 1 (0.99 — p99).
+    :return: Значение или None для пустого списка.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+def latency_summary(samples):
+    """
+    Сводка задержек в миллисекундах.
+
+    :param samples: Задержки в секундах.
+    :return: Словарь {"count", "p50_ms", "p90_ms", "p99_ms", "max_ms"}.
+    """
+    values = sorted(samples)
+    summary = {"count": len(values)}
+    for name, fraction in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99), ("max_ms", 1.0)):
+        value = percentile(values, fraction)
+        summary[name] = round(value * 1000, 2) if value is not None else None
+    return summary
+
+
+class RenditionCache:
+    """
+    LRU-кэш вариантов в памяти с ограничением суммарного размера.
+
+    Вместе с данными хранится отпечаток исходника (размер и время изменения), с которого они
+    получены: при изменении исходника запись перестаёт совпадать и вариант собирается заново.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_CACHE):
+        """
+        :param max_bytes: Наибольший суммарный размер вариантов в байтах; 0 — кэш отключён.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()  # Ключ -> (данные, отпечаток исходника)
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, stamp):
+        """
+        Возвращает данные варианта, если они получены с исходника с тем же отпечатком, иначе None.
+        """
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[1] != stamp:
+            self.discard(key)
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, data, stamp):
+        """
+        Запоминает вариант, вытесняя давно не запрошенные. Вариант больше всего кэша не запоминается.
+        """
+        self.discard(key)
+        if len(data) > self.max_bytes:
+            return
+        self._items[key] = (data, stamp)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self._items.popitem(last=False)
+            self.size -= len(evicted)
+
+    def discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size -= len(item[0])
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+
+class LatencyStats:
+    """
+    Задержки ответов по путям (см. LATENCY_KINDS); хранятся последние LATENCY_SAMPLES каждого пути.
+    """
+
+    def __init__(self):
+        self.requests = 0  # Всего обработанных запросов, включая ошибки
+        self._samples = {kind: deque(maxlen=LATENCY_SAMPLES) for kind in LATENCY_KINDS}
+
+    def record(self, kind, seconds):
+        if kind in self._samples:
+            self._samples[kind].append(seconds)
+
+    def summary(self):
+        """
+        Словарь {путь: сводка задержек} (см. latency_summary).
+        """
+        return {kind: latency_summary(samples) for kind, samples in self._samples.items()}
+
+
+class RenditionServer:
+    """
+    HTTP-сервер вариантов по запросу.
+    """
+
+    def __init__(self, source_folders, output_folder, widths=None, formats=SUPPORTED_FORMATS, save_params=None,
+                 options=None, workers=0, memory_cache=DEFAULT_MEMORY_CACHE, max_queue=DEFAULT_MAX_QUEUE,
+                 recursive=True):
+        """
+        :param source_folders: Папки (или шаблоны) с исходниками; исходник ищется по имени без расширения.
+        :param output_folder: Папка результатов — дисковый кэш вариантов с манифестом сборки.
+        :param widths: Разрешённые ширины; None — любые.
+        :param formats: Разрешённые форматы.
+        :param save_params: Дополнительные параметры сохранения {формат: {параметр: значение}}.
+        :param options: ConversionOptions; по умолчанию — параметры по умолчанию.
+        :param workers: Число процессов сборки; 0 — по числу ядер.
+        :param memory_cache: Размер кэша вариантов в памяти в байтах.
+        :param max_queue: Сколько разных вариантов может одновременно ждать сборки.
+        :param recursive: Обходить ли вложенные папки исходников.
+        """
+        self.source_folders = list(source_folders)
+        self.output_folder = output_folder
+        self.widths = sorted(set(widths)) if widths else None
+        self.formats = list(formats)
+        self.params = resolve_save_params(self.formats, save_params)
+        self.workers = resolve_workers(workers)
+        self.options = copy.copy(options or ConversionOptions())
+        # Вариант собирается один, поэтому форматы не распараллеливаются, а удалять и искать
+        # одинаковые исходники не с чем
+        self.options.encode_threads = resolve_encode_threads(self.options.encode_threads, self.workers, 1)
+        self.options.prune = False
+        self.options.dedup = False
+        self.max_queue = max_queue
+        self.recursive = recursive
+        self.manifest = BuildManifest.load(output_folder)
+        self.cache = RenditionCache(memory_cache)
+        self.stats = LatencyStats()
+        self._sources = {}       # Имя исходника без расширения -> путь
+        self._scanned_at = None  # Время последнего обхода папок исходников
+        self._renders = {}       # Путь варианта -> задача его получения
+        self._connections = {}   # Задача обслуживания соединения -> его writer
+        self._pool = None
+        self._server = None
+
+    @property
+    def port(self):
+        """Порт, на котором принимаются соединения (полезно при запуске на порту 0)."""
+        return self._server.sockets[0].getsockname()[1] if self._server else None
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """
+        Открывает порт и пул процессов сборки.
+        """
+        loop = asyncio.get_running_loop()
+        # Ctrl+C обрабатывает главный процесс: он дожидается начатых сборок и сохраняет манифест
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(None,))
+        await loop.run_in_executor(None, self.scan)
+        self._server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+
+    async def serve(self, host="127.0.0.1", port=8080, on_ready=None):
+        """
+        Запускает сервер и обслуживает запросы до отмены задачи (например, по Ctrl+C в asyncio.run).
+
+        :param on_ready: Функция, вызываемая с сервером, когда порт открыт.
+        """
+        await self.start(host, port)
+        try:
+            if on_ready:
+                on_ready(self)
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        Закрывает порт и пул процессов и сохраняет манифест сборки.
+        """
+        if self._server:
+            self._server.close()
+            # Соединения закрываются; ответы, уже отданные в буфер, дописываются
+            for writer in self._connections.values():
+                writer.transport.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        self.manifest.save()
+
+    def scan(self):
+        """
+        Обходит папки исходников и запоминает исходник для каждого имени без расширения
+        (при совпадении имён — первый найденный). Результаты прошлых сборок исходниками не считаются.
+        """
+        sources = {}
+        for source in iter_sources(self.source_folders, self.recursive, exclude=[self.output_folder]):
+            path, _ = split_source(source)
+            if not self.manifest.is_output(path):
+                sources.setdefault(source_base_name(path), path)
+        self._sources = sources
+        self._scanned_at = time.monotonic()
+
+    async def find_source(self, base_name):
+        """
+        Путь к исходнику по имени без расширения или None. Неизвестное имя приводит к повторному
+        обходу папок не чаще раза в RESCAN_INTERVAL секунд.
+        """
+        path = self._sources.get(base_name)
+        if path is None and time.monotonic() - self._scanned_at >= RESCAN_INTERVAL:
+            await asyncio.get_running_loop().run_in_executor(None, self.scan)
+            path = self._sources.get(base_name)
+        return path
+
+    async def handle_connection(self, reader, writer):
+        """
+        Обслуживает одно соединение: запросы читаются по очереди, пока клиент не закроет соединение
+        или не попросит закрыть его.
+        """
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send(writer, 400, b"", "text/plain", False)
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ")
+                except ValueError:
+                    await self.send(writer, 400, b"", "text/plain", False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+                connection = headers.get("connection", "")
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+                started = time.perf_counter()
+                try:
+                    status, body, content_type, kind = await self.respond(method, target)
+                except Exception as e:
+                    status, body, content_type, kind = 500, str(e).encode(), "text/plain; charset=utf-8", None
+                await self.send(writer, status, body, content_type, keep_alive, kind, method == "HEAD")
+                self.stats.requests += 1
+                if status == 200 and kind:
+                    self.stats.record(kind, time.perf_counter() - started)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+    @staticmethod
+    async def send(writer, status, body, content_type, keep_alive, kind=None, head_only=False):
+        """
+        Отправляет ответ.
+        """
+        lines = [
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if kind:
+            lines.append(f"X-Cache: {kind}")
+        if status == 200 and content_type.startswith("image/"):
+            lines.append("Cache-Control: public, max-age=86400")
+        if status == 503:
+            lines.append("Retry-After: 1")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if not head_only:
+            writer.write(body)
+        await writer.drain()
+
+    async def respond(self, method, target):
+        """
+        Обрабатывает запрос.
+
+        :return: Кортеж (статус, тело, Content-Type, путь ответа из LATENCY_KINDS или None).
+        """
+        if method not in ("GET", "HEAD"):
+            return 405, b"", "text/plain", None
+        path = unquote(urlsplit(target).path)
+        if path == "/stats":
+            return 200, json.dumps(self.snapshot(), ensure_ascii=False).encode(), "application/json", None
+        name = path[1:]
+        parsed = parse_rendition_name(name) if "/" not in name else None
+        if parsed is None:
+            return 404, b"", "text/plain", None
+        base_name, width, fmt = parsed
+        # Точная проверка ширины — после чтения размера исходника (см. check_disk)
+        if fmt not in self.formats or (self.widths and width > self.widths[-1]):
+            return 404, b"", "text/plain", None
+        source_path = await self.find_source(base_name)
+        if source_path is None:
+            return 404, b"", "text/plain", None
+        return await self.rendition(source_path, base_name, width, fmt)
+
+    async def rendition(self, source_path, base_name, width, fmt):
+        """
+        Возвращает вариант из памяти, с диска или собирает его; одновременные запросы одного
+        варианта ждут одну сборку.
+        """
+        out_path = os.path.join(self.output_folder, output_filename(base_name, width, fmt))
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            self._sources.pop(base_name, None)
+            return 404, b"", "text/plain", None
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        data = self.cache.get(out_path, stamp)
+        if data is not None:
+            return 200, data, CONTENT_TYPES[fmt], "memory"
+
+        task = self._renders.get(out_path)
+        if task is not None:
+            status, data, kind = await asyncio.shield(task)
+            return status, data, CONTENT_TYPES[fmt] if status == 200 else "text/plain", "coalesced"
+        if len(self._renders) >= self.max_queue:
+            return 503, b"", "text/plain", None
+
+        task = asyncio.ensure_future(self.produce(source_path, width, fmt, out_path, stamp))
+        self._renders[out_path] = task
+        task.add_done_callback(lambda _: self._renders.pop(out_path, None))
+        # Отключение клиента не отменяет сборку, которую могут ждать другие запросы
+        status, data, kind = await asyncio.shield(task)
+        return status, data, CONTENT_TYPES[fmt] if status == 200 else "text/plain; charset=utf-8", kind
+
+    def check_disk(self, source_path, width, fmt, out_path):
+        """
+        Проверяет вариант на диске по манифесту сборки. Выполняется в потоке: может прочитать
+        и хешировать исходник.
+
+        :return: Кортеж (статус или None, если вариант нужно собрать; данные; SourceCache для сборки).
+        """
+        cache = self.manifest.lookup(source_path, [out_path])
+        cache.state = source_state(source_path, cache.state)
+        if self.options.upscale != "allow":
+            image_size = cache.state.get("image_size")
+            if not image_size:
+                image_size = read_image_size(source_path)
+                cache.state["image_size"] = list(image_size)
+            if width not in resolve_widths(self.widths or [width], image_size[0], self.options.upscale):
+                return 404, b"", None
+        if self.widths and width not in self.widths and self.options.upscale == "allow":
+            return 404, b"", None
+        key = output_key(cache.state["sha256"], width, fmt, self.params[fmt], self.options.cache_key(fmt))
+        entry = cache.outputs.get(out_path)
+        if self.options.incremental and cache.is_fresh(out_path, key) and not entry.get("pruned"):
+            try:
+                return 200, read_file(out_path), cache
+            except OSError:
+                pass  # Файл удалён после проверки: собирается заново
+        return None, None, cache
+
+    async def produce(self, source_path, width, fmt, out_path, stamp):
+        """
+        Получает вариант с диска или собирает его в пуле процессов и запоминает в памяти.
+
+        :return: Кортеж (статус, данные, путь ответа).
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            status, data, cache = await loop.run_in_executor(None, self.check_disk, source_path, width, fmt, out_path)
+        except OSError:
+            return 404, b"", None
+        kind = "disk"
+        if status is None:
+            kind = "render"
+            results = await loop.run_in_executor(self._pool, convert_source, source_path, [width], [fmt],
+                                                 self.output_folder, self.params, self.options, None, cache)
+            record_manifest(self.manifest, source_path, results)
+            try:
+                self.manifest.flush_journal()
+            except OSError:
+                pass  # Манифест сохранится при остановке сервера
+            result = next((r for r in results if r.width == width and r.fmt == fmt), None)
+            if result is None:
+                return 404, b"", None
+            if not result.ok:
+                return 500, result.error.encode(), None
+            data = await loop.run_in_executor(None, read_file, out_path)
+            status = 200
+        if status == 200:
+            self.cache.put(out_path, data, stamp)
+        return status, data, kind
+
+    def snapshot(self):
+        """
+        Состояние сервера для /stats: задержки по путям ответа, кэш в памяти и очередь сборки.
+        """
+        return {
+            "requests": self.stats.requests,
+            "latency": self.stats.summary(),
+            "memory_cache": {"items": len(self.cache), "bytes": self.cache.size, "max_bytes": self.cache.max_bytes},
+            "renders_in_flight": len(self._renders),
+            "workers": self.workers,
+        }
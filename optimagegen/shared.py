@@ -0,0 +1,174 @@
+"""
+Передача пикселей вариантов процессам-кодировщикам через разделяемую память.
+
+При кодировании в отдельных процессах (см. ConversionOptions.shared_memory) передача изображения
+через pickle копирует пиксели несколько раз: в байтовую строку, в буфер pickle, через канал между
+процессами и обратно в изображение. Вместо этого процесс, масштабирующий исходник, один раз
+копирует пиксели варианта в сегмент разделяемой памяти (SharedFrame), а кодировщики подключаются
+к нему через Image.frombuffer без копирования и получают только небольшое описание (FrameRef).
+
+Сегментом владеет создавший его процесс: он удаляет сегмент (SharedFrame.close), когда все
+форматы варианта закодированы. Кодировщик закрывает своё подключение сразу после кодирования
+(см. attached_image). Процессы-кодировщики создаются после start_tracker.
+"""
+import os
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+from PIL import Image
+
+# Режимы, которые Image.frombuffer отображает на буфер без копирования (Image._MAPMODES)
+MAPPED_MODES = ("L", "RGBX", "RGBA", "CMYK", "I;16", "I;16L", "I;16B")
+
+# Байтов на пиксель в буфере каждого режима: Pillow выравнивает пиксели многоканальных режимов до 4 байт
+BUFFER_PIXEL_BYTES = {"L": 1, "I;16": 2, "I;16L": 2, "I;16B": 2}
+
+
+def buffer_mode(mode):
+    """
+    Режим, в котором изображение хранится в разделяемой памяти, или None, если режим так не передаётся.
+
+    RGB хранится как RGBX: Pillow и так держит RGB по 4 байта на пиксель, но отображает без копирования
+    только RGBX. Палитровые изображения не передаются: палитру пришлось бы менять у отображённого
+    изображения, а это создаёт его копию.
+
+    :param mode: Режим изображения.
+    """
+    if mode == "RGB":
+        return "RGBX"
+    return mode if mode in MAPPED_MODES else None
+
+
+def frame_bytes(mode, size):
+    """
+    Размер буфера изображения в разделяемой памяти в байтах.
+
+    :param mode: Режим буфера (см. buffer_mode).
+    :param size: Размер изображения (ширина, высота).
+    """
+    width, height = size
+    return width * height * BUFFER_PIXEL_BYTES.get(mode, 4)
+
+
+def start_tracker():
+    """
+    Запускает учёт сегментов разделяемой памяти (resource_tracker) до создания процессов-кодировщиков.
+
+    Процесс, созданный раньше учёта, запускает собственный и при завершении удаляет все сегменты,
+    к которым подключался, — в том числе ещё нужные владельцу. Общий учёт наследуется процессами,
+    созданными после его запуска.
+    """
+    if os.name == "posix":
+        resource_tracker.ensure_running()
+
+
+def _attach(name):
+    # Сегментом владеет создавший его процесс; подключение не должно удалять его при завершении кодировщика
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python до 3.13: подключение учитывается общим учётом (см. start_tracker)
+        return shared_memory.SharedMemory(name=name)
+
+
+def _map(buffer, mode, size):
+    return Image.frombuffer(mode, size, buffer, "raw", mode, 0, 1)
+
+
+class FrameRef:
+    """
+    Описание изображения в разделяемой памяти, передаваемое кодировщику вместо пикселей.
+    """
+
+    def __init__(self, name, mode, size, info):
+        """
+        :param name: Имя сегмента разделяемой памяти.
+        :param mode: Режим исходного изображения.
+        :param size: Размер изображения (ширина, высота).
+        :param info: Сведения изображения (прозрачность, ICC-профиль), учитываемые при сохранении.
+        """
+        self.name = name
+        self.mode = mode
+        self.size = size
+        self.info = info
+
+
+class SharedFrame:
+    """
+    Изображение в сегменте разделяемой памяти; владелец сегмента.
+    """
+
+    def __init__(self, img):
+        """
+        Создаёт сегмент и копирует в него пиксели изображения (единственное копирование).
+
+        :param img: Изображение режима, для которого buffer_mode не возвращает None.
+        """
+        mode = buffer_mode(img.mode)
+        if mode is None:
+            raise ValueError(f"Режим {img.mode} не передаётся через разделяемую память")
+        self.nbytes = frame_bytes(mode, img.size)
+        self._memory = shared_memory.SharedMemory(create=True, size=max(1, self.nbytes))
+        try:
+            view = _map(self._memory.buf, mode, img.size)
+            # Отображение создаётся только для чтения; копирование в него — единственная запись
+            view.readonly = 0
+            # RGB и RGBX устроены в памяти одинаково, поэтому пиксели копируются без преобразования
+            view.im.paste(img.im, (0, 0) + img.size)
+            del view
+        except BaseException:
+            self._memory.close()
+            self._memory.unlink()
+            raise
+        self.ref = FrameRef(self._memory.name, img.mode, img.size, dict(img.info))
+
+    @staticmethod
+    def supported(img):
+        """
+        Можно ли передать изображение через разделяемую память.
+        """
+        return buffer_mode(img.mode) is not None
+
+    def close(self):
+        """
+        Закрывает и удаляет сегмент. Кодировщики, ещё подключённые к нему, дочитывают свои
+        отображения: память освобождается после закрытия последнего из них.
+        """
+        if self._memory is None:
+            return
+        self._memory.close()
+        try:
+            self._memory.unlink()
+        except FileNotFoundError:
+            pass
+        self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@contextmanager
+def attached_image(ref):
+    """
+    Подключается к изображению в разделяемой памяти без копирования пикселей.
+
+    Изображение доступно только внутри блока with: после выхода подключение закрывается, и
+    изображение нельзя использовать.
+
+    :param ref: FrameRef.
+    :return: Контекстный менеджер, возвращающий изображение.
+    """
+    memory = _attach(ref.name)
+    try:
+        img = _map(memory.buf, buffer_mode(ref.mode), ref.size)
+        img.info.update(ref.info)
+        try:
+            yield img
+        finally:
+            # Отображение держит буфер сегмента: без удаления изображения сегмент не закрыть
+            img.close()
+            del img
+    finally:
+        memory.close()
@@ -0,0 +1,163 @@
+"""
+Обход исходников: отдельные файлы, папки и шаблоны имён.
+
+Папки и шаблоны обходятся лениво, генератором: конвертация первых файлов начинается, пока
+остальное дерево ещё не просмотрено, а в памяти хранится только стек непросмотренных папок.
+Найденные в папке файлы помнят свою корневую папку, поэтому при желании структуру подпапок
+можно повторить в папке результатов.
+"""
+import glob
+import os
+
+# Расширения файлов, которые считаются изображениями при обходе папок
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+
+
+class SourceFile:
+    """
+    Исходник, найденный при обходе папки или шаблона.
+    """
+
+    __slots__ = ("path", "root")
+
+    def __init__(self, path, root=None):
+        """
+        :param path: Путь к файлу.
+        :param root: Корневая папка обхода; None для явно указанного файла.
+        """
+        self.path = path
+        self.root = root
+
+    @property
+    def subdir(self):
+        """Папка файла относительно корня обхода ("" — файл лежит в самом корне)."""
+        if not self.root:
+            return ""
+        subdir = os.path.relpath(os.path.dirname(self.path), self.root)
+        return "" if subdir == os.curdir else subdir
+
+    def __repr__(self):
+        return f"SourceFile({self.path!r}, root={self.root!r})"
+
+
+def split_source(source):
+    """
+    Возвращает путь к исходнику и его папку относительно корня обхода.
+
+    :param source: Путь к файлу или SourceFile.
+    :return: Пара (путь, подпапка); для явно указанных файлов подпапка пустая.
+    """
+    if isinstance(source, SourceFile):
+        return source.path, source.subdir
+    return source, ""
+
+
+def source_root(source):
+    """
+    Папка, которая служит папкой результатов по умолчанию: корень обхода или папка файла.
+    """
+    if isinstance(source, SourceFile) and source.root:
+        return source.root
+    return os.path.dirname(split_source(source)[0])
+
+
+def is_image_file(name):
+    """
+    Проверяет расширение файла по IMAGE_EXTENSIONS.
+    """
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def walk_images(root, exclude=()):
+    """
+    Лениво обходит папку и вложенные папки в порядке имён.
+
+    Скрытые файлы и папки (имя начинается с точки) пропускаются: среди них манифест сборки
+    и временные файлы.
+
+    :param root: Корневая папка.
+    :param exclude: Папки, которые не нужно обходить (например, папка результатов внутри корня).
+    :return: Генератор путей к изображениям.
+    """
+    excluded = {os.path.realpath(path) for path in exclude}
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue  # Папка недоступна или удалена во время обхода
+        subfolders = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir():
+                    if os.path.realpath(entry.path) not in excluded:
+                        subfolders.append(entry.path)
+                elif entry.is_file() and is_image_file(entry.name):
+                    yield entry.path
+            except OSError:
+                continue
+        # Стек обходится с конца, поэтому подпапки кладутся в обратном порядке
+        stack.extend(reversed(subfolders))
+
+
+def glob_root(pattern):
+    """
+    Возвращает папку шаблона до первого компонента со спецсимволами.
+
+    :param pattern: Шаблон вида "photos/**/*.jpg".
+    """
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    else:
+        parts = parts[:-1]  # Шаблон без спецсимволов — путь к файлу
+    root = os.sep.join(parts)
+    if not root:
+        return os.sep if pattern.startswith(os.sep) else os.curdir
+    return root
+
+
+def iter_sources(inputs, recursive=True, exclude=()):
+    """
+    Превращает список файлов, папок и шаблонов в поток исходников.
+
+    Каждый файл выдаётся один раз, даже если он попадает под несколько входов.
+
+    :param inputs: Пути к файлам и папкам или шаблоны имён ("*", "?", "[...]", "**").
+    :param recursive: Обходить ли вложенные папки.
+    :param exclude: Папки, которые не нужно обходить.
+    :return: Генератор: пути явно указанных файлов и SourceFile для найденных в папках и по шаблонам.
+    """
+    seen = set()
+
+    def first_time(path):
+        key = os.path.realpath(path)
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
+
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                found = walk_images(item, exclude)
+            else:
+                found = (entry.path for entry in sorted(os.scandir(item), key=lambda entry: entry.name)
+                         if not entry.name.startswith(".") and entry.is_file() and is_image_file(entry.name))
+            for path in found:
+                if first_time(path):
+                    yield SourceFile(path, item)
+        elif glob.has_magic(item) and not os.path.exists(item):
+            root = glob_root(item)
+            for path in glob.iglob(item, recursive=recursive):
+                if os.path.isfile(path) and is_image_file(path) and first_time(path):
+                    yield SourceFile(path, root)
+        elif first_time(item):
+            # Явно указанный файл передаётся как есть: ошибку открытия сообщит конвертация
+            yield item
@@ -0,0 +1,475 @@
+"""
+Распределение конвертации по машинам через общую папку заданий («спул»).
+
+Координатор (обычный запуск с параметром spool) записывает задание на каждый исходник в папку
+jobs/ общей папки, а рабочие процессы — на этой или других машинах, видящих ту же файловую систему
+по тем же путям, — забирают задания, конвертируют исходники и записывают результаты в done/.
+Координатор собирает результаты и передаёт их в обычный поток convert_images: манифест сборки,
+code.txt, images.json и статусы файлов в интерфейсе обновляются так же, как при локальной работе.
+
+Задание забирается атомарным переименованием из jobs/ в claimed/, поэтому его получает ровно один
+рабочий процесс. Пока задание выполняется, рабочий процесс обновляет время изменения файла в
+claimed/ (аренду); если аренда не обновлялась дольше lease секунд — процесс завершился или машина
+недоступна, — координатор возвращает задание в jobs/, и его забирает другой рабочий процесс.
+Аренда сравнивается с часами координатора, поэтому её длительность стоит выбирать с запасом на
+расхождение часов машин.
+
+Каждое взятие задания получает свой ключ (claim token): он входит в имя файла аренды и результата.
+Рабочий процесс, аренда которого истекла, результат не записывает, а если записал раньше, чем
+координатор вернул задание в очередь, координатор его отбрасывает и ждёт повторного выполнения.
+Выходные файлы при этом пишутся через временные файлы каждого процесса
+(см. output.private_partial_path), поэтому два одновременных выполнения не портят друг друга.
+"""
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from .cache import SourceCache
+from .engine import ConversionOptions, OutputResult, convert_source, resolve_encode_threads
+from .quality import QualityTarget
+
+# Папки общей папки заданий: ожидающие, выполняемые и выполненные задания
+JOBS_DIR = "jobs"
+CLAIMED_DIR = "claimed"
+DONE_DIR = "done"
+
+# Аренда задания по умолчанию, в секундах
+DEFAULT_LEASE = 60.0
+
+# Как часто координатор проверяет результаты, а свободный рабочий процесс — новые задания, в секундах
+POLL_INTERVAL = 0.5
+
+# Сколько заданий координатор записывает между проверками результатов
+SUBMIT_BATCH = 100
+
+
+def write_json(path, data):
+    """
+    Атомарно записывает JSON: во временный скрытый файл (рабочие процессы его не видят),
+    затем переименованием.
+    """
+    folder, name = os.path.split(path)
+    tmp_path = os.path.join(folder, f".{name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def options_to_dict(options):
+    """
+    Параметры конвейера в виде, пригодном для JSON.
+    """
+    data = dict(vars(options))
+    if options.target is not None:
+        data["target"] = dict(vars(options.target))
+    return data
+
+
+def options_from_dict(data):
+    """
+    Восстанавливает ConversionOptions из options_to_dict.
+    """
+    data = dict(data)
+    if data.get("target") is not None:
+        data["target"] = QualityTarget(**data["target"])
+    return ConversionOptions(**data)
+
+
+def result_to_dict(result):
+    """
+    OutputResult в виде, пригодном для JSON.
+    """
+    return dict(vars(result))
+
+
+def result_from_dict(data):
+    """
+    Восстанавливает OutputResult из result_to_dict.
+    """
+    result = OutputResult(data["source_path"], data["out_path"], data["width"], data["fmt"])
+    vars(result).update(data)
+    result.spans = [tuple(span) for span in result.spans]
+    return result
+
+
+class Spool:
+    """
+    Общая папка заданий.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Путь к общей папке; вложенные папки создаются при необходимости.
+        """
+        self.path = path
+        self.jobs = os.path.join(path, JOBS_DIR)
+        self.claimed = os.path.join(path, CLAIMED_DIR)
+        self.done = os.path.join(path, DONE_DIR)
+        self.stale = set()  # Имена "{задание}.{ключ}" взятий, аренда которых истекла (см. expire)
+        for folder in (self.jobs, self.claimed, self.done):
+            os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def _names(folder, prefix=""):
+        # Временные файлы скрыты, поэтому недописанные задания и результаты не видны
+        try:
+            return sorted(name for name in os.listdir(folder)
+                          if name.endswith(".json") and not name.startswith(".") and name.startswith(prefix))
+        except FileNotFoundError:
+            return []
+
+    def submit(self, job_id, job):
+        """
+        Записывает задание.
+
+        :param job_id: Идентификатор задания (без точек).
+        :param job: Описание задания — простые данные, сериализуемые в JSON.
+        """
+        write_json(os.path.join(self.jobs, job_id + ".json"), job)
+
+    def claim(self, worker_id):
+        """
+        Забирает первое свободное задание.
+
+        :param worker_id: Идентификатор рабочего процесса (без точек).
+        :return: Кортеж (идентификатор задания, путь файла аренды, задание) или None, если заданий нет.
+        """
+        for name in self._names(self.jobs):
+            job_id = name[:-len(".json")]
+            path = os.path.join(self.jobs, name)
+            # Ключ взятия: тот же рабочий процесс может взять задание снова после истечения аренды
+            claimed = os.path.join(self.claimed, f"{job_id}.{worker_id}-{uuid.uuid4().hex[:8]}.json")
+            try:
+                # Аренда отсчитывается от времени изменения, а переименование его не меняет:
+                # файл сначала обновляется, и только потом забирается
+                os.utime(path)
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue  # Задание забрал другой рабочий процесс
+            try:
+                return job_id, claimed, read_json(claimed)
+            except (OSError, ValueError):
+                self.release(job_id, claimed)
+                raise
+        return None
+
+    @staticmethod
+    def renew(claimed):
+        """
+        Продлевает аренду задания.
+
+        :return: False, если аренда уже истекла и задание возвращено в очередь.
+        """
+        try:
+            os.utime(claimed)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def release(self, job_id, claimed):
+        """
+        Возвращает незавершённое задание в очередь.
+        """
+        try:
+            os.rename(claimed, os.path.join(self.jobs, job_id + ".json"))
+        except FileNotFoundError:
+            pass  # Аренда уже истекла
+
+    def complete(self, job_id, claimed, payload):
+        """
+        Записывает результат задания и снимает аренду.
+
+        Результат записывается под ключом взятия. Если аренда уже истекла, результат не записывается:
+        задание возвращено в очередь и будет выполнено заново.
+
+        :return: False, если аренда истекла и результат отброшен.
+        """
+        if not self.renew(claimed):
+            return False
+        write_json(os.path.join(self.done, os.path.basename(claimed)), payload)
+        try:
+            os.remove(claimed)
+        except FileNotFoundError:
+            pass  # Аренда истекла после записи результата: его отбросит координатор
+        return True
+
+    def expire(self, prefix, lease):
+        """
+        Возвращает в очередь задания, аренда которых не продлевалась дольше lease секунд.
+
+        :param prefix: Префикс идентификаторов заданий (задания одного запуска).
+        :return: Число возвращённых заданий.
+        """
+        expired = 0
+        now = time.time()
+        for name in self._names(self.claimed, prefix):
+            path = os.path.join(self.claimed, name)
+            try:
+                if now - os.path.getmtime(path) <= lease:
+                    continue
+                os.rename(path, os.path.join(self.jobs, name.split(".", 1)[0] + ".json"))
+                expired += 1
+            except FileNotFoundError:
+                continue  # Задание только что завершено
+            # Результат этого взятия, если он всё же появится, не принимается
+            self.stale.add(name[:-len(".json")])
+        return expired
+
+    def collect(self, prefix):
+        """
+        Забирает результаты заданий.
+
+        :param prefix: Префикс идентификаторов заданий.
+        :return: Список пар (идентификатор задания, результат).
+        """
+        collected = []
+        for name in self._names(self.done, prefix):
+            path = os.path.join(self.done, name)
+            claim = name[:-len(".json")]
+            if claim in self.stale:
+                # Аренда этого взятия истекла: задание выполняется заново, результат не нужен
+                self.stale.discard(claim)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                payload = read_json(path)
+                os.remove(path)
+            except (OSError, ValueError):
+                continue
+            job_id = claim.split(".", 1)[0]
+            # Задание, возвращённое в очередь после истечения аренды, но выполненное раньше, чем его взяли
+            # снова, больше не нужно
+            self.withdraw([job_id])
+            collected.append((job_id, payload))
+        return collected
+
+    def withdraw(self, job_ids):
+        """
+        Удаляет из очереди ещё не забранные задания.
+        """
+        for job_id in job_ids:
+            try:
+                os.remove(os.path.join(self.jobs, job_id + ".json"))
+            except FileNotFoundError:
+                pass
+
+
+def iter_spool_results(spool_path, tasks, widths, formats, save_params, options, on_output=None, lookup=None,
+                       cancel=None, lease=DEFAULT_LEASE):
+    """
+    Координатор: раздаёт исходники через общую папку заданий и собирает результаты.
+
+    :param spool_path: Общая папка заданий.
+    :param tasks: Итерируемый объект кортежей (индекс, путь к исходнику, папка результатов, ошибка или None).
+    :param widths: Список ширин.
+    :param formats: Список форматов.
+    :param save_params: Словарь {формат: параметры сохранения}.
+    :param options: ConversionOptions.
+    :param on_output: Функция для OutputResult; вызывается в текущем процессе после завершения исходника.
+    :param lookup: Функция (путь, папка) -> SourceCache или None; сведения передаются в задание.
+    :param cancel: Объект с методом is_set(); после установки флага незабранные задания удаляются,
+                   а результаты начатых не ожидаются.
+    :param lease: Аренда задания в секундах.
+    :return: Генератор кортежей (индекс исходника, путь, список OutputResult или исключение)
+             в порядке завершения.
+    """
+    spool = Spool(spool_path)
+    run_id = f"{time.strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:8]}"
+    pending = {}  # Идентификатор задания -> (индекс, путь к исходнику)
+
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    def finished():
+        for job_id, payload in spool.collect(run_id):
+            if job_id not in pending:
+                continue
+            index, source_path = pending.pop(job_id)
+            if "error" in payload:
+                yield index, source_path, RuntimeError(payload["error"])
+                continue
+            results = [result_from_dict(data) for data in payload["results"]]
+            if on_output:
+                for result in results:
+                    on_output(result)
+            yield index, source_path, results
+
+    try:
+        for index, source_path, folder, error in tasks:
+            if cancelled():
+                return
+            if error is not None:
+                yield index, source_path, error
+                continue
+            cache = lookup(source_path, folder) if lookup else None
+            job_id = f"{run_id}-{index:08d}"
+            spool.submit(job_id, {
+                "source": os.path.abspath(source_path),
+                "folder": os.path.abspath(folder),
+                "widths": list(widths),
+                "formats": list(formats),
+                "save_params": save_params,
+                "options": options_to_dict(options),
+                "cache": {"state": cache.state, "outputs": cache.outputs} if cache is not None else None,
+            })
+            pending[job_id] = (index, source_path)
+            if len(pending) % SUBMIT_BATCH == 0:
+                yield from finished()
+
+        while pending and not cancelled():
+            spool.expire(run_id, lease)
+            yield from finished()
+            if pending:
+                if cancel is not None:
+                    cancel.wait(POLL_INTERVAL)
+                else:
+                    time.sleep(POLL_INTERVAL)
+    finally:
+        # Незабранные задания этого запуска не нужны; начатые дописывают файлы, а их результаты
+        # остаются в done/ (готовые файлы при повторном запуске пересобираются по манифесту)
+        spool.withdraw(pending)
+
+
+class Heartbeat:
+    """
+    Поток, продлевающий аренду задания, пока оно выполняется.
+    """
+
+    def __init__(self, claimed, interval):
+        self.claimed = claimed
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            if not Spool.renew(self.claimed):
+                break
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def process_job(job, local_workers=1, cancel=None):
+    """
+    Выполняет задание.
+
+    :param job: Описание задания (см. iter_spool_results).
+    :param local_workers: Число рабочих процессов на этой машине (для выбора числа потоков кодирования).
+    :param cancel: Объект с методом is_set() (см. engine.convert_source).
+    :return: Результат для done/: {"results": [...]} или {"error": текст}.
+    """
+    options = options_from_dict(job["options"])
+    options.encode_threads = resolve_encode_threads(0, local_workers, len(job["formats"]))
+    cache = SourceCache(job["cache"]["state"], job["cache"]["outputs"]) if job.get("cache") else None
+    try:
+        results = convert_source(job["source"], job["widths"], job["formats"], job["folder"], job["save_params"],
+                                 options, None, cache, cancel)
+    except Exception as e:
+        return {"error": str(e)}
+    return {"results": [result_to_dict(result) for result in results]}
+
+
+def worker_id():
+    """
+    Идентификатор рабочего процесса: имя машины и номер процесса.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}".replace(".", "_")
+
+
+def run_worker(spool_path, lease=DEFAULT_LEASE, once=False, cancel=None, local_workers=1, on_job=None):
+    """
+    Рабочий процесс: забирает и выполняет задания, пока не будет установлен флаг отмены.
+
+    :param spool_path: Общая папка заданий.
+    :param lease: Аренда задания в секундах (должна совпадать с арендой координатора).
+    :param once: Завершиться, когда свободных заданий не останется.
+    :param cancel: Объект с методами is_set() и wait(); после установки флага начатое задание
+                   возвращается в очередь.
+    :param local_workers: Число рабочих процессов на этой машине.
+    :param on_job: Функция, вызываемая с заданием и его результатом.
+    :return: Число выполненных заданий.
+    """
+    spool = Spool(spool_path)
+    me = worker_id()
+    completed = 0
+    while cancel is None or not cancel.is_set():
+        claim = spool.claim(me)
+        if claim is None:
+            if once:
+                break
+            if cancel is not None:
+                cancel.wait(POLL_INTERVAL)
+            else:
+                time.sleep(POLL_INTERVAL)
+            continue
+        job_id, claimed, job = claim
+        heartbeat = Heartbeat(claimed, lease / 3)
+        try:
+            payload = process_job(job, local_workers, cancel)
+        except BaseException:
+            heartbeat.stop()
+            spool.release(job_id, claimed)
+            raise
+        heartbeat.stop()
+        if cancel is not None and cancel.is_set():
+            # Исходник обработан не полностью: задание выполнит другой рабочий процесс
+            spool.release(job_id, claimed)
+            break
+        if not spool.complete(job_id, claimed, payload):
+            continue  # Аренда истекла: задание уже выполняет другой рабочий процесс
+        completed += 1
+        if on_job:
+            on_job(job, payload)
+    return completed
+
+
+def _worker_process(spool_path, lease, once, cancel, local_workers):
+    # Ctrl+C и SIGTERM обрабатывает родительский процесс и просит рабочие завершиться через общий флаг
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    run_worker(spool_path, lease, once, cancel, local_workers)
+
+
+def run_workers(spool_path, workers=1, lease=DEFAULT_LEASE, once=False, cancel=None, on_job=None):
+    """
+    Запускает несколько рабочих процессов на этой машине и ждёт их завершения.
+
+    :param workers: Число процессов; при 1 задания выполняются в текущем процессе.
+    :param cancel: threading.Event; при его установке процессы завершают начатые задания
+                   возвратом в очередь.
+    :param on_job: Функция для заданий, выполненных в текущем процессе (только при workers=1).
+    """
+    if workers <= 1:
+        return run_worker(spool_path, lease, once, cancel, 1, on_job)
+    shared_cancel = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=_worker_process,
+                                         args=(spool_path, lease, once, shared_cancel, workers))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        while any(process.is_alive() for process in processes):
+            if cancel is not None and cancel.is_set():
+                shared_cancel.set()
+            for process in processes:
+                process.join(POLL_INTERVAL / len(processes))
+    finally:
+        shared_cancel.set()
+        for process in processes:
+            process.join()
+    return None
@@ -0,0 +1,330 @@
+"""
+Потоковое масштабирование очень крупных исходников.
+
+Сканы карт и панорамы (20000 × 20000 и больше) при обычной обработке декодируются целиком: они
+упираются в ограничение Pillow на число пикселей (защита от «бомб декомпрессии») или занимают всю
+память. Исходники, пиксели которых хранятся в файле без сжатия (BMP, PPM/PGM, TIFF без сжатия),
+читаются полосами по STRIP_HEIGHT строк, и каждая полоса сразу уменьшается: память зависит от
+размера результатов, а не исходника.
+
+Масштабирование повторяет LANCZOS из Image.resize: Pillow масштабирует сначала по горизонтали, затем
+по вертикали. Горизонтальный проход выполняется для каждой полосы отдельно — он не зависит от
+соседних строк, — а вертикальный — для групп строк результата по окну из строк, которые покрывает
+ядро фильтра (box в Image.resize задаёт то же положение строк, что и при масштабировании целиком).
+Отличие от масштабирования в памяти — только в округлении плавающей точки (см. benchmark
+--compare-streaming).
+
+Остальные форматы (JPEG, PNG, TIFF со сжатием) Pillow не умеет читать частями: такие исходники
+декодируются целиком, и гигапиксельный PNG или TIFF со сжатием по-прежнему упирается в ограничение
+Pillow (check_decoded_size) — его нужно пересохранить без сжатия. JPEG декодируется в уменьшенном
+масштабе (см. resize.apply_draft), поэтому ограничение проверяется для уменьшенного размера.
+"""
+import struct
+
+from PIL import Image, UnidentifiedImageError
+
+from .resize import FILTERED_MODES, SOURCE, plan_resizes
+
+# Высота полосы исходника в строках
+STRIP_HEIGHT = 256
+
+# Исходники с большим числом пикселей читаются полосами, если формат это позволяет
+STREAM_PIXELS = 64 * 1024 * 1024
+
+# Опорная полуширина ядра LANCZOS в Pillow (при уменьшении умножается на коэффициент)
+LANCZOS_SUPPORT = 3.0
+
+# Бит на пиксель для режимов хранения в файле (rawmode), которые читаются полосами
+RAW_BITS = {
+    "1": 1, "1;I": 1, "1;R": 1, "1;IR": 1,
+    "L": 8, "L;I": 8, "P": 8,
+    "LA": 16, "I;16": 16, "I;16B": 16, "I;16L": 16,
+    "RGB": 24, "BGR": 24,
+    "RGBX": 32, "BGRX": 32, "XBGR": 32, "RGBA": 32, "BGRA": 32, "ABGR": 32, "RGBa": 32, "CMYK": 32,
+    "I": 32, "I;32": 32, "F": 32, "F;32F": 32,
+}
+
+# Режимы, которые Image.resize и Image.reduce обрабатывают с предумножением на альфа-канал
+PREMULTIPLIED_MODES = {"RGBA": "RGBa", "LA": "La"}
+
+def _open_unchecked(source_path):
+    # То же, что Image.open, но без проверки числа пикселей: модуль формата открывает файл сам.
+    # Ограничение Pillow — глобальная настройка, и снимать его нельзя даже ненадолго: потоки,
+    # декодирующие в это время другие изображения, остались бы без защиты
+    with open(source_path, "rb") as f:
+        prefix = f.read(16)
+    for load_plugins in (Image.preinit, Image.init):
+        load_plugins()
+        for fmt in Image.ID:
+            factory, accept = Image.OPEN[fmt]
+            accepted = not accept or accept(prefix)
+            if not accepted or isinstance(accepted, str):
+                continue
+            try:
+                return factory(source_path)
+            except (SyntaxError, IndexError, TypeError, struct.error):
+                continue
+    raise UnidentifiedImageError(f"cannot identify image file {source_path!r}")
+
+
+def open_image(source_path):
+    """
+    Открывает изображение; заголовок читается без декодирования.
+
+    Изображение, превышающее ограничение Pillow на число пикселей, всё равно открывается: его можно
+    читать полосами или декодировать в уменьшенном масштабе. Перед декодированием в память нужно
+    вызвать check_decoded_size.
+
+    :param source_path: Путь к изображению.
+    :return: Открытое, но не загруженное изображение.
+    """
+    try:
+        return Image.open(source_path)
+    except Image.DecompressionBombError:
+        return _open_unchecked(source_path)
+
+
+def check_decoded_size(size):
+    """
+    Проверка Pillow на «бомбу декомпрессии» для изображения, декодируемого в память целиком.
+
+    :param size: Размер декодируемого изображения (после уменьшенного декодирования).
+    :raises Image.DecompressionBombError: Если пикселей больше двойного Image.MAX_IMAGE_PIXELS.
+    """
+    limit = Image.MAX_IMAGE_PIXELS
+    pixels = size[0] * size[1]
+    if limit and pixels > 2 * limit:
+        raise Image.DecompressionBombError(
+            f"Изображение из {pixels} пикселей превышает ограничение {2 * limit} и не читается полосами: "
+            f"возможна бомба декомпрессии")
+
+
+def _raw_tiles(img):
+    # Описания фрагментов файла (x0, y0, x1, y1, смещение, rawmode, длина строки, направление строк)
+    # или None, если фрагменты нельзя читать по строкам
+    tiles = []
+    for tile in img.tile:
+        name, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+        if name != "raw":
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        rawmode, stride, ystep = (tuple(args) + (0, 1))[:3]
+        x0, y0, x1, y1 = extents
+        if not stride:
+            bits = RAW_BITS.get(rawmode)
+            if bits is None:
+                return None
+            stride = ((x1 - x0) * bits + 7) // 8
+        tiles.append((x0, y0, x1, y1, offset, rawmode, stride, ystep))
+    return tiles or None
+
+
+def strip_reader(img, strip_height=STRIP_HEIGHT):
+    """
+    Чтение изображения полосами без декодирования целиком.
+
+    :param img: Открытое, но не загруженное изображение.
+    :param strip_height: Высота полосы в строках.
+    :return: Функция без аргументов, возвращающая генератор полос (изображений во всю ширину) сверху
+             вниз, или None, если формат или режим не позволяют читать полосами.
+    """
+    if img.mode not in FILTERED_MODES or not getattr(img, "filename", None):
+        return None
+    tiles = _raw_tiles(img)
+    if tiles is None:
+        return None
+    width, height = img.size
+    mode, path = img.mode, img.filename
+
+    def read_rows(f, top, bottom):
+        band = None
+        for x0, y0, x1, y1, offset, rawmode, stride, ystep in tiles:
+            first, last = max(top, y0), min(bottom, y1)
+            if first >= last:
+                continue
+            # В файлах со строками снизу вверх (BMP) нижняя строка фрагмента записана первой
+            row = first - y0 if ystep > 0 else y1 - last
+            f.seek(offset + row * stride)
+            data = f.read((last - first) * stride)
+            part = Image.frombytes(mode, (x1 - x0, last - first), data, "raw", rawmode, stride, ystep)
+            if (x0, x1, first, last) == (0, width, top, bottom):
+                return part
+            if band is None:
+                band = Image.new(mode, (width, bottom - top))
+            band.paste(part, (x0, first - top))
+        return band
+
+    def strips():
+        with open(path, "rb") as f:
+            for top in range(0, height, strip_height):
+                yield read_rows(f, top, min(height, top + strip_height))
+
+    return strips
+
+
+def stream_reader(img):
+    """
+    Чтение полосами для исходника, который выгоднее не декодировать целиком.
+
+    :param img: Открытое, но не загруженное изображение (после apply_draft).
+    :return: См. strip_reader; None, если исходник меньше STREAM_PIXELS или не читается полосами.
+    """
+    width, height = img.size
+    if width * height <= STREAM_PIXELS:
+        return None
+    return strip_reader(img)
+
+
+def _row_span(row, scale, in_height):
+    # Строки входа, которые ядро LANCZOS использует для строки результата (как precompute_coeffs в Pillow)
+    support = LANCZOS_SUPPORT * max(scale, 1.0)
+    center = (row + 0.5) * scale
+    return max(int(center - support + 0.5), 0), min(int(center + support + 0.5), in_height)
+
+
+class StripResampler:
+    """
+    Масштабирование LANCZOS изображения, поступающего полосами сверху вниз.
+
+    Результат совпадает с image.reduce(reduce_factor).resize(size, Image.LANCZOS) для изображения,
+    составленного из полос, с точностью до округления; в памяти одновременно находятся только
+    результат и окно из строк, которые покрывает ядро фильтра.
+    """
+
+    def __init__(self, source_size, size, mode, reduce_factor=1):
+        """
+        :param source_size: Размер изображения, составленного из полос.
+        :param size: Размер результата.
+        :param mode: Режим полос.
+        :param reduce_factor: Коэффициент Image.reduce перед масштабированием (1 — без него).
+        """
+        self.mode = mode
+        self.size = size
+        self.reduce_factor = reduce_factor
+        # Размер после Image.reduce: неполные блоки на краях усредняются по имеющимся пикселям
+        self._in_size = (-(-source_size[0] // reduce_factor), -(-source_size[1] // reduce_factor))
+        self._work_mode = PREMULTIPLIED_MODES.get(mode, mode)
+        self._scale = self._in_size[1] / size[1]
+        self._result = Image.new(self._work_mode, size)
+        self._carry = None      # Строки исходника, не набравшие блока Image.reduce
+        self._window = None     # Строки после горизонтального прохода, ещё нужные ядру фильтра
+        self._window_top = 0    # Номер первой строки окна
+        self._rows = 0          # Сколько строк входа получено
+        self._next = 0          # Следующая строка результата
+
+    def _stack(self, top_img, bottom_img):
+        if top_img is None:
+            return bottom_img
+        stacked = Image.new(bottom_img.mode, (bottom_img.width, top_img.height + bottom_img.height))
+        stacked.paste(top_img, (0, 0))
+        stacked.paste(bottom_img, (0, top_img.height))
+        return stacked
+
+    def _reduce(self, band, last):
+        # Image.reduce по полосам, высота которых кратна коэффициенту, совпадает с reduce целиком
+        band = self._stack(self._carry, band)
+        usable = band.height if last else band.height - band.height % self.reduce_factor
+        self._carry = band.crop((0, usable, band.width, band.height)) if usable < band.height else None
+        if not usable:
+            return None
+        if usable < band.height:
+            band = band.crop((0, 0, band.width, usable))
+        # Image.reduce усредняет RGBA с предумножением и возвращает RGBA, как и в обычном пути
+        return band.reduce(self.reduce_factor)
+
+    def feed(self, band, last=False):
+        """
+        Принимает следующую полосу.
+
+        :param band: Изображение во всю ширину исходника.
+        :param last: True для последней полосы.
+        """
+        if self.reduce_factor > 1:
+            band = self._reduce(band, last)
+            if band is None:
+                return
+        if band.mode != self._work_mode:
+            band = band.convert(self._work_mode)
+        # Горизонтальный проход не зависит от соседних строк
+        if band.width != self.size[0]:
+            band = band.resize((self.size[0], band.height), Image.LANCZOS, box=(0, 0, band.width, band.height))
+        self._window = self._stack(self._window, band)
+        self._rows += band.height
+        self._emit(last)
+
+    def _emit(self, last):
+        in_height = self._in_size[1]
+        out_height = self.size[1]
+        end = self._next
+        while end < out_height and (last or _row_span(end, self._scale, in_height)[1] <= self._rows):
+            end += 1
+        if end == self._next:
+            return
+        top = self._window_top
+        # Строки результата [next, end) по окну: box задаёт их положение в координатах окна
+        # (низ последней строки может выйти за окно на погрешность округления)
+        box = (0, self._next * self._scale - top, self.size[0], min(end * self._scale - top, self._window.height))
+        rows = self._window.resize((self.size[0], end - self._next), Image.LANCZOS, box=box)
+        self._result.paste(rows, (0, self._next))
+        self._next = end
+        # Строки выше нужных следующей строке результата больше не понадобятся
+        if end < out_height:
+            first = _row_span(end, self._scale, in_height)[0]
+            if first > top:
+                self._window = self._window.crop((0, first - top, self._window.width, self._window.height))
+                self._window_top = first
+        else:
+            self._window = None
+
+    def result(self):
+        """
+        Результат после последней полосы.
+        """
+        if self._work_mode != self.mode:
+            return self._result.convert(self.mode)
+        return self._result
+
+
+def stream_renditions(img, strips, widths, cascade=True, logical_size=None):
+    """
+    Масштабирует читаемое полосами изображение во все ширины по плану resize.plan_resizes.
+
+    Шаги, которые строятся из исходника, выполняются за один проход по полосам; остальные — из уже
+    полученных вариантов, как в resize.resize_renditions.
+
+    :param img: Открытое изображение (используются только размер и режим).
+    :param strips: Функция, возвращающая генератор полос (см. strip_reader).
+    :param widths: Список ширин.
+    :param cascade: Использовать ли каскадное масштабирование.
+    :param logical_size: Размер исходника в файле (см. plan_resizes).
+    :return: Генератор пар (ширина, изображение) от большей ширины к меньшей.
+    """
+    steps = plan_resizes(img.size, widths, img.mode, cascade, logical_size)
+    resamplers = {step.width: StripResampler(img.size, (step.width, step.height), img.mode, step.reduce_factor)
+                  for step in steps if step.base is SOURCE}
+    bands = strips()
+    band = next(bands, None)
+    while band is not None:
+        following = next(bands, None)
+        for resampler in resamplers.values():
+            resampler.feed(band, following is None)
+        band = following
+
+    renditions = {width: resampler.result() for width, resampler in resamplers.items()}
+    del resamplers
+    consumers = {}
+    for step in steps:
+        if step.base is not SOURCE:
+            consumers[step.base] = consumers.get(step.base, 0) + 1
+    for step in steps:
+        if step.base is SOURCE:
+            resized_img = renditions.pop(step.width)
+        else:
+            resized_img = renditions[step.base].resize((step.width, step.height), Image.LANCZOS)
+            consumers[step.base] -= 1
+            if not consumers[step.base]:
+                del renditions[step.base]
+        if consumers.get(step.width):
+            renditions[step.width] = resized_img
+        yield step.width, resized_img
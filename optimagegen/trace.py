@@ -0,0 +1,119 @@
+"""
+Замеры стадий конвейера и запись трассировки.
+
+Конвейер замеряет декодирование, масштабирование, кодирование и запись каждого выходного файла.
+Отрезки времени (spans) передаются вместе с результатами, в том числе из рабочих процессов, и могут
+быть записаны в файл трассировки: в формате Chrome Trace (открывается в chrome://tracing и Perfetto)
+или построчно в JSON Lines.
+"""
+import json
+import os
+import threading
+import time
+
+# Стадии конвейера в порядке выполнения
+STAGES = ("decode", "resize", "encode", "write")
+
+
+def make_span(stage, start, duration):
+    """
+    Создаёт отрезок времени стадии.
+
+    :param stage: Название стадии (см. STAGES).
+    :param start: Время начала по часам эпохи (time.time()), в секундах.
+    :param duration: Длительность в секундах.
+    :return: Кортеж (стадия, начало, длительность, pid, tid) — простые данные, пригодные для передачи
+             между процессами.
+    """
+    return (stage, start, duration, os.getpid(), threading.get_ident())
+
+
+class Stopwatch:
+    """
+    Контекстный менеджер, замеряющий одну стадию.
+
+    Начало берётся по часам эпохи, чтобы отрезки из разных процессов совпадали на общей шкале,
+    а длительность — по монотонным часам.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.span = None
+
+    def __enter__(self):
+        self._start = time.time()
+        self._counter = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.span = make_span(self.stage, self._start, time.perf_counter() - self._counter)
+        return False
+
+    @property
+    def duration(self):
+        """Длительность стадии в секундах."""
+        return self.span[2]
+
+
+class TraceWriter:
+    """
+    Потоковая запись трассировки в файл.
+
+    Формат выбирается по расширению: ".jsonl" — JSON Lines (одно событие в строке), иначе — массив
+    событий Chrome Trace. События пишутся по мере поступления, поэтому память не растёт с размером пакета.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Путь к файлу трассировки.
+        """
+        self.path = path
+        self.json_lines = path.endswith(".jsonl")
+        self._file = open(path, "w", encoding="utf-8")
+        self._first = True
+        if not self.json_lines:
+            self._file.write("[\n")
+
+    def write_event(self, event):
+        """
+        Записывает одно событие.
+        """
+        line = json.dumps(event, ensure_ascii=False)
+        if self.json_lines:
+            self._file.write(line + "\n")
+            return
+        if not self._first:
+            self._file.write(",\n")
+        self._file.write(line)
+        self._first = False
+
+    def write_result(self, result):
+        """
+        Записывает отрезки времени одного выходного файла.
+
+        :param result: OutputResult.
+        """
+        for stage, start, duration, pid, tid in result.spans:
+            args = {"source": result.source_path}
+            if stage != "decode":
+                args["width"] = result.width
+            if stage in ("encode", "write"):
+                args.update({"output": result.out_path, "format": result.fmt, "bytes": result.size_bytes})
+            self.write_event({
+                "name": stage,
+                "cat": "pipeline",
+                "ph": "X",
+                "ts": round(start * 1e6),
+                "dur": round(duration * 1e6),
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            })
+
+    def close(self):
+        """
+        Завершает и закрывает файл трассировки.
+        """
+        if not self.json_lines:
+            self._file.write("\n]\n")
+        self._file.close()
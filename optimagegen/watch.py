@@ -0,0 +1,425 @@
+"""
+Режим наблюдения за папкой.
+
+Папка с исходниками один раз обходится при запуске (неизменённые файлы берутся из манифеста сборки),
+после чего конвертируются только новые и изменённые изображения, в том числе появившиеся во время
+первого обхода: наблюдение начинается до него. Изменения отслеживаются через
+inotify (Linux) или, если он недоступен, опросом: при опросе заново читаются только папки, время
+изменения которых поменялось, а известные файлы проверяются через stat.
+
+Файл конвертируется, только когда его размер и время изменения перестали меняться в течение
+WATCH_SETTLE секунд, — так недописанные при копировании файлы не попадают в конвертацию.
+code.txt и images.json обновляются после каждой пачки: описания хранятся по исходникам, и меняются
+только описания затронутых исходников.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from .cache import BuildManifest
+from .engine import convert_images, source_html
+from .output import CODE_FILENAME, INDEX_FILENAME, source_entry, write_code_file, write_index_file
+from .sources import SourceFile, is_image_file, iter_sources, walk_images
+
+# Сколько секунд файл не должен меняться, чтобы считаться записанным
+WATCH_SETTLE = 1.0
+
+# Период опроса папок, если inotify недоступен, и наибольшее ожидание событий inotify, в секундах
+POLL_INTERVAL = 1.0
+
+# Флаги inotify (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# События, на которые подписывается каждая наблюдаемая папка
+INOTIFY_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+                | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+
+# Заголовок события inotify: wd, mask, cookie, len
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def visible(name):
+    """
+    Скрытые файлы и папки (манифест, временные файлы) не отслеживаются.
+    """
+    return not name.startswith(".")
+
+
+class PollingWatcher:
+    """
+    Отслеживание изменений опросом файловой системы.
+
+    Запоминает время изменения папок и размер/время изменения файлов. За один опрос заново
+    читаются только папки, в которых появились, исчезли или были переименованы файлы.
+    """
+
+    def __init__(self, roots, recursive=True, exclude=(), interval=POLL_INTERVAL):
+        """
+        :param roots: Наблюдаемые папки.
+        :param recursive: Наблюдать ли вложенные папки.
+        :param exclude: Папки, которые не нужно наблюдать.
+        :param interval: Период опроса в секундах.
+        """
+        self.recursive = recursive
+        self.excluded = {os.path.realpath(path) for path in exclude}
+        self.interval = interval
+        self.folders = {}  # Папка -> время изменения
+        self.files = {}    # Файл -> (размер, время изменения)
+        for root in roots:
+            self._scan(root, set())
+
+    def _scan(self, folder, changed):
+        """
+        Читает папку, запоминает её состояние и отмечает новые файлы как изменённые.
+        """
+        try:
+            stat = os.stat(folder)
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError:
+            self.folders.pop(folder, None)
+            return
+        self.folders[folder] = stat.st_mtime_ns
+        for entry in entries:
+            if not visible(entry.name):
+                continue
+            try:
+                if entry.is_dir():
+                    if (self.recursive and entry.path not in self.folders
+                            and os.path.realpath(entry.path) not in self.excluded):
+                        self._scan(entry.path, changed)
+                elif entry.is_file() and is_image_file(entry.name) and entry.path not in self.files:
+                    entry_stat = entry.stat()
+                    self.files[entry.path] = (entry_stat.st_size, entry_stat.st_mtime_ns)
+                    changed.add(entry.path)
+            except OSError:
+                continue
+
+    def poll(self, timeout=None):
+        """
+        Ждёт до следующего опроса и возвращает изменившиеся пути.
+
+        :param timeout: Наибольшее время ожидания; по умолчанию — период опроса.
+        :return: Множество путей к созданным, изменённым и удалённым файлам.
+        """
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        changed = set()
+        for folder, mtime_ns in list(self.folders.items()):
+            try:
+                current = os.stat(folder).st_mtime_ns
+            except OSError:
+                # Папка удалена: её файлы и вложенные папки больше не наблюдаются
+                prefix = folder + os.sep
+                for path in [p for p in self.files if p.startswith(prefix)]:
+                    del self.files[path]
+                    changed.add(path)
+                for path in [p for p in self.folders if p == folder or p.startswith(prefix)]:
+                    del self.folders[path]
+                continue
+            if current != mtime_ns:
+                self._scan(folder, changed)
+        for path, signature in list(self.files.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.files[path]
+                changed.add(path)
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self.files[path] = current
+                changed.add(path)
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Отслеживание изменений через inotify (только Linux).
+
+    Каждая наблюдаемая папка подписывается на события отдельно; новые вложенные папки подписываются
+    по мере появления. При переполнении очереди событий наблюдаемые папки перечитываются.
+    """
+
+    def __init__(self, roots, recursive=True, exclude=()):
+        """
+        :param roots: Наблюдаемые папки.
+        :param recursive: Наблюдать ли вложенные папки.
+        :param exclude: Папки, которые не нужно наблюдать.
+        :raises OSError: Если inotify недоступен.
+        """
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify доступен только в Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.recursive = recursive
+        self.excluded = {os.path.realpath(path) for path in exclude}
+        self.roots = list(roots)
+        self.watches = {}  # Дескриптор подписки -> папка
+        for root in self.roots:
+            self._add_tree(root, None)
+
+    def _add_watch(self, folder):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(folder), INOTIFY_MASK)
+        if wd < 0:
+            return False
+        self.watches[wd] = folder
+        return True
+
+    def _add_tree(self, folder, changed):
+        """
+        Подписывается на папку и вложенные папки. Если передано множество changed, в него
+        добавляются уже лежащие там изображения: они могли появиться до подписки.
+        """
+        if os.path.realpath(folder) in self.excluded or not self._add_watch(folder):
+            return
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError:
+            return
+        for entry in entries:
+            if not visible(entry.name):
+                continue
+            try:
+                if entry.is_dir():
+                    if self.recursive:
+                        self._add_tree(entry.path, changed)
+                elif changed is not None and entry.is_file() and is_image_file(entry.name):
+                    changed.add(entry.path)
+            except OSError:
+                continue
+
+    def poll(self, timeout=POLL_INTERVAL):
+        """
+        Ждёт события inotify и возвращает изменившиеся пути.
+
+        :param timeout: Наибольшее время ожидания в секундах.
+        :return: Множество путей к созданным, изменённым и удалённым файлам.
+        """
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # События потеряны: наблюдаемые папки перечитываются
+                for root in self.roots:
+                    changed.update(walk_images(root, self.excluded))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            folder = self.watches.get(wd)
+            if folder is None or not name:
+                continue
+            name = os.fsdecode(name)
+            if not visible(name):
+                continue
+            path = os.path.join(folder, name)
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(path, changed)
+            elif is_image_file(name):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(roots, recursive=True, exclude=()):
+    """
+    Создаёт наблюдатель через inotify, а если он недоступен — через опрос.
+    """
+    try:
+        return InotifyWatcher(roots, recursive, exclude)
+    except (OSError, AttributeError):
+        return PollingWatcher(roots, recursive, exclude)
+
+
+class SettleQueue:
+    """
+    Пути, ожидающие окончания записи.
+
+    Путь готов к обработке, когда после последнего события прошло не меньше settle секунд и за это
+    время размер и время изменения файла не поменялись.
+    """
+
+    def __init__(self, settle=WATCH_SETTLE):
+        self.settle = settle
+        self.pending = {}  # Путь -> (время последнего изменения, (размер, время изменения) или None)
+
+    def __len__(self):
+        return len(self.pending)
+
+    @staticmethod
+    def signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None  # Файл удалён
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def add(self, paths, now=None):
+        now = time.monotonic() if now is None else now
+        for path in paths:
+            self.pending[path] = (now, self.signature(path))
+
+    def take_ready(self, now=None):
+        """
+        Забирает пути, запись которых закончилась.
+
+        :return: Пара списков (существующие файлы, удалённые файлы).
+        """
+        now = time.monotonic() if now is None else now
+        ready, removed = [], []
+        for path, (changed_at, signature) in list(self.pending.items()):
+            if now - changed_at < self.settle:
+                continue
+            current = self.signature(path)
+            if current != signature:
+                self.pending[path] = (now, current)  # Файл ещё записывается
+                continue
+            del self.pending[path]
+            (ready if current is not None else removed).append(path)
+        return ready, removed
+
+
+def watch_folders(roots, widths, formats, output_folder, save_params=None, generate_html=True,
+                  lazy_loading=True, on_output=None, on_error=None, on_batch=None, workers=1, options=None,
+                  memory_budget=None, preserve_layout=False, recursive=True, settle=WATCH_SETTLE,
+                  should_stop=None, generate_index=True, metadata=None):
+    """
+    Конвертирует папки и затем следит за ними, конвертируя новые и изменённые изображения.
+
+    :param roots: Наблюдаемые папки.
+    :param widths: Список ширин.
+    :param formats: Список форматов.
+    :param output_folder: Папка для сохранения.
+    :param save_params: Дополнительные параметры сохранения {формат: {параметр: значение}}.
+    :param generate_html: Поддерживать ли code.txt в актуальном состоянии.
+    :param lazy_loading: Добавлять ли атрибут loading="lazy".
+    :param on_output: Функция, вызываемая с OutputResult после каждого выходного файла.
+    :param on_error: Функция, вызываемая с текстом ошибки.
+    :param on_batch: Функция, вызываемая с ConversionReport после каждой пачки (включая первый обход).
+    :param workers: Число рабочих процессов.
+    :param options: ConversionOptions.
+    :param memory_budget: Бюджет памяти параллельной конвертации в байтах (см. convert_images).
+    :param preserve_layout: Повторять ли структуру подпапок исходников в папке результатов.
+    :param recursive: Наблюдать ли вложенные папки.
+    :param settle: Сколько секунд файл не должен меняться, чтобы считаться записанным.
+    :param should_stop: Функция без аргументов; наблюдение завершается, когда она вернёт True.
+                        По умолчанию наблюдение продолжается до KeyboardInterrupt.
+    :param generate_index: Поддерживать ли images.json в актуальном состоянии.
+    :param metadata: metadata.MetadataIndex — индекс хешей и размеров исходников (см. convert_images).
+    """
+    roots = [os.path.abspath(root) for root in roots]
+    output_folder = os.path.abspath(output_folder)
+    manifest = BuildManifest.load(output_folder)
+    html_parts = {}  # Исходник -> HTML-код (в порядке первого появления)
+    index_entries = {}  # Исходник -> описание для images.json (в порядке первого появления)
+    code_path = os.path.join(output_folder, CODE_FILENAME)
+    index_path = os.path.join(output_folder, INDEX_FILENAME)
+
+    def run(sources):
+        report = convert_images(
+            sources, widths, formats, output_folder=output_folder, save_params=save_params,
+            generate_html=False, generate_index=False, on_output=on_output, on_error=on_error, workers=workers,
+            options=options, memory_budget=memory_budget, preserve_layout=preserve_layout,
+            manifest=manifest, metadata=metadata,
+        )
+        by_source = {}
+        for result in report.results:
+            by_source.setdefault(result.source_path, []).append(result)
+        for source_path, results in by_source.items():
+            if generate_html:
+                html_code = source_html(source_path, results, formats, lazy_loading, output_folder)
+                if html_code:
+                    html_parts[source_path] = html_code
+                else:
+                    html_parts.pop(source_path, None)
+            if generate_index:
+                entry = source_entry(source_path, results, output_folder)
+                if entry:
+                    index_entries[source_path] = entry
+                else:
+                    index_entries.pop(source_path, None)
+        return report
+
+    def flush_html():
+        try:
+            if generate_html:
+                write_code_file(code_path, list(html_parts.values()))
+            if generate_index:
+                write_index_file(index_path, widths, formats, list(index_entries.values()))
+        except OSError as e:
+            if on_error:
+                on_error(f"Ошибка записи code.txt и images.json: {e}")
+
+    def as_source(path):
+        # Файл из наблюдаемой папки помнит свой корень, чтобы сохранить структуру подпапок
+        for root in roots:
+            if path.startswith(root + os.sep):
+                return SourceFile(path, root)
+        return path
+
+    # Папка результатов внутри наблюдаемой не наблюдается; если же она сама наблюдаемая (результаты
+    # пишутся рядом с исходниками), свои файлы отсеивает манифест сборки (см. ниже)
+    real_roots = {os.path.realpath(root) for root in roots}
+    exclude = [] if os.path.realpath(output_folder) in real_roots else [output_folder]
+
+    # Наблюдение начинается до первого обхода: файлы, добавленные или изменённые во время него,
+    # накопятся в наблюдателе (очередь inotify или отличие от снимка опроса) и будут обработаны после
+    watcher = create_watcher(roots, recursive, exclude=exclude)
+    queue = SettleQueue(settle)
+    try:
+        # Первый обход: актуальные файлы берутся из манифеста, их HTML-код восстанавливается
+        report = run(iter_sources(roots, recursive, exclude=exclude))
+        flush_html()
+        if on_batch:
+            on_batch(report)
+
+        while not (should_stop and should_stop()):
+            queue.add(watcher.poll(min(POLL_INTERVAL, settle) if len(queue) else POLL_INTERVAL))
+            ready, removed = queue.take_ready()
+            # Файлы, записанные самой конвертацией в наблюдаемую папку, исходниками не считаются
+            ready = [path for path in ready if not manifest.is_output(path)]
+            for path in removed:
+                html_parts.pop(path, None)
+                index_entries.pop(path, None)
+            if ready:
+                report = run([as_source(path) for path in sorted(ready)])
+                if on_batch:
+                    on_batch(report)
+            if ready or removed:
+                flush_html()
+    finally:
+        watcher.close()
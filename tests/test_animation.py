@@ -0,0 +1,44 @@
+"""
+Анимированные исходники (optimagegen.animation и engine.encode_animation).
+"""
+from PIL import Image
+
+from optimagegen import engine
+from optimagegen.animation import frame_duration
+from optimagegen.engine import convert_images
+
+
+def read_durations(path):
+    with Image.open(path) as img:
+        durations = []
+        for frame in range(img.n_frames):
+            img.seek(frame)
+            img.load()
+            durations.append(img.info["duration"])
+        return durations
+
+
+def test_frame_duration_replaces_only_unset_gif_delays():
+    assert frame_duration({"duration": 0}, "GIF") == 100
+    assert frame_duration({"duration": 10}, "GIF") == 100
+    assert frame_duration({"duration": 20}, "GIF") == 20
+    assert frame_duration({}, "GIF") == 100
+    assert frame_duration({"duration": 10}, "WEBP") == 10
+
+
+def test_durations_read_once_per_source(tmp_path, monkeypatch):
+    frames = [Image.new("RGB", (200, 100), (i * 60, 0, 0)) for i in range(4)]
+    source = tmp_path / "a.gif"
+    frames[0].save(source, save_all=True, append_images=frames[1:], duration=[0, 20, 60, 200], loop=0)
+    output_folder = tmp_path / "out"
+    output_folder.mkdir()
+    calls = []
+    original = engine.frame_durations
+    monkeypatch.setattr(engine, "frame_durations", lambda img, count: calls.append(count) or original(img, count))
+
+    report = convert_images([str(source)], [50, 100, 150], ["WEBP"], str(output_folder))
+    assert not report.errors and not report.failed_outputs
+    assert calls == [4]
+    for result in report.results:
+        assert result.frames == 4
+        assert read_durations(result.out_path) == [100, 20, 60, 200]
@@ -0,0 +1,78 @@
+"""
+Манифест сборки и журнал (optimagegen.cache) при повторных запусках.
+"""
+import os
+
+from PIL import Image
+
+from optimagegen.cache import JOURNAL_FILENAME, MANIFEST_FILENAME, BuildManifest, source_state
+from optimagegen.engine import convert_images
+
+WIDTHS = [50, 100]
+FORMATS = ["WEBP", "PNG"]
+
+
+def make_png(path, color):
+    Image.new("RGB", (300, 200), color).save(path)
+    return str(path)
+
+
+def convert(sources, output_folder, **kwargs):
+    report = convert_images(sources, WIDTHS, FORMATS, str(output_folder), **kwargs)
+    assert not report.errors and not report.failed_outputs
+    return report
+
+
+def test_incremental_rerun_hits_cache(tmp_path):
+    output_folder = tmp_path / "out"
+    output_folder.mkdir()
+    sources = [make_png(tmp_path / "a.png", (255, 0, 0)), make_png(tmp_path / "b.png", (0, 0, 255))]
+    first = convert(sources, output_folder)
+    assert not first.cached_outputs
+    assert (output_folder / MANIFEST_FILENAME).exists()
+    assert not (output_folder / JOURNAL_FILENAME).exists()
+
+    second = convert(sources, output_folder)
+    assert len(second.cached_outputs) == len(second.results) == len(sources) * len(WIDTHS) * len(FORMATS)
+    # Иные параметры сохранения делают файлы формата неактуальными
+    third = convert(sources, output_folder, save_params={"WEBP": {"quality": 50}})
+    assert {r.fmt for r in third.results if not r.cached} == {"WEBP"}
+
+
+def test_changed_source_invalidates_only_its_entries(tmp_path):
+    output_folder = tmp_path / "out"
+    output_folder.mkdir()
+    changed = make_png(tmp_path / "a.png", (255, 0, 0))
+    unchanged = make_png(tmp_path / "b.png", (0, 0, 255))
+    convert([changed, unchanged], output_folder)
+
+    make_png(changed, (0, 255, 0))
+    stat = os.stat(changed)
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    report = convert([changed, unchanged], output_folder)
+    assert {r.source_path for r in report.results if not r.cached} == {changed}
+    assert all(r.cached for r in report.results if r.source_path == unchanged)
+    manifest = BuildManifest.load(str(output_folder))
+    assert manifest.source(changed)["sha256"] == source_state(changed)["sha256"]
+
+
+def test_journal_is_replayed_after_interruption(tmp_path):
+    output_folder = tmp_path / "out"
+    output_folder.mkdir()
+    out_path = str(output_folder / "a-100w.webp")
+    with open(out_path, "wb") as f:
+        f.write(b"x" * 10)
+    manifest = BuildManifest(str(output_folder))
+    manifest.record_source(str(tmp_path / "a.png"), {"size": 1, "mtime_ns": 2, "sha256": "abc"})
+    manifest.record_output(out_path, {"source_sha256": "abc", "width": 100, "format": "WEBP"})
+    manifest.flush_journal()
+    # Процесс завершён до сохранения манифеста, последняя строка журнала недописана
+    with open(output_folder / JOURNAL_FILENAME, "a", encoding="utf-8") as f:
+        f.write('["output", "a-50w')
+
+    restored = BuildManifest.load(str(output_folder))
+    assert restored.source(str(tmp_path / "a.png"))["sha256"] == "abc"
+    assert restored.outputs == {"a-100w.webp": {"source_sha256": "abc", "width": 100, "format": "WEBP", "bytes": 10}}
+    restored.save()
+    assert not (output_folder / JOURNAL_FILENAME).exists()
+    assert BuildManifest.load(str(output_folder)).outputs == restored.outputs
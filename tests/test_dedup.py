@@ -0,0 +1,74 @@
+"""
+Одинаковые исходники (optimagegen.dedup).
+"""
+import os
+import shutil
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+from optimagegen.dedup import DedupIndex
+from optimagegen.engine import convert_images
+
+WIDTHS = [50, 100]
+FORMATS = ["WEBP", "PNG"]
+
+
+def make_png(path, comment):
+    # Одинаковые пиксели, разные метаданные
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Comment", comment)
+    img = Image.linear_gradient("L").resize((300, 200)).convert("RGB")
+    img.save(path, pnginfo=info)
+    return str(path)
+
+
+@pytest.fixture
+def folders(tmp_path):
+    sources = tmp_path / "in"
+    sources.mkdir()
+    output_folder = tmp_path / "out"
+    output_folder.mkdir()
+    return sources, output_folder
+
+
+def test_identical_files_are_hardlinked(folders):
+    sources, output_folder = folders
+    first = make_png(sources / "a.png", "a")
+    shutil.copyfile(first, sources / "b.png")
+
+    report = convert_images([first, str(sources / "b.png")], WIDTHS, FORMATS, str(output_folder))
+    assert not report.errors and not report.failed_outputs
+    linked = report.deduplicated_outputs
+    assert {r.source_path for r in linked} == {str(sources / "b.png")}
+    assert len(linked) == len(WIDTHS) * len(FORMATS)
+    for result in linked:
+        assert result.hardlinked
+        assert os.path.samefile(result.out_path, result.linked_from)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_same_pixels_are_linked_across_runs(folders, workers):
+    sources, output_folder = folders
+    first = make_png(sources / "a.png", "a")
+    second = make_png(sources / "b.png", "b")
+    convert_images([first], WIDTHS, FORMATS, str(output_folder))
+
+    # Донор известен по манифесту; в рабочий процесс передаётся только хеш его пикселей
+    report = convert_images([first, second], WIDTHS, FORMATS, str(output_folder), workers=workers)
+    assert not report.errors and not report.failed_outputs
+    assert {r.source_path for r in report.deduplicated_outputs} == {second}
+    assert all(r.cached for r in report.results if r.source_path == first)
+
+
+def test_hint_for_worker_carries_only_digests():
+    index = DedupIndex()
+    renditions = {(100, "WEBP"): ("/out/a-100w.webp", 50, None, 1234)}
+    index.by_file["sha"] = renditions
+    index._add_pixels({"pixels": "digest", "image_size": [300, 200]}, renditions)
+
+    local = index.hint("other", (300, 200))
+    assert local.pixels == {"digest": renditions} and not local.digests
+    remote = index.hint("other", (300, 200), digests_only=True)
+    assert remote.pixels == {} and remote.digests == {"digest"}
+    assert index.hint("other", (10, 10), digests_only=True) is None
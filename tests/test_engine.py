@@ -0,0 +1,52 @@
+"""
+Пакетная конвертация (optimagegen.engine.convert_images).
+"""
+import shutil
+
+from PIL import Image
+
+from optimagegen.engine import convert_images, plan_outputs
+
+
+def make_jpeg(path, color):
+    Image.new("RGB", (800, 600), color).save(path, quality=90)
+    return str(path)
+
+
+def test_decoded_sources_exclude_cached_and_linked(tmp_path):
+    sources = tmp_path / "in"
+    sources.mkdir()
+    output_folder = tmp_path / "out"
+    output_folder.mkdir()
+    first = make_jpeg(sources / "a.jpg", (200, 40, 40))
+    second = make_jpeg(sources / "b.jpg", (40, 40, 200))
+    # Копия первого исходника: её файлы берутся у него, а не кодируются
+    shutil.copyfile(first, sources / "c.jpg")
+    paths = [first, second, str(sources / "c.jpg")]
+
+    report = convert_images(paths, [100, 200], ["WEBP", "JPEG"], str(output_folder))
+    assert not report.errors and not report.failed_outputs
+    assert report.sources_converted == 3
+    assert {r.source_path for r in report.deduplicated_outputs} == {str(sources / "c.jpg")}
+    assert report.sources_decoded == 2
+    assert report.draft_decodes == 2
+
+    # Повторный запуск: все файлы актуальны, ничего не декодируется
+    report = convert_images(paths, [100, 200], ["WEBP", "JPEG"], str(output_folder))
+    assert report.sources_converted == 3
+    assert len(report.cached_outputs) == len(report.results)
+    assert report.sources_decoded == 0
+    assert report.draft_decodes == 0
+
+
+def test_default_plan_matches_conversion(tmp_path):
+    output_folder = tmp_path / "out"
+    output_folder.mkdir()
+    source = make_jpeg(tmp_path / "a.jpg", (90, 160, 90))
+    # Ширина 1600 больше исходника (800): по умолчанию она сводится к ширине исходника
+    widths, formats = [400, 1600], ["WEBP"]
+
+    planned = {out_path for _, _, _, out_path in plan_outputs([source], widths, formats, str(output_folder))}
+    report = convert_images([source], widths, formats, str(output_folder))
+    assert planned == set(report.generated_files)
+    assert {r.width for r in report.results} == {400, 800}
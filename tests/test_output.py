@@ -0,0 +1,61 @@
+"""
+Запись code.txt и images.json (optimagegen.output.OutputWriter).
+"""
+import json
+
+from optimagegen.output import CODE_FILENAME, HTML_SEPARATOR, INDEX_FILENAME, OutputWriter, partial_path
+
+WIDTHS = [100, 200]
+FORMATS = ["WEBP"]
+
+
+def entry(name):
+    return {"source": name, "renditions": []}
+
+
+def test_out_of_order_sources_are_written_in_order(tmp_path):
+    writer = OutputWriter(str(tmp_path), WIDTHS, FORMATS)
+    writer.add(2, "<img c>", entry("c"))
+    writer.add(0, "<img a>", entry("a"))
+    # Исходник 1 не обработан: он передаётся с пустыми значениями и не задерживает следующие
+    assert writer.html_count == 1
+    writer.add(1)
+    assert writer.html_count == 2
+    writer.add(3, "<img d>", entry("d"))
+    code_path, index_path = writer.close()
+
+    assert code_path == str(tmp_path / CODE_FILENAME)
+    assert (tmp_path / CODE_FILENAME).read_text(encoding="utf-8") == HTML_SEPARATOR.join(
+        ["<img a>", "<img c>", "<img d>"])
+    index = json.loads((tmp_path / INDEX_FILENAME).read_text(encoding="utf-8"))
+    assert index["widths"] == WIDTHS and index["formats"] == FORMATS
+    assert [item["source"] for item in index["images"]] == ["a", "c", "d"]
+    assert not (tmp_path / ("." + CODE_FILENAME + ".part")).exists()
+
+
+def test_close_without_entries_keeps_previous_files(tmp_path):
+    (tmp_path / CODE_FILENAME).write_text("old code", encoding="utf-8")
+    (tmp_path / INDEX_FILENAME).write_text("old index", encoding="utf-8")
+    writer = OutputWriter(str(tmp_path), WIDTHS, FORMATS)
+    writer.add(0)
+
+    assert writer.close() == (None, None)
+    assert (tmp_path / CODE_FILENAME).read_text(encoding="utf-8") == "old code"
+    assert (tmp_path / INDEX_FILENAME).read_text(encoding="utf-8") == "old index"
+    assert sorted(path.name for path in tmp_path.iterdir()) == [CODE_FILENAME, INDEX_FILENAME]
+
+
+def test_abort_leaves_partial_files(tmp_path):
+    (tmp_path / CODE_FILENAME).write_text("old code", encoding="utf-8")
+    writer = OutputWriter(str(tmp_path), WIDTHS, FORMATS)
+    writer.add(0, "<img a>", entry("a"))
+    writer.abort()
+
+    assert (tmp_path / CODE_FILENAME).read_text(encoding="utf-8") == "old code"
+    assert not (tmp_path / INDEX_FILENAME).exists()
+    code_part = partial_path(str(tmp_path / CODE_FILENAME))
+    index_part = partial_path(str(tmp_path / INDEX_FILENAME))
+    with open(code_part, encoding="utf-8") as f:
+        assert f.read() == "<img a>"
+    with open(index_part, encoding="utf-8") as f:
+        assert '"source": "a"' in f.read()
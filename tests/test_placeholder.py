@@ -0,0 +1,79 @@
+"""
+Заглушки изображений (optimagegen.placeholder).
+
+Ожидаемые строки BlurHash получены эталонной реализацией (пакет blurhash с PyPI).
+"""
+import pytest
+from PIL import Image
+
+from optimagegen.placeholder import blurhash, compute_placeholder, dominant_color, placeholder_attributes
+
+np = pytest.importorskip("numpy")
+
+
+def gradient():
+    pixels = np.zeros((6, 8, 3), np.uint8)
+    pixels[..., 0] = np.arange(8) * 32
+    pixels[..., 1] = (np.arange(6) * 40)[:, None]
+    pixels[..., 2] = 128
+    return pixels
+
+
+@pytest.mark.parametrize("color, expected", [
+    ((255, 0, 0), "00TI:j"),
+    ((0, 128, 255), "0004*="),
+    ((10, 20, 30), "001C={"),
+])
+def test_blurhash_uniform_color(color, expected):
+    assert blurhash(np.full((4, 6, 3), color, np.uint8), 1, 1) == expected
+
+
+@pytest.mark.parametrize("components, expected", [
+    ((4, 3), "LjF=ad3Ba|xuzONLfQnTeqf7fQf7"),
+    ((3, 4), "TjF=ad3Ba|zONLfQeqf7fQ%MOXfQ"),
+    ((1, 2), "9XF=ad*Y"),
+])
+def test_blurhash_gradient(components, expected):
+    assert blurhash(gradient(), *components) == expected
+
+
+def test_blurhash_all_components():
+    value = blurhash(gradient(), 9, 9)
+    assert len(value) == 4 + 2 + 2 * (9 * 9 - 1)
+    assert value.startswith("|jF=ad3Ba|xuJl%2FI-VFIzONLfQnTWp")
+    assert value.endswith("%fOXfQofWpofWpofWpd_e;fQe;fQe;fQe;fQ")
+
+
+def test_dominant_color_ignores_transparent_pixels():
+    pixels = np.zeros((4, 4, 3), np.uint8)
+    pixels[:3] = (200, 10, 10)
+    pixels[3] = (10, 10, 200)
+    assert dominant_color(pixels) == "#c80a0a"
+    alpha = np.zeros((4, 4), np.uint8)
+    alpha[3] = 255
+    assert dominant_color(pixels, alpha) == "#0a0ac8"
+
+
+def test_opaque_blurhash_placeholder():
+    placeholder = compute_placeholder(Image.new("RGB", (120, 80), (255, 0, 0)), "blurhash")
+    assert placeholder["kind"] == "blurhash" and placeholder["opaque"]
+    assert placeholder["color"] == "#ff0000"
+    # Для горизонтального изображения компонент по ширине больше (4×3); цвет — как у 1×1
+    assert placeholder["blurhash"][0] == "L" and placeholder["blurhash"][2:6] == "TI:j"
+    assert placeholder_attributes(placeholder) == [("style", "background-color: #ff0000"),
+                                                   ("data-blurhash", placeholder["blurhash"])]
+
+
+def test_transparent_lqip_placeholder_has_no_background():
+    img = Image.new("RGBA", (40, 60), (0, 0, 255, 255))
+    img.paste((0, 0, 0, 0), (0, 0, 40, 20))
+    placeholder = compute_placeholder(img, "lqip")
+    assert not placeholder["opaque"]
+    assert placeholder["color"] == "#0000ff"
+    assert placeholder["thumbnail"].startswith("data:image/webp;base64,")
+    assert placeholder_attributes(placeholder) == []
+
+
+def test_unknown_kind():
+    with pytest.raises(ValueError):
+        compute_placeholder(Image.new("RGB", (8, 8)), "svg")
@@ -0,0 +1,80 @@
+"""
+Подбор качества под целевое сходство и бюджет байт (optimagegen.quality).
+"""
+import io
+
+import pytest
+from PIL import Image
+
+from optimagegen.quality import QUALITY_FORMATS, QualityTarget, SsimReference, lowest_passing, search_quality
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture(scope="module")
+def image():
+    # Градиент с шумом: размер файла и сходство заметно зависят от качества
+    img = Image.linear_gradient("L").resize((320, 240)).convert("RGB")
+    noise = Image.effect_noise((320, 240), 40).convert("RGB")
+    return Image.blend(img, noise, 0.3)
+
+
+def encode(img, fmt, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def ssim(img, data):
+    with Image.open(io.BytesIO(data)) as decoded:
+        return SsimReference(img).ssim(decoded)
+
+
+def test_lowest_passing_matches_scan():
+    for threshold in range(30, 97):
+        def passes(q):
+            return q >= threshold
+        expected = threshold if threshold <= 95 else None
+        assert lowest_passing(30, 95, passes) == expected
+        for guess in (30, 60, 95):
+            assert lowest_passing(30, 95, passes, guess) == expected
+
+
+@pytest.mark.parametrize("fmt", QUALITY_FORMATS)
+@pytest.mark.parametrize("guess", [None, 40, 90])
+def test_ssim_search_converges(image, fmt, guess):
+    target = QualityTarget(min_ssim=0.9)
+    data, quality, trials = search_quality(image, fmt, {}, target, guess)
+    assert data == encode(image, fmt, quality)
+    assert ssim(image, data) >= target.min_ssim
+    assert quality == target.min_quality or ssim(image, encode(image, fmt, quality - 1)) < target.min_ssim
+    assert trials <= 14
+
+
+@pytest.mark.parametrize("fmt", QUALITY_FORMATS)
+@pytest.mark.parametrize("guess", [None, 40, 90])
+def test_byte_budget_search_converges(image, fmt, guess):
+    max_bytes = len(encode(image, fmt, 60))
+    target = QualityTarget(max_bytes=max_bytes)
+    data, quality, trials = search_quality(image, fmt, {}, target, guess)
+    assert len(data) <= max_bytes
+    assert quality == target.max_quality or len(encode(image, fmt, quality + 1)) > max_bytes
+    # Далёкая подсказка стоит не больше двух двоичных поисков по шкале
+    assert trials <= 14
+
+
+@pytest.mark.parametrize("fmt", QUALITY_FORMATS)
+def test_exact_guess_needs_few_trials(image, fmt):
+    target = QualityTarget(min_ssim=0.9)
+    _, quality, _ = search_quality(image, fmt, {}, target)
+    _, repeated, trials = search_quality(image, fmt, {}, target, quality)
+    assert repeated == quality
+    assert trials <= 3
+
+
+@pytest.mark.parametrize("fmt", QUALITY_FORMATS)
+def test_unreachable_budget_falls_back_to_min_quality(image, fmt):
+    target = QualityTarget(max_bytes=100)
+    data, quality, _ = search_quality(image, fmt, {}, target)
+    assert quality == target.min_quality
+    assert data == encode(image, fmt, target.min_quality)
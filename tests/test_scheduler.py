@@ -0,0 +1,35 @@
+"""
+Очередь задач с бюджетом памяти (optimagegen.scheduler.MemoryScheduler).
+"""
+from optimagegen.scheduler import MemoryScheduler
+
+
+def test_deferred_counts_each_task_once():
+    scheduler = MemoryScheduler(budget=100, max_in_flight=4)
+    scheduler.add("a", 60)
+    scheduler.add("b", 60)
+    scheduler.add("c", 60)
+    assert scheduler.admit() == [("a", 60)]
+
+    # Пока "a" выполняется, "b" не помещается, сколько бы раз ни проверялась очередь
+    for _ in range(5):
+        assert scheduler.admit() == []
+    assert scheduler.deferred == 1
+
+    scheduler.release(60)
+    assert scheduler.admit() == [("b", 60)]
+    assert scheduler.admit() == []
+    scheduler.release(60)
+    assert scheduler.admit() == [("c", 60)]
+    assert scheduler.deferred == 2
+    assert scheduler.peak == 60
+
+
+def test_small_task_bypasses_large_one():
+    scheduler = MemoryScheduler(budget=100, max_in_flight=4)
+    scheduler.add("large", 80)
+    scheduler.add("small", 10)
+    scheduler.add("big", 90)
+    assert scheduler.admit() == [("large", 80), ("small", 10)]
+    assert scheduler.admit() == []
+    assert scheduler.deferred == 1
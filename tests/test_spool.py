@@ -0,0 +1,58 @@
+"""
+Общая папка заданий (optimagegen.spool): аренда и ключи взятия.
+"""
+import os
+import time
+
+from optimagegen.output import private_partial_path
+from optimagegen.spool import Spool, write_json
+
+JOB = {"source": "a.png"}
+
+
+def expire_claim(spool, claimed):
+    # Аренда «истекает»: время изменения файла аренды отодвигается в прошлое
+    past = time.time() - 3600
+    os.utime(claimed, (past, past))
+    assert spool.expire("run", lease=60) == 1
+
+
+def test_complete_after_expiry_drops_result(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.submit("run-1", JOB)
+    job_id, claimed, job = spool.claim("w1")
+    assert job == JOB
+    expire_claim(spool, claimed)
+
+    # Задание вернулось в очередь, а опоздавший рабочий процесс результат не записывает
+    assert not spool.complete(job_id, claimed, {"results": []})
+    assert os.listdir(spool.done) == []
+    assert spool.collect("run") == []
+
+    job_id, claimed, _ = spool.claim("w2")
+    assert spool.complete(job_id, claimed, {"results": ["new"]})
+    assert spool.collect("run") == [("run-1", {"results": ["new"]})]
+    assert os.listdir(spool.done) == [] and os.listdir(spool.claimed) == [] and os.listdir(spool.jobs) == []
+
+
+def test_result_of_expired_claim_is_discarded(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.submit("run-1", JOB)
+    job_id, old_claim, _ = spool.claim("w1")
+    # Результат записан, но аренда истекла раньше, чем рабочий процесс её снял
+    write_json(os.path.join(spool.done, os.path.basename(old_claim)), {"results": ["old"]})
+    expire_claim(spool, old_claim)
+
+    assert spool.collect("run") == []
+    assert os.listdir(spool.done) == []
+    job_id, claimed, _ = spool.claim("w1")
+    assert claimed != old_claim
+    assert spool.complete(job_id, claimed, {"results": ["new"]})
+    assert spool.collect("run") == [("run-1", {"results": ["new"]})]
+
+
+def test_private_partial_paths_differ(tmp_path):
+    path = str(tmp_path / "a-100w.webp")
+    first, second = private_partial_path(path), private_partial_path(path)
+    assert first != second
+    assert all(os.path.basename(p).startswith(".a-100w.webp.") for p in (first, second))
@@ -0,0 +1,91 @@
+"""
+Потоковое масштабирование (optimagegen.stream) против масштабирования исходника в памяти.
+"""
+import io
+
+import pytest
+from PIL import Image, ImageChops
+
+from optimagegen import stream
+from optimagegen.resize import SOURCE, plan_resizes, resize_renditions
+
+# Размер исходника: несколько полос по STRIP_HEIGHT строк, последняя неполная
+SOURCE_SIZE = (1000, 700)
+
+# Наибольшее допустимое отклонение канала: RGBA сравнивается в предумноженном виде, где к округлению
+# масштабирования добавляется округление предумножения
+TOLERANCE = {"RGB": 1, "RGBA": 2}
+
+
+def make_source(directory, mode):
+    # Шум поверх градиента: резкие перепады проверяют окна строк на границах полос
+    noise = Image.effect_noise(SOURCE_SIZE, 64)
+    gradient = Image.linear_gradient("L").resize(SOURCE_SIZE)
+    bands = [noise, gradient, ImageChops.add(noise, gradient.rotate(90), scale=2)]
+    if mode == "RGBA":
+        bands.append(gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))
+        path = directory / "source.tif"
+    else:
+        path = directory / "source.ppm"
+    Image.merge(mode, bands).save(path)
+    return path
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+@pytest.mark.parametrize("widths, cascade, reduce_factors", [
+    ([600, 300], False, {1}),
+    ([150], True, {2}),
+])
+def test_stream_matches_in_memory(tmp_path, monkeypatch, mode, widths, cascade, reduce_factors):
+    monkeypatch.setattr(stream, "STREAM_PIXELS", 0)
+    path = make_source(tmp_path, mode)
+    steps = plan_resizes(SOURCE_SIZE, widths, mode, cascade)
+    assert {step.reduce_factor for step in steps if step.base is SOURCE} == reduce_factors
+
+    with stream.open_image(path) as img:
+        strips = stream.stream_reader(img)
+        assert strips is not None
+        streamed = dict(stream.stream_renditions(img, strips, widths, cascade))
+    with Image.open(path) as img:
+        img.load()
+        in_memory = dict(resize_renditions(img, widths, cascade))
+
+    assert streamed.keys() == in_memory.keys()
+    for width, expected in in_memory.items():
+        actual = streamed[width]
+        assert (actual.mode, actual.size) == (expected.mode, expected.size)
+        if mode in stream.PREMULTIPLIED_MODES:
+            expected = expected.convert(stream.PREMULTIPLIED_MODES[mode])
+            actual = actual.convert(stream.PREMULTIPLIED_MODES[mode])
+        diff = ImageChops.difference(expected, actual)
+        assert max(band.getextrema()[1] for band in diff.split()) <= TOLERANCE[mode]
+
+
+def huge_jpeg(path, size):
+    # Маленький JPEG, в заголовке кадра (SOF0) которого записан огромный размер
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16)).save(buffer, "JPEG")
+    data = bytearray(buffer.getvalue())
+    sof = data.index(b"\xff\xc0")
+    data[sof + 5:sof + 9] = size[1].to_bytes(2, "big") + size[0].to_bytes(2, "big")
+    path.write_bytes(bytes(data))
+
+
+@pytest.mark.filterwarnings("ignore::PIL.Image.DecompressionBombWarning")
+def test_open_image_over_limit_keeps_global_limit(tmp_path):
+    ppm = tmp_path / "huge.ppm"
+    ppm.write_bytes(b"P6\n30000 30000\n255\n" + bytes(300))
+    jpeg = tmp_path / "huge.jpg"
+    huge_jpeg(jpeg, (60000, 60000))
+    limit = Image.MAX_IMAGE_PIXELS
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(ppm)
+
+    with stream.open_image(ppm) as img:
+        assert (img.format, img.size) == ("PPM", (30000, 30000))
+        assert stream.stream_reader(img) is not None
+        with pytest.raises(Image.DecompressionBombError):
+            stream.check_decoded_size(img.size)
+    with stream.open_image(jpeg) as img:
+        assert (img.format, img.size) == ("JPEG", (60000, 60000))
+    assert Image.MAX_IMAGE_PIXELS == limit
@@ -0,0 +1,52 @@
+"""
+Режим наблюдения (optimagegen.watch).
+"""
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from optimagegen import watch
+from optimagegen.watch import PollingWatcher, watch_folders
+
+# Наибольшее время ожидания конвертации добавленного файла в секундах
+TIMEOUT = 30
+
+
+def watch_until_converted(root, output_folder, name):
+    # Запускает наблюдение, добавляет файл после первого обхода и ждёт его вариантов
+    outputs = []
+    state = {"dropped": False, "deadline": time.monotonic() + TIMEOUT}
+
+    def should_stop():
+        if not state["dropped"]:
+            Image.new("RGB", (120, 80), (200, 40, 40)).save(os.path.join(root, name))
+            state["dropped"] = True
+        stem = os.path.splitext(name)[0]
+        converted = any(os.path.basename(result.out_path).startswith(stem + "-") for result in outputs)
+        return converted or time.monotonic() > state["deadline"]
+
+    watch_folders([str(root)], [60], ["WEBP"], str(output_folder), on_output=outputs.append, settle=0.2,
+                  should_stop=should_stop)
+    return outputs
+
+
+@pytest.mark.parametrize("polling", [False, True])
+@pytest.mark.parametrize("separate_output", [False, True])
+def test_watch_converts_dropped_file(tmp_path, monkeypatch, polling, separate_output):
+    if polling:
+        monkeypatch.setattr(watch, "create_watcher",
+                            lambda roots, recursive=True, exclude=(): PollingWatcher(roots, recursive, exclude, 0.1))
+    root = tmp_path / "in"
+    root.mkdir()
+    Image.new("RGB", (120, 80), (40, 40, 200)).save(root / "a.png")
+    output_folder = tmp_path / "out" if separate_output else root
+    output_folder.mkdir(exist_ok=True)
+
+    outputs = watch_until_converted(root, output_folder, "b.png")
+
+    converted = {os.path.basename(result.source_path) for result in outputs if result.ok}
+    assert converted == {"a.png", "b.png"}
+    # Варианты, записанные в наблюдаемую папку, исходниками не становятся
+    assert all(os.path.basename(result.source_path) in ("a.png", "b.png") for result in outputs)